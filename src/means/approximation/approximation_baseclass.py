@@ -2,14 +2,17 @@ class ApproximationBaseClass(object):
     """
     A class of explicit generators for ordinary differential equations required to simulate the model provided.
     """
-    def __init__(self, model):
+    def __init__(self, model, cse=False):
         """
         Initialise the approximation.
 
         :param model: Model to approximate
         :type model: :class:`~means.core.model.Model`
+        :param cse: whether the resulting :class:`~means.core.ODEProblem` should eliminate common subexpressions
+                    from its right hand side when it is compiled (see :class:`~means.core.ODEProblem`)
         """
         self.__model = model
+        self.__cse = cse
 
     @property
     def model(self):
@@ -18,6 +21,13 @@ class ApproximationBaseClass(object):
         """
         return self.__model
 
+    @property
+    def cse(self):
+        """
+        Whether the resulting problem eliminates common subexpressions from its right hand side
+        """
+        return self.__cse
+
     def run(self):
         """
         Perform the approximation. Return a constructed :class:`~means.core.ODEProblem` object.
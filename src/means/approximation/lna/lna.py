@@ -6,16 +6,17 @@ from means.approximation.approximation_baseclass import ApproximationBaseClass
 from means.core import Moment, VarianceTerm, ODEProblem
 
 
-def lna_approximation(model):
+def lna_approximation(model, cse=False):
 
     r"""
     A wrapper around :class:`~means.approximation.lna.lna.LinearNoiseApproximation`.
     It performs linear noise approximation (MEA).
 
+    :param cse: whether the resulting problem eliminates common subexpressions (see :class:`~means.core.ODEProblem`)
     :return: an ODE problem which can be further used in inference and simulation.
     :rtype: :class:`~means.core.problems.ODEProblem`
     """
-    lna = LinearNoiseApproximation(model)
+    lna = LinearNoiseApproximation(model, cse=cse)
     return lna.run()
 
 
@@ -105,7 +106,7 @@ class LinearNoiseApproximation(ApproximationBaseClass):
             rhs.append(rhs_redundant[i])
 
 
-        out_problem = ODEProblem("LNA", ode_terms, rhs, sp.Matrix(self.model.parameters))
+        out_problem = ODEProblem("LNA", ode_terms, rhs, sp.Matrix(self.model.parameters), cse=self.cse)
 
 
         return out_problem
@@ -71,7 +71,7 @@ class ClosureBase(object):
         return closed_central_moments
 
 
-    def close(self, mfk, central_from_raw_exprs, n_counter, k_counter):
+    def close(self, mfk, central_from_raw_exprs, n_counter, k_counter, number_of_processes=1):
 
         """
         In MFK, replaces symbol for high order (order == max_order+1) by parametric expressions.
@@ -83,6 +83,7 @@ class ClosureBase(object):
         :type n_counter: list[:class:`~means.core.descriptors.Moment`]
         :param k_counter: a list of :class:`~means.core.descriptors.Moment`\s representing raw moments
         :type k_counter: list[:class:`~means.core.descriptors.Moment`]
+        :param number_of_processes: if set to more than 1, the equations are substituted in parallel
         :return: the modified MFK
         :rtype: `sympy.Matrix`
         """
@@ -100,7 +101,7 @@ class ClosureBase(object):
         positive_n_counter = [n for n in n_counter if n.order > 0]
         substitutions_pairs = [(n.symbol, ccm) for n,ccm in
                                zip(positive_n_counter, closed_central_moments) if n.order > self.max_order]
-        new_mfk = substitute_all(mfk, substitutions_pairs)
+        new_mfk = substitute_all(mfk, substitutions_pairs, number_of_processes)
 
         return new_mfk
 
@@ -3,7 +3,7 @@ import sympy as sp
 from means.approximation.mea.mea_helpers import get_one_over_n_factorial, derive_expr_from_counter_entry
 
 
-def generate_dmu_over_dt(species, propensity, n_counter, stoichiometry_matrix):
+def generate_dmu_over_dt(species, propensity, n_counter, stoichiometry_matrix, derivative_lattice=None):
     r"""
     Calculate :math:`\frac{d\mu_i}{dt}` in eq. 6 (see Ale et al. 2013).
 
@@ -21,13 +21,16 @@ def generate_dmu_over_dt(species, propensity, n_counter, stoichiometry_matrix):
     :type n_counter: list[:class:`~means.core.descriptors.Moment`]
     :param stoichiometry_matrix: the stoichiometry matrix
     :type stoichiometry_matrix: `sympy.Matrix`
+    :param derivative_lattice: the memoised derivatives of the propensities to use, if any
+    :type derivative_lattice: :class:`~means.approximation.mea.mea_helpers.DerivativeLattice`
     :return: a matrix in which each row corresponds to a reaction, and each column to an element of counter.
     """
 
 
     # compute derivatives :math:`\frac{\partial^n \mathbf{n}a_l(\mathbf{x})}{\partial \mathbf{x^n}}`
     # for EACH REACTION and EACH entry in COUNTER
-    derives =[derive_expr_from_counter_entry(reac, species, c.n_vector) for (reac, c) in itertools.product(propensity, n_counter)]
+    derives =[derive_expr_from_counter_entry(reac, species, c.n_vector, derivative_lattice)
+              for (reac, c) in itertools.product(propensity, n_counter)]
     # Computes the factorial terms (:math:`\frac{1}{\mathbf{n!}}`) for EACH REACTION and EACH entry in COUNTER
     # this does not depend of the reaction, so we just repeat the result for each reaction
     factorial_terms = [get_one_over_n_factorial(tuple(c.n_vector)) for c in n_counter] * len(propensity)
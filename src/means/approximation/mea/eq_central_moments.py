@@ -1,9 +1,12 @@
+import multiprocessing
 import sympy as sp
 from means.approximation.mea.eq_mixed_moments import DBetaOverDtCalculator
 from means.approximation.mea.mea_helpers import make_k_chose_e
+from means.util.moment_counters import MomentLattice
 from means.util.sympyhelpers import sum_of_cols, product, sympy_sum_list
 
-def eq_central_moments(n_counter, k_counter, dmu_over_dt, species, propensities, stoichiometry_matrix, max_order):
+def eq_central_moments(n_counter, k_counter, dmu_over_dt, species, propensities, stoichiometry_matrix, max_order,
+                       derivative_lattice=None, number_of_processes=1, rows=None):
     r"""
     Function used to calculate the terms required for use in equations giving the time dependence of central moments.
 
@@ -23,29 +26,88 @@ def eq_central_moments(n_counter, k_counter, dmu_over_dt, species, propensities,
     :param species: species matrix: y_0, y_1,..., y_d
     :param propensities: propensities matrix
     :param stoichiometry_matrix: stoichiometry matrix
+    :param derivative_lattice: the memoised derivatives of the propensities to use, if any
+    :type derivative_lattice: :class:`~means.approximation.mea.mea_helpers.DerivativeLattice`
+    :param number_of_processes: if set to more than 1, the rows are computed in parallel
+    :param rows: the central moments to compute the rows for. By default, all the elements of `n_counter`
+                 of order 1 to `max_order`. If given, `n_counter` only determines the columns, and `dmu_over_dt`
+                 must have the same columns.
     :return: central_moments matrix with `(len(n_counter)-1)` rows and one column per each :math:`[n_1, ... n_d]` combination
     """
-    central_moments = []
-
+    # copy dmu_mat matrix as a list of rows vectors (1/species)
+    dmu_mat = [sp.Matrix(l).T for l in dmu_over_dt.tolist()]
 
     # Loops through required combinations of moments (n1,...,nd)
     # (does not include 0th order central moment as this is 1,
     # or 1st order central moment as this is 0
+    if rows is None:
+        n_rows = [n_iter for n_iter in n_counter if 0 < n_iter.order <= max_order]
+    else:
+        n_rows = rows
+
+    if number_of_processes == 1:
+        calculator = _CentralMomentsCalculator(n_counter, k_counter, dmu_mat, species, propensities,
+                                               stoichiometry_matrix, derivative_lattice)
+        central_moments = [calculator.row(n_iter.n_vector) for n_iter in n_rows]
+    else:
+        # Each process has its own derivative lattice, as they cannot be shared between processes
+        p = multiprocessing.Pool(number_of_processes, initializer=multiprocessing_pool_initialiser,
+                                 initargs=[n_counter, k_counter, dmu_mat, species, propensities,
+                                           stoichiometry_matrix])
+        # higher order rows take longer, so we hand them out one by one
+        try:
+            central_moments = p.map(multiprocessing_apply_row, [tuple(n_iter.n_vector) for n_iter in n_rows],
+                                    chunksize=1)
+            p.close()
+        except:
+            # Do not leave the processes behind if any of the rows failed
+            p.terminate()
+            raise
+        finally:
+            p.join()
+
+    return sp.Matrix(central_moments)
 
-    # copy dmu_mat matrix as a list of rows vectors (1/species)
-    dmu_mat = [sp.Matrix(l).T for l in dmu_over_dt.tolist()]
 
-    d_beta_over_dt_calculator = DBetaOverDtCalculator(propensities,n_counter,stoichiometry_matrix, species)
+def multiprocessing_pool_initialiser(n_counter, k_counter, dmu_mat, species, propensities, stoichiometry_matrix):
+    global central_moments_calculator
+    central_moments_calculator = _CentralMomentsCalculator(n_counter, k_counter, dmu_mat, species, propensities,
+                                                           stoichiometry_matrix)
 
-    for n_iter in n_counter:
-        # skip zeroth moment
-        if n_iter.order == 0 or n_iter.order > max_order:
-            continue
+def multiprocessing_apply_row(n_vector):
+    """
+    Used in `eq_central_moments`.
+    Needs to be in global scope for multiprocessing module to pick it up
+    """
+    return central_moments_calculator.row(n_vector)
 
-        n_vec = n_iter.n_vector
+
+class _CentralMomentsCalculator(object):
+    """
+    Computes the rows of the matrix returned by :func:`eq_central_moments`, one central moment at a time.
+    """
+    def __init__(self, n_counter, k_counter, dmu_mat, species, propensities, stoichiometry_matrix,
+                 derivative_lattice=None):
+        self.__dmu_mat = dmu_mat
+        self.__species = species
+        # index of raw moments, to find the moments lower than a given one without scanning `k_counter`
+        self.__k_lattice = MomentLattice(k_counter)
+        self.__d_beta_over_dt_calculator = DBetaOverDtCalculator(propensities, n_counter, stoichiometry_matrix,
+                                                                 species, derivative_lattice)
+
+    def row(self, n_vec):
+        """
+        Computes the sum of the terms of equation 9 for the central moment `n_vec`.
+
+        :param n_vec: the vector :math:`[n_1, ... n_d]`
+        :return: a row vector with one column per element of `n_counter`
+        """
+        species = self.__species
+        dmu_mat = self.__dmu_mat
+        k_lattice = self.__k_lattice
 
         # Find all moments in k_counter that are lower than the current n_iter
-        k_lower = [k for k in k_counter if n_iter >= k]
+        k_lower = k_lattice.lower_moments(n_vec)
 
         taylor_exp_mat = []
 
@@ -69,9 +131,9 @@ def eq_central_moments(n_counter, k_counter, dmu_over_dt, species, propensities,
                                              in zip(species, n_vec, k_vec, dmu_mat)])
 
             # e_counter contains elements of k_counter lower than the current k_iter
-            e_counter = [k for k in k_counter if k_iter >= k and k.order > 0]
+            e_counter = [k for k in k_lattice.lower_moments(k_iter) if k.order > 0]
 
-            dbeta_over_dt = d_beta_over_dt_calculator.get(k_iter.n_vector, e_counter)
+            dbeta_over_dt = self.__d_beta_over_dt_calculator.get(k_iter.n_vector, e_counter)
 
             # Calculate beta, dbeta_over_dt terms in equation 9
             if len(e_counter) == 0:
@@ -84,6 +146,4 @@ def eq_central_moments(n_counter, k_counter, dmu_over_dt, species, propensities,
         # Taylorexp is a matrix which has an entry equal to
         # the `n_choose_k * minus_one_pow_n_minus_k * (AdB/dt + beta dA/dt)` term in equation 9  for each k1,..,kd
         # These are summed over to give the Taylor Expansion for each n1,..,nd combination in equation 9
-        central_moments.append(sum_of_cols(sp.Matrix(taylor_exp_mat)))
-
-    return sp.Matrix(central_moments)
+        return sum_of_cols(sp.Matrix(taylor_exp_mat))
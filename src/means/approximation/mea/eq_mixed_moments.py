@@ -1,8 +1,8 @@
 import itertools
 import sympy as sp
 from means.approximation.mea.mea_helpers import get_one_over_n_factorial, derive_expr_from_counter_entry, make_k_chose_e
+from means.approximation.mea.mea_helpers import DerivativeLattice
 from means.util.sympyhelpers import sum_of_cols, product
-from means.util.decorators import cache
 
 
 class DBetaOverDtCalculator(object):
@@ -14,19 +14,25 @@ class DBetaOverDtCalculator(object):
        "A general moment expansion method for stochastic kinetic models,"\
        The Journal of Chemical Physics, vol. 138, no. 17, p. 174101, 2013.
     """
-    def __init__(self, propensities, n_counter, stoichoimetry_matrix, species):
+    def __init__(self, propensities, n_counter, stoichoimetry_matrix, species, derivative_lattice=None):
         """
         :param propensities:  the rates/propensities of the reactions
         :param n_counter: a list of :class:`~means.core.descriptors.Moment`\s representing central moments
         :type n_counter: list[:class:`~means.core.descriptors.Moment`]
         :param stoichoimetry_matrix: The stoichiometry matrix. Explicitly provided by the model
         :param species: the names of the variables/species
+        :param derivative_lattice: the memoised derivatives to use. A new one is created if none is given
+        :type derivative_lattice: :class:`~means.approximation.mea.mea_helpers.DerivativeLattice`
 
         """
         self.__propensities = propensities
         self.__n_counter = n_counter
         self.__stoichoimetry_matrix = stoichoimetry_matrix
         self.__species = tuple(species)
+        if derivative_lattice is None:
+            derivative_lattice = DerivativeLattice(species)
+        self.__derivative_lattice = derivative_lattice
+        self.__f_expectations = {}
 
     def get(self, k_vec, e_counter):
         r"""
@@ -90,18 +96,24 @@ class DBetaOverDtCalculator(object):
         # multiply the product by the propensity {a(x)}
         return prod * reaction
 
-    @cache
     def _make_f_expectation(self, expr):
         """
         Calculates :math:`<F>` in eq. 12 (see Ale et al. 2013) to calculate :math:`<F>` for EACH VARIABLE combination.
+        The results are memoised for the lifetime of this calculator.
 
         :param expr: an expression
         :return: a column vector. Each row correspond to an element of counter.
         :rtype: :class:`sympy.Matrix`
         """
+        try:
+            return self.__f_expectations[expr]
+        except KeyError:
+            pass
+
         # compute derivatives for EACH ENTRY in COUNTER
 
-        derives = sp.Matrix([derive_expr_from_counter_entry(expr, self.__species, tuple(c.n_vector))
+        derives = sp.Matrix([derive_expr_from_counter_entry(expr, self.__species, tuple(c.n_vector),
+                                                            self.__derivative_lattice)
                              for c in self.__n_counter])
 
 
@@ -112,6 +124,7 @@ class DBetaOverDtCalculator(object):
         # Element wise product of the two vectors
         te_vector= derives.multiply_elementwise(factorial_terms)
 
+        self.__f_expectations[expr] = te_vector
         return te_vector
 
     def _make_s_pow_e(self, reac_idx, e_vec):
@@ -6,25 +6,82 @@ This part of the package provides a few small utility
 functions for the rest :mod:`~means.approximation.mea`.
 """
 
-import operator
+from collections import OrderedDict
 import sympy as sp
 from means.util.decorators import cache
 from means.util.sympyhelpers import product
 
 
-@cache
-def _cached_diff(expression, var):
-    """
-    Derive expression with respect to a single variable.
+class DerivativeLattice(object):
+    r"""
+    Computes and memoises the partial derivatives of expressions with respect to the species,
+    such as :math:`\frac{\partial^n \mathbf{n}a_l(\mathbf{x})}{\partial \mathbf{x^n}}` in eq. 6.
 
-    :param expression: an expression to derive
-    :type expression: :class:`~sympy.Expr`
-    :param var: a variable
-    :type var: :class:`~sympy.Symbol`
-    :return: the derived expression
-    :type: :class:`~sympy.Expr`
+    The derivatives are built incrementally along the lattice of counter entries.
+    For instance, the derivative for the entry `(1, 1, 0)` is obtained by deriving the memoised derivative
+    for `(1, 0, 0)` with respect to the second species.
+    At most `max_size` derivatives are kept, the least recently used ones are discarded first.
+
+    A lattice is meant to be shared by all the steps of a single approximation, e.g. during one
+    :meth:`~means.approximation.mea.moment_expansion_approximation.MomentExpansionApproximation.run`,
+    so the memoised derivatives do not outlive it.
     """
-    return sp.Derivative(expression, var, evaluate=True)
+
+    DEFAULT_MAX_SIZE = 100000
+
+    def __init__(self, species, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param species: the variables to derive with respect to (typically {y_0, y_1, ..., y_n})
+        :type species: list[:class:`~sympy.Symbol`]
+        :param max_size: the maximal number of derivatives to keep in memory
+        """
+        self.__species = tuple(species)
+        self.__max_size = max_size
+        self.__derivatives = OrderedDict()
+
+    @property
+    def species(self):
+        return self.__species
+
+    def __len__(self):
+        return len(self.__derivatives)
+
+    def derive(self, expression, counter_entry):
+        """
+        Derives `expression` with respect to the species as many times as given by `counter_entry`.
+
+        :param expression: the expression to be derived
+        :type expression: :class:`~sympy.Expr`
+        :param counter_entry: a tuple of integers of length equal to the number of species
+        :return: the derived expression
+        """
+        counter_entry = tuple(counter_entry)
+
+        # no derivation, we return the unchanged expression
+        if sum(counter_entry) == 0:
+            return expression
+
+        key = (expression, counter_entry)
+        try:
+            derivative = self.__derivatives.pop(key)
+        except KeyError:
+            # the entry right below in the lattice: one order lower for the last species we derive with respect to
+            i = max([i for i, c in enumerate(counter_entry) if c > 0])
+            lower_entry = counter_entry[:i] + (counter_entry[i] - 1,) + counter_entry[i+1:]
+            lower_derivative = self.derive(expression, lower_entry)
+
+            # If the lower derivative is a constant, this one is 0
+            if lower_derivative.is_Number:
+                derivative = sp.Integer(0)
+            else:
+                derivative = sp.Derivative(lower_derivative, self.__species[i], evaluate=True)
+
+        # (re)insert the derivative as the most recently used one
+        self.__derivatives[key] = derivative
+        if len(self.__derivatives) > self.__max_size:
+            self.__derivatives.popitem(last=False)
+
+        return derivative
 
 
 @cache
@@ -44,7 +101,7 @@ def get_one_over_n_factorial(counter_entry):
     return sp.Integer(1)/sp.S(prod)
 
 
-def derive_expr_from_counter_entry(expression, species, counter_entry):
+def derive_expr_from_counter_entry(expression, species, counter_entry, derivative_lattice=None):
     r"""
     Derives an given expression with respect to arbitrary species and orders.
     This is used to compute :math:`\frac{\partial^n \mathbf{n}a_l(\mathbf{x})}{\partial \mathbf{x^n}}` in eq. 6
@@ -56,25 +113,15 @@ def derive_expr_from_counter_entry(expression, species, counter_entry):
     :param counter_entry: an entry of counter. That is a tuple of integers of length equal to the number of variables.
     For example, (0,2,1) means we derive with respect to the third variable (first order)
     and to the second variable (second order)
+    :param derivative_lattice: a :class:`DerivativeLattice` for `species` to reuse the derivatives from.
+        If none is given, the derivatives are not memoised.
+    :type derivative_lattice: :class:`DerivativeLattice`
 
     :return: the derived expression
     """
-
-    # no derivation, we return the unchanged expression
-    if sum(counter_entry) == 0:
-        return expression
-
-    # repeat a variable as many time as its value in counter
-    diff_vars = reduce(operator.add, map(lambda v, c: [v] * c, species, counter_entry))
-    out_expr = expression
-
-    for var in diff_vars:
-        # If the derivative is already 0, we can return 0
-        if out_expr.is_Integer:
-            return sp.Integer(0)
-        out_expr = _cached_diff(out_expr, var)
-
-    return out_expr
+    if derivative_lattice is None:
+        derivative_lattice = DerivativeLattice(species)
+    return derivative_lattice.derive(expression, counter_entry)
 
 
 def make_k_chose_e(e_vec, k_vec):
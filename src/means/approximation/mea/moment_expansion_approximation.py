@@ -8,9 +8,10 @@ from means.approximation.approximation_baseclass import ApproximationBaseClass
 from means.util.moment_counters import generate_n_and_k_counters
 
 from dmu_over_dt import generate_dmu_over_dt
+from mea_helpers import DerivativeLattice
 from eq_central_moments import eq_central_moments
 from raw_to_central import raw_to_central
-from means.util.sympyhelpers import substitute_all, quick_solve
+from means.util.sympyhelpers import cached_xreplace, quick_solve, resolve_substitutions
 
 
 from closure_gamma import GammaClosure
@@ -24,8 +25,10 @@ def mea_approximation(model, max_order, closure='scalar', *closure_args, **closu
     A wrapper around :class:`~means.approximation.mea.moment_expansion_approximation.MomentExpansionApproximation`.
     It performs moment expansion approximation (MEA) up to a given order of moment.
     See :class:`~means.approximation.mea.moment_expansion_approximation.MomentExpansionApproximation` for details
-    about the options.
+    about the options. For instance, the equations can be generated in parallel with::
 
+        >>> from means.examples.sample_models import MODEL_P53
+        >>> problem = mea_approximation(MODEL_P53, 3, number_of_processes=4)
 
     :return: an ODE problem which can be further used in inference and simulation.
     :rtype: :class:`~means.core.problems.ODEProblem`
@@ -66,15 +69,33 @@ class MomentExpansionApproximation(ApproximationBaseClass):
 
         :type closure: string
         :param closure_args: arguments to be passed to the closure
-        :param closure_kwargs: keyword arguments to be passed to the closure
+        :param closure_kwargs: keyword arguments to be passed to the closure,
+            except for `number_of_processes`, which is the number of processes to generate the equations with.
+            If set to more than 1, the equations for each of the moments are generated in parallel.
+            `cse` is not passed to the closure either,
+            it is whether the resulting problem eliminates common subexpressions (see :class:`~means.core.ODEProblem`)
         """
-        super(MomentExpansionApproximation, self).__init__(model)
+        super(MomentExpansionApproximation, self).__init__(model, cse=closure_kwargs.pop('cse', False))
+
+        self.__number_of_processes = int(closure_kwargs.pop('number_of_processes', 1))
+        if self.__number_of_processes < 1:
+            raise ValueError("`number_of_processes` can only be POSITIVE, {0!r} given".format(
+                self.__number_of_processes))
 
         max_order = int(max_order)
         if max_order < 1:
             raise ValueError("`max_order` can only be POSITIVE, {0!r} given".format(max_order))
 
         self.__max_order = max_order
+        # the intermediate results for the highest order computed so far, see `_extend_to_order()`
+        self.__computed_order = 0
+        self.__derivative_lattice = None
+        self.__n_counter = []
+        self.__k_counter = []
+        self.__dmu_over_dt = None
+        self.__central_moments_exprs = None
+        self.__central_from_raw_exprs = None
+        self.__raw_in_terms_of_central = {}
 
         # A dictionary of "option -> closure". this allows a generic handling for closure without having to add
         # if-else and exceptions when implementing new closures. One only needs to add the new closure class to the dict
@@ -88,6 +109,10 @@ class MomentExpansionApproximation(ApproximationBaseClass):
             # our closure is an instance of the class queried in the dictionary
             ClosureClass = supported_closures[closure]
             self.__closure = ClosureClass(self.__max_order, *closure_args, **closure_kwargs)
+            # keep the arguments, so we can make the closure for other orders
+            self.__closure_class = ClosureClass
+            self.__closure_args = closure_args
+            self.__closure_kwargs = closure_kwargs
         except KeyError:
             error_str = "The closure type '{0}' is not supported.\n\
                          Supported values for closure:\
@@ -98,39 +123,137 @@ class MomentExpansionApproximation(ApproximationBaseClass):
     def closure(self):
         return self.__closure
 
-    def run(self):
+    @property
+    def number_of_processes(self):
+        return self.__number_of_processes
+
+    def run(self, max_order=None):
         r"""
         Overrides the default run() method.
         Performs the complete analysis on the model specified during initialisation.
 
+        The intermediate results are kept, so that running the approximation again for a higher order only
+        computes the terms for the new moments, and running it for a lower order does not compute anything new,
+        but the closure. Therefore, sweeping over orders costs about the same as the highest order alone:
+
+            >>> from means.examples.sample_models import MODEL_P53
+            >>> mea = MomentExpansionApproximation(MODEL_P53, 2)
+            >>> problems = [mea.run(max_order=order) for order in [2, 3, 4]]
+
+        :param max_order: the highest order of central moments in the resulting ODEs.
+                          Defaults to the `max_order` the approximation was initialised with.
         :return: an ODE problem which can be further used in inference and simulation.
         :rtype: :class:`~means.core.problems.ODEProblem`
         """
-        max_order = self.__max_order
-        stoichiometry_matrix = self.model.stoichiometry_matrix
-        propensities = self.model.propensities
-        species = self.model.species
+        if max_order is None:
+            max_order = self.__max_order
+            closure = self.closure
+        else:
+            max_order = int(max_order)
+            if max_order < 1:
+                raise ValueError("`max_order` can only be POSITIVE, {0!r} given".format(max_order))
+            closure = self.__closure_class(max_order, *self.__closure_args, **self.__closure_kwargs)
+
+        self._extend_to_order(max_order)
+
         # compute n_counter and k_counter; the "n" and "k" vectors in equations, respectively.
-        n_counter, k_counter = generate_n_and_k_counters(max_order, species)
+        # These are the first elements of the counters of the highest order computed so far
+        n_counter, k_counter = generate_n_and_k_counters(max_order, self.model.species)
+        number_of_rows = len([n for n in n_counter if 0 < n.order <= max_order])
+
         # dmu_over_dt has row per species and one col per element of n_counter (eq. 6)
-        dmu_over_dt = generate_dmu_over_dt(species, propensities, n_counter, stoichiometry_matrix)
-        # Calculate expressions to use in central moments equations (eq. 9)
-        central_moments_exprs = eq_central_moments(n_counter, k_counter, dmu_over_dt, species, propensities, stoichiometry_matrix, max_order)
+        dmu_over_dt = self.__dmu_over_dt[:, :len(n_counter)]
+        # Expressions of the central moments equations (eq. 9), where raw moments are substituted with expressions
+        # depending only on central moments
+        central_moments_exprs = self.__central_moments_exprs[:number_of_rows, :len(n_counter)]
         # Expresses central moments in terms of raw moments (and central moments) (eq. 8)
-        central_from_raw_exprs = raw_to_central(n_counter, species, k_counter)
-        # Substitute raw moment, in central_moments, with expressions depending only on central moments
-        central_moments_exprs = self._substitute_raw_with_central(central_moments_exprs, central_from_raw_exprs, n_counter, k_counter)
+        central_from_raw_exprs = self.__central_from_raw_exprs[:len(n_counter) - 1, :]
+
         # Get final right hand side expressions for each moment in a vector
         mfk = self._generate_mass_fluctuation_kinetics(central_moments_exprs, dmu_over_dt, n_counter)
         # Applies moment expansion closure, that is replaces last order central moments by parametric expressions
-        mfk = self.closure.close(mfk, central_from_raw_exprs, n_counter, k_counter)
+        mfk = closure.close(mfk, central_from_raw_exprs, n_counter, k_counter, self.__number_of_processes)
         # These are the left hand sign symbols referring to the mfk
-        prob_lhs = self._generate_problem_left_hand_side(n_counter, k_counter)
+        prob_lhs = self._generate_problem_left_hand_side(n_counter, k_counter, max_order)
         # Finally, we build the problem
-        out_problem = ODEProblem("MEA", prob_lhs, mfk, sp.Matrix(self.model.parameters))
+        out_problem = ODEProblem("MEA", prob_lhs, mfk, sp.Matrix(self.model.parameters), cse=self.cse)
         return out_problem
 
-    def _generate_problem_left_hand_side(self, n_counter, k_counter):
+    def _extend_to_order(self, max_order):
+        """
+        Computes the intermediate results (`dmu_over_dt`, the central moments equations
+        and the expressions of central moments in terms of raw moments) up to `max_order`.
+        Only the terms involving the moments that were not computed before are computed.
+
+        :param max_order: the highest order of central moments in the resulting ODEs
+        """
+        old_order = self.__computed_order
+        if max_order <= old_order:
+            return
+
+        number_of_processes = self.__number_of_processes
+        stoichiometry_matrix = self.model.stoichiometry_matrix
+        propensities = self.model.propensities
+        species = self.model.species
+        # the derivatives of the propensities are memoised and shared between all the orders
+        if self.__derivative_lattice is None:
+            self.__derivative_lattice = DerivativeLattice(species)
+        derivative_lattice = self.__derivative_lattice
+
+        old_n_counter, old_k_counter = self.__n_counter, self.__k_counter
+        # compute n_counter and k_counter; the "n" and "k" vectors in equations, respectively.
+        # The old counters are the first elements of the new ones
+        n_counter, k_counter = generate_n_and_k_counters(max_order, species)
+        new_n_counter = n_counter[len(old_n_counter):]
+        new_k_counter = k_counter[len(old_k_counter):]
+
+        # the new columns of dmu_over_dt (eq. 6), for the new elements of n_counter
+        new_dmu_over_dt = generate_dmu_over_dt(species, propensities, new_n_counter, stoichiometry_matrix,
+                                               derivative_lattice)
+
+        # Expresses the new central moments in terms of raw moments (and central moments) (eq. 8)
+        new_central_from_raw_exprs = raw_to_central(new_n_counter, species, k_counter)
+        # And the new raw moments in terms of central moments only
+        raw_in_terms_of_central = self.__raw_in_terms_of_central
+        raw_in_terms_of_central.update(self._raw_in_terms_of_central(new_central_from_raw_exprs, new_n_counter,
+                                                                     new_k_counter, raw_in_terms_of_central))
+
+        # Calculate expressions to use in central moments equations (eq. 9), for the new central moments ...
+        new_rows = [n for n in n_counter if old_order < n.order <= max_order]
+        if old_order == 0:
+            dmu_over_dt = new_dmu_over_dt
+        else:
+            dmu_over_dt = self.__dmu_over_dt.row_join(new_dmu_over_dt)
+        central_moments_exprs = eq_central_moments(n_counter, k_counter, dmu_over_dt, species, propensities,
+                                                   stoichiometry_matrix, max_order, derivative_lattice,
+                                                   number_of_processes, rows=new_rows)
+        # Substitute raw moment, in central_moments, with expressions depending only on central moments.
+        # The replaced sub-expressions are shared between all of the elements of the equations
+        substitution_cache = {}
+        central_moments_exprs = cached_xreplace(central_moments_exprs, raw_in_terms_of_central, substitution_cache)
+
+        # ... and the new columns of the equations for the old central moments, if any
+        old_rows = [n for n in old_n_counter if 0 < n.order <= old_order]
+        if old_rows:
+            new_columns = eq_central_moments(new_n_counter, k_counter, new_dmu_over_dt, species, propensities,
+                                             stoichiometry_matrix, max_order, derivative_lattice,
+                                             number_of_processes, rows=old_rows)
+            new_columns = cached_xreplace(new_columns, raw_in_terms_of_central, substitution_cache)
+            central_moments_exprs = self.__central_moments_exprs.row_join(new_columns).col_join(
+                central_moments_exprs)
+
+        if old_order == 0:
+            central_from_raw_exprs = new_central_from_raw_exprs
+        else:
+            central_from_raw_exprs = self.__central_from_raw_exprs.col_join(new_central_from_raw_exprs)
+
+        self.__n_counter, self.__k_counter = n_counter, k_counter
+        self.__dmu_over_dt = dmu_over_dt
+        self.__central_moments_exprs = central_moments_exprs
+        self.__central_from_raw_exprs = central_from_raw_exprs
+        self.__computed_order = max_order
+
+    def _generate_problem_left_hand_side(self, n_counter, k_counter, max_order):
         """
         Generate the left hand side of the ODEs. This is simply the
         symbols for the corresponding moments.
@@ -141,6 +264,7 @@ class MomentExpansionApproximation(ApproximationBaseClass):
         :type n_counter: list[:class:`~means.core.descriptors.Moment`]
         :param k_counter: a list of :class:`~means.core.descriptors.Moment`\s representing raw moments
         :type k_counter: list[:class:`~means.core.descriptors.Moment`]
+        :param max_order: the highest order of central moments in the ODEs
         :return: a list of the problem left hand sides
         :rtype: list[:class:`sympy.Symbol`]
         """
@@ -148,7 +272,7 @@ class MomentExpansionApproximation(ApproximationBaseClass):
         # concatenate the symbols for first order raw moments (means)
         prob_moments_over_dt = [k for k in k_counter if k.order == 1]
         # and the higher order central moments (variances, covariances,...)
-        prob_moments_over_dt += [n for n in n_counter if self.__max_order >= n.order > 1]
+        prob_moments_over_dt += [n for n in n_counter if max_order >= n.order > 1]
 
 
         return prob_moments_over_dt
@@ -191,6 +315,29 @@ class MomentExpansionApproximation(ApproximationBaseClass):
 
         :return: expressions for central moments without raw moment
         """
+        # we build substitution pairs to replace all raw moments
+        substitution_pairs = self._raw_in_terms_of_central(central_from_raw_exprs, n_counter, k_counter)
+
+        # apply this substitution to all elements of the central moment expressions matrix
+        out_exprs = cached_xreplace(central_moments_exprs, substitution_pairs)
+
+        return out_exprs
+
+    def _raw_in_terms_of_central(self, central_from_raw_exprs, n_counter, k_counter, known_raw_moments=None):
+        r"""
+        Expresses the raw moments (of order higher than one) in terms of central moments and means only.
+
+        :param central_from_raw_exprs: central moment expressed in terms of raw moments
+        :param n_counter: a list of :class:`~means.core.descriptors.Moment`\s representing central moments
+        :type n_counter: list[:class:`~means.core.descriptors.Moment`]
+        :param k_counter: a list of :class:`~means.core.descriptors.Moment`\s representing raw moments
+        :type k_counter: list[:class:`~means.core.descriptors.Moment`]
+        :param known_raw_moments: the expressions of lower order raw moments, that are not in `k_counter`,
+                                  in terms of central moments, if any
+        :type known_raw_moments: dict
+        :return: a dictionary {raw moment symbol: expression in terms of central moments}
+        :rtype: dict
+        """
         positiv_raw_moms_symbs = [raw.symbol for raw in k_counter if raw.order > 1]
         # The symbols for the corresponding central moment
         central_symbols= [central.symbol for central in n_counter if central.order > 1]
@@ -199,23 +346,13 @@ class MomentExpansionApproximation(ApproximationBaseClass):
 
         # And we solve this for the symbol of the corresponding raw moment. This gives an expression
         # of the symbol for raw moment in terms of central moments and lower order raw moment
-        solved_xs = sp.Matrix([quick_solve(eq,raw) for (eq, raw) in zip(eq_to_solve, positiv_raw_moms_symbs)])
+        solved_xs = [quick_solve(eq,raw) for (eq, raw) in zip(eq_to_solve, positiv_raw_moms_symbs)]
+        if known_raw_moments:
+            cache = {}
+            solved_xs = [cached_xreplace(x, known_raw_moments, cache) for x in solved_xs]
 
         # now we want to express raw moments only in terms od central moments and means
         # for instance if we have: :math:`x_1 = 1; x_2 = 2 +x_1 and  x_3 = x_2*x_1`, we should give:
         # :math:`x_1 = 1; x_2 = 2+1 and  x_3 = 1*(2+1)`
-        # To achieve this, we recursively apply substitution as many times as the highest order (minus one)
-        max_order = max([p.order for p in k_counter])
-
-        for i in range(max_order - 1):
-            substitution_pairs = zip(positiv_raw_moms_symbs, solved_xs)
-            solved_xs = substitute_all(solved_xs, substitution_pairs)
-
-        # we finally build substitution pairs to replace all raw moments
-        substitution_pairs = zip(positiv_raw_moms_symbs, solved_xs)
-
-        # apply this substitution to all elements of the central moment expressions matrix
-        out_exprs = substitute_all(central_moments_exprs, substitution_pairs)
-
-        return out_exprs
-
+        # The raw moments are resolved in order of their dependencies, each of them exactly once
+        return resolve_substitutions(zip(positiv_raw_moms_symbs, solved_xs))
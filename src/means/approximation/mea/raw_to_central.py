@@ -1,6 +1,7 @@
 import operator
 import sympy as sp
 from means.approximation.mea.mea_helpers import make_k_chose_e
+from means.util.moment_counters import MomentLattice
 
 
 def _make_alpha(n_vec, k_vec, ymat):
@@ -37,6 +38,8 @@ def raw_to_central(n_counter, species, k_counter):
     """
     # create empty output
     central_in_terms_of_raw = []
+    # index of raw moments, to find the moments lower than a given one without scanning `k_counter`
+    k_lattice = MomentLattice(k_counter)
     # This loop loops through the ::math::`[n_1, ..., n_d]` vectors of the sums in the beginning of the equation
     # i.e. :math:`\sum_{k1=0}^n_1 ... \sum_{kd=0}^n_d` part of the equation.
     # Note, this is not the sum over k's in that equation, or at least I think its not
@@ -49,7 +52,7 @@ def raw_to_central(n_counter, species, k_counter):
         # k_lower contains the elements of `k_counter` that are lower than or equal to the current n_vec
         # This generates the list of possible k values to satisfy ns in the equation.
         # `k_vec` iterators bellow are the vector ::math::`[k_1, ..., k_d]`
-        k_lower = [k for k in k_counter if n_iter >= k]
+        k_lower = k_lattice.lower_moments(n_iter)
         # (n k) binomial term in equation 9
         n_choose_k_vec = [make_k_chose_e(k_vec.n_vector, n_vec) for k_vec in k_lower]
         # (-1)^(n-k) term in equation 9
@@ -0,0 +1,19 @@
+"""
+Benchmarks
+----
+
+This part of the package provides a benchmark suite for the symbolic approximation pipeline.
+It measures, for each combination of model, approximation method, order and closure,
+the wall time of each stage of the approximation, the peak memory used,
+the size of the resulting equations and the time it takes to compile them.
+
+The benchmarks are run over the models in :mod:`means.examples.sample_models`
+and over synthetic mass-action networks of increasing size (see :func:`~means.benchmarks.models.mass_action_network`).
+The results are written as JSON, so they can be compared between releases::
+
+    $ python -m means.benchmarks --output benchmarks.json
+
+"""
+
+from models import mass_action_network
+from approximation import benchmark_case, default_cases, run_benchmarks
@@ -0,0 +1,3 @@
+from means.benchmarks.approximation import main
+
+main()
@@ -0,0 +1,258 @@
+"""
+Approximation Benchmarks
+----
+
+This part of the package times the stages of :class:`~means.approximation.mea.MomentExpansionApproximation`
+and :class:`~means.approximation.lna.LinearNoiseApproximation`, and the compilation of the resulting equations.
+
+Each benchmark case is a dictionary describing the model and the approximation, e.g.::
+
+    {'model': 'p53', 'method': 'MEA', 'max_order': 3, 'closure': 'normal'}
+
+Synthetic models are named `'mass-action-N'` where `N` is the number of species,
+see :func:`~means.benchmarks.models.mass_action_network`.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+import sympy as sp
+
+from means.approximation.lna.lna import LinearNoiseApproximation
+from means.approximation.mea.moment_expansion_approximation import MomentExpansionApproximation
+from means.benchmarks.models import mass_action_network
+from means.examples import sample_models
+from means.util import codegen
+
+SAMPLE_MODELS = OrderedDict([('dimerisation', sample_models.MODEL_DIMERISATION),
+                             ('michaelis-menten', sample_models.MODEL_MICHAELIS_MENTEN),
+                             ('lotka-volterra', sample_models.MODEL_LOTKA_VOLTERRA),
+                             ('p53', sample_models.MODEL_P53),
+                             ('hes1', sample_models.MODEL_HES1)])
+
+CLOSURES = ['scalar', 'normal', 'log-normal', 'gamma']
+
+_SYNTHETIC_MODEL_PREFIX = 'mass-action-'
+
+
+def get_model(name):
+    """
+    Returns the model for a benchmark case: either one of the :data:`SAMPLE_MODELS`,
+    or a synthetic network named `'mass-action-N'`, with `N` species.
+    """
+    if name.startswith(_SYNTHETIC_MODEL_PREFIX):
+        return mass_action_network(int(name[len(_SYNTHETIC_MODEL_PREFIX):]))
+    try:
+        return SAMPLE_MODELS[name]
+    except KeyError:
+        raise KeyError('Unknown model {0!r}. Use one of {1!r} or {2!r}'.format(name, SAMPLE_MODELS.keys(),
+                                                                            _SYNTHETIC_MODEL_PREFIX + 'N'))
+
+
+def default_cases(max_order=3, max_species=5, closures=CLOSURES):
+    """
+    The cases benchmarked by default: LNA and MEA for all the closures up to `max_order`, for each of
+    the sample models and for synthetic mass-action networks of 1 to `max_species` species.
+
+    :return: a list of benchmark cases
+    :rtype: list[dict]
+    """
+    models = SAMPLE_MODELS.keys() + ['{0}{1}'.format(_SYNTHETIC_MODEL_PREFIX, n) for n in range(1, max_species + 1)]
+
+    cases = []
+    for model in models:
+        cases.append({'model': model, 'method': 'LNA'})
+        for order in range(1, max_order + 1):
+            for closure in closures:
+                # Only the scalar closure can be used for the first order
+                if order == 1 and closure != 'scalar':
+                    continue
+                cases.append({'model': model, 'method': 'MEA', 'max_order': order, 'closure': closure})
+    return cases
+
+
+class _StageTimer(object):
+    """
+    Records the wall time of each stage of a computation, in order.
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def time(self, name, function, *args, **kwargs):
+        start = time.time()
+        result = function(*args, **kwargs)
+        self.stages[name] = time.time() - start
+        return result
+
+
+def _run_mea(model, max_order, closure, timer):
+    """
+    Runs :meth:`~means.approximation.mea.MomentExpansionApproximation.run`, timing the computation of
+    the equations of the moments (`moment_equations`) separately from the rest of the run, that is the mass
+    fluctuation kinetics and the closure (`closure`).
+    As the approximation keeps its intermediate results, `run()` does not compute the equations of the moments again.
+    """
+    mea = MomentExpansionApproximation(model, max_order, closure=closure)
+    timer.time('moment_equations', mea._extend_to_order, max_order)
+    return timer.time('closure', mea.run, max_order=max_order)
+
+
+def _run_lna(model, timer):
+    return timer.time('approximation', LinearNoiseApproximation(model).run)
+
+
+def benchmark_case(case, compile_equations=True):
+    """
+    Benchmarks a single case in the current process.
+
+    The result contains the wall time of each stage of the approximation (`stages`, in seconds),
+    their total (`approximation_time`), the number of equations and of operations
+    (see :func:`~means.util.codegen.count_operations`) in their right hand sides, the time it took to compile
+    the right hand side (`compile_time`, the cache of compiled code is not used) and the peak resident memory
+    of the process (`peak_rss_kb`, in kilobytes, as reported by :func:`resource.getrusage`).
+    If the approximation fails, `error` describes the exception.
+
+    :param case: the benchmark case, see :func:`default_cases`
+    :type case: dict
+    :param compile_equations: whether to compile the right hand side of the equations
+    :return: the result of the benchmark
+    :rtype: dict
+    """
+    result = OrderedDict(sorted(case.items()))
+    timer = _StageTimer()
+    try:
+        model = get_model(case['model'])
+        result['number_of_species'] = len(model.species)
+        result['number_of_reactions'] = len(model.propensities)
+
+        if case['method'] == 'MEA':
+            problem = _run_mea(model, case['max_order'], case.get('closure', 'scalar'), timer)
+        elif case['method'] == 'LNA':
+            problem = _run_lna(model, timer)
+        else:
+            raise ValueError('Unknown method {0!r}'.format(case['method']))
+
+        result['stages'] = timer.stages
+        result['approximation_time'] = sum(timer.stages.values())
+        result['number_of_equations'] = problem.number_of_equations
+        result['operations'] = codegen.count_operations(problem.right_hand_side)
+
+        if compile_equations:
+            result['compile_time'] = _compile_time(problem)
+
+        result['error'] = None
+    except Exception as e:
+        result['stages'] = timer.stages
+        result['error'] = '{0}: {1!s}'.format(e.__class__.__name__, e)
+
+    result['peak_rss_kb'] = _peak_rss_kb()
+    return result
+
+
+def _peak_rss_kb():
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # It is reported in bytes on OS X, and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        peak_rss //= 1024
+    return peak_rss
+
+
+def _compile_time(problem):
+    # Make sure the code is actually compiled rather than loaded from the cache
+    environment = os.environ.copy()
+    os.environ[codegen.CACHE_DIRECTORY_ENVIRONMENT_VARIABLE] = ''
+    codegen._loaded_functions.clear()
+    try:
+        start = time.time()
+        problem.right_hand_side_as_function
+        return time.time() - start
+    finally:
+        os.environ.clear()
+        os.environ.update(environment)
+
+
+def _benchmark_case_in_process(args):
+    """
+    Used in `run_benchmarks`.
+    Needs to be in global scope for multiprocessing module to pick it up
+    """
+    case, compile_equations = args
+    return benchmark_case(case, compile_equations)
+
+
+def run_benchmarks(cases=None, output=None, compile_equations=True, verbose=False):
+    """
+    Runs the benchmark `cases`, each of them in a new process, so that the peak memory
+    of each of them is measured independently.
+
+    :param cases: the cases to run, see :func:`default_cases`. Defaults to all of the default cases
+    :param output: a file name or file object to write the results to, as JSON
+    :param compile_equations: whether to compile the right hand side of the equations
+    :param verbose: whether to print a line for each case as it is run
+    :return: the results, with information about the environment they were obtained in
+    :rtype: dict
+    """
+    if cases is None:
+        cases = default_cases()
+
+    results = []
+    # A new process for each case
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    try:
+        for case in cases:
+            result = pool.apply(_benchmark_case_in_process, [(case, compile_equations)])
+            if verbose:
+                print '{0}: {1:.3f}s, {2} operations{3}'.format(
+                    ', '.join(['{0}={1}'.format(k, v) for k, v in sorted(case.items())]),
+                    result.get('approximation_time', float('nan')), result.get('operations'),
+                    '' if result['error'] is None else ' ({0})'.format(result['error']))
+            results.append(result)
+    finally:
+        pool.close()
+        pool.join()
+
+    report = OrderedDict([('python', sys.version),
+                          ('platform', platform.platform()),
+                          ('sympy', sp.__version__),
+                          ('numpy', np.__version__),
+                          ('date', time.strftime('%Y-%m-%dT%H:%M:%S')),
+                          ('results', results)])
+
+    if output is not None:
+        if isinstance(output, basestring):
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            json.dump(report, output, indent=2)
+
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the approximations of MEANS.')
+    parser.add_argument('-o', '--output', default='means_benchmarks.json',
+                        help='the file to write the results to (default: %(default)s)')
+    parser.add_argument('--max-order', type=int, default=3,
+                        help='the highest order of moments for MEA (default: %(default)s)')
+    parser.add_argument('--max-species', type=int, default=5,
+                        help='the largest number of species in the synthetic networks (default: %(default)s)')
+    parser.add_argument('--closure', action='append', choices=CLOSURES,
+                        help='the closures to benchmark, can be given several times (default: all of them)')
+    parser.add_argument('--model', action='append',
+                        help='only benchmark these models, can be given several times (default: all of them)')
+    parser.add_argument('--no-compile', action='store_true', help='do not compile the equations')
+    args = parser.parse_args(argv)
+
+    cases = default_cases(args.max_order, args.max_species, args.closure or CLOSURES)
+    if args.model:
+        cases = [case for case in cases if case['model'] in args.model]
+
+    run_benchmarks(cases, args.output, compile_equations=not args.no_compile, verbose=True)
@@ -0,0 +1,62 @@
+"""
+Synthetic Models
+----
+
+This part of the package generates synthetic mass-action reaction networks of arbitrary size for benchmarking.
+"""
+
+import numpy as np
+
+from means.core import Model
+
+
+def mass_action_network(number_of_species, number_of_reactions=None, seed=0):
+    """
+    Generates a random mass-action network with `number_of_species` species.
+
+    Every species is produced and degraded (e.g. :math:`\\emptyset \\rightarrow X_i` and
+    :math:`X_i \\rightarrow \\emptyset`), so that all moments are coupled to the reactions.
+    The remaining reactions are conversions (:math:`X_i \\rightarrow X_j`) and
+    bimolecular reactions (:math:`X_i + X_j \\rightarrow X_k`) between randomly chosen species.
+    Each reaction has its own rate constant.
+
+    :param number_of_species: the number of species in the network
+    :param number_of_reactions: the number of reactions in addition to production and degradation.
+                                Defaults to `number_of_species`
+    :param seed: the seed of the random number generator, the same seed always gives the same network
+    :return: the network
+    :rtype: :class:`~means.core.model.Model`
+    """
+    if number_of_species < 1:
+        raise ValueError('`number_of_species` can only be POSITIVE, {0!r} given'.format(number_of_species))
+    if number_of_reactions is None:
+        number_of_reactions = number_of_species
+
+    rng = np.random.RandomState(seed)
+    species = ['y_{0}'.format(i) for i in range(number_of_species)]
+
+    # each reaction as a pair of (reactants, products), given as lists of species indices
+    reactions = []
+    for i in range(number_of_species):
+        reactions.append(([], [i]))
+        reactions.append(([i], []))
+    for _ in range(number_of_reactions):
+        if number_of_species > 1 and rng.rand() < 0.5:
+            i, j = rng.choice(number_of_species, 2, replace=False)
+            reactions.append(([i], [j]))
+        else:
+            i, j, k = rng.randint(number_of_species, size=3)
+            reactions.append(([i, j], [k]))
+
+    parameters = ['c_{0}'.format(r) for r in range(len(reactions))]
+    propensities = []
+    stoichiometry_matrix = np.zeros((number_of_species, len(reactions)), dtype=int)
+    for r, (reactants, products) in enumerate(reactions):
+        propensities.append('*'.join([parameters[r]] + [species[i] for i in reactants]))
+        for i in reactants:
+            stoichiometry_matrix[i, r] -= 1
+        for i in products:
+            stoichiometry_matrix[i, r] += 1
+
+    return Model(species=species, parameters=parameters, propensities=propensities,
+                 stoichiometry_matrix=stoichiometry_matrix.tolist())
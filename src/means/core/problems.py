@@ -23,16 +23,31 @@ and can be simply built from  a :class:`~means.core.model.Model`:
 
 import sympy
 import numpy as np
-from sympy.utilities.autowrap import autowrap
 
 from means.core.model import Model
 from means.core.descriptors import Moment
 from means.io.latex import LatexPrintableObject
 from means.io.serialise import SerialisableObject
+from means.util.codegen import compile_expressions, to_double_array
+from means.util.codegen import count_operations, eliminate_common_subexpressions
+from means.util.logs import get_logger
 from means.util.memoisation import memoised_property, MemoisableObject
 from means.util.sympyhelpers import to_list_of_symbols, to_sympy_column_matrix, to_sympy_matrix
 from means.util.sympyhelpers import sympy_expressions_equal
 
+logger = get_logger(__name__)
+
+def _nonzero_positions(matrix):
+    """
+    The positions of the non-zero entries in `matrix` as a pair of arrays (rows, columns).
+    The entries are listed column by column, which is the order of the data in
+    :class:`scipy.sparse.csc_matrix`.
+    """
+    positions = [(row, column) for column in range(matrix.cols) for row in range(matrix.rows)
+                 if matrix[row, column] != 0]
+    rows = np.array([row for row, _ in positions], dtype=int)
+    columns = np.array([column for _, column in positions], dtype=int)
+    return rows, columns
 
 class ODEProblem(SerialisableObject, LatexPrintableObject, MemoisableObject):
     """
@@ -49,7 +64,7 @@ class ODEProblem(SerialisableObject, LatexPrintableObject, MemoisableObject):
 
     yaml_tag = '!problem'
 
-    def __init__(self, method, left_hand_side_descriptors, right_hand_side, parameters):
+    def __init__(self, method, left_hand_side_descriptors, right_hand_side, parameters, cse=False):
         """
         :param method: a string describing the method used to generate the problem.
         Currently, 'MEA' and 'LNA' are supported"
@@ -57,6 +72,11 @@ class ODEProblem(SerialisableObject, LatexPrintableObject, MemoisableObject):
             :class:`~means.core.descriptors.Descriptor` objects (such as :class:`~means.core.descriptors.Moment`)
         :param right_hand_side: the right hand side of equations
         :param parameters: the parameters of the model
+        :param cse: whether to eliminate common subexpressions (see :func:`sympy.cse`) from the right hand side
+            and its Jacobian before compiling them. This takes some time upfront, but results in smaller code
+            that compiles and evaluates faster for large problems, e.g. the ones obtained with
+            :class:`~means.approximation.mea.closure_log_normal.LogNormalClosure`.
+            See :attr:`common_subexpression_report`.
         """
 
         self.__left_hand_side_descriptors = left_hand_side_descriptors
@@ -66,6 +86,7 @@ class ODEProblem(SerialisableObject, LatexPrintableObject, MemoisableObject):
         self.__right_hand_side = to_sympy_column_matrix(right_hand_side)
         self.__parameters = to_list_of_symbols(parameters)
         self.__method = method
+        self.__cse = cse
 
     def validate(self):
         """
@@ -113,6 +134,10 @@ class ODEProblem(SerialisableObject, LatexPrintableObject, MemoisableObject):
     def method(self):
         return self.__method
 
+    @property
+    def cse(self):
+        return self.__cse
+
     @memoised_property
     def _descriptions_dict(self):
         return {ode_term.symbol: ode_term for ode_term in self.left_hand_side_descriptors}
@@ -121,11 +146,34 @@ class ODEProblem(SerialisableObject, LatexPrintableObject, MemoisableObject):
     def number_of_equations(self):
         return len(self.left_hand_side)
 
+    def _compile(self, expressions, temporaries=(), batched=False):
+        # Compiled functions are called as `f(values_for_constants, values_for_variables, out)`
+        return compile_expressions(expressions, [self.parameters, self.variables], temporaries, batched)
+
+    @memoised_property
+    def _right_hand_side_common_subexpressions(self):
+        return eliminate_common_subexpressions(self.right_hand_side)
+
+    @memoised_property
+    def common_subexpression_report(self):
+        """
+        Reports how much the common subexpression elimination reduces the size of the right hand side,
+        as a dictionary with the number of operations (see :func:`sympy.count_ops`) before and after
+        the elimination, and the number of temporaries it introduced.
+        """
+        temporaries, reduced_right_hand_side = self._right_hand_side_common_subexpressions
+        return {'operations_before': count_operations(self.right_hand_side),
+                'operations_after': count_operations(reduced_right_hand_side, temporaries),
+                'temporaries': len(temporaries)}
+
     @memoised_property
-    def _right_hand_side_as_numeric_functions(self):
-        all_symbols = self.parameters + self.variables
-        wrapping_func = lambda x: autowrap(x, args=all_symbols, language='C', backend='Cython')
-        return map(wrapping_func, self.right_hand_side)
+    def _right_hand_side_as_numeric_function(self):
+        # A single compiled function evaluating all the equations at once
+        if self.cse:
+            temporaries, reduced_right_hand_side = self._right_hand_side_common_subexpressions
+            logger.debug('Common subexpression elimination: {0!r}'.format(self.common_subexpression_report))
+            return self._compile(reduced_right_hand_side, temporaries)
+        return self._compile(self.right_hand_side)
 
     @memoised_property
     def right_hand_side_as_function(self):
@@ -134,15 +182,189 @@ class ODEProblem(SerialisableObject, LatexPrintableObject, MemoisableObject):
         values for variables and values for constants,
         e.g. `f(values_for_variables=[1,2,3], values_for_constants=[3,4,5])
 
+        The values of all equations are computed in a single call to the compiled code.
+        Optionally, a preallocated array of length :attr:`number_of_equations` can be passed as `out`
+        to be filled with the result, instead of allocating a new one.
+
         This function is directly used in `means.simulation.Simulation`
         :return:
         :rtype: function
         """
-        wrapped_functions = self._right_hand_side_as_numeric_functions
+        wrapped_function = self._right_hand_side_as_numeric_function
+        number_of_equations = self.number_of_equations
+
+        def f(values_for_variables, values_for_constants, out=None):
+            if out is None:
+                out = np.empty(number_of_equations, dtype=np.double)
+            wrapped_function(to_double_array(values_for_constants), to_double_array(values_for_variables), out)
+            return out
+
+        return f
+
+    @memoised_property
+    def right_hand_side_as_batch_function(self):
+        """
+        Generates and returns the right hand side of the model as a callable function that evaluates it
+        for many sets of values at once, e.g. for an ensemble of simulations.
+        It takes a matrix of values for variables and a matrix of values for constants,
+        with one row per set of values, and returns a matrix with the values of all equations for each of the rows.
+
+        As with :attr:`right_hand_side_as_function`, a preallocated matrix can be passed as `out`.
+
+        :return:
+        :rtype: function
+        """
+        if self.cse:
+            temporaries, reduced_right_hand_side = self._right_hand_side_common_subexpressions
+            wrapped_function = self._compile(reduced_right_hand_side, temporaries, batched=True)
+        else:
+            wrapped_function = self._compile(self.right_hand_side, batched=True)
+        number_of_equations = self.number_of_equations
+
+        def f(values_for_variables, values_for_constants, out=None):
+            values_for_variables = np.ascontiguousarray(values_for_variables, dtype=np.double)
+            values_for_constants = np.ascontiguousarray(values_for_constants, dtype=np.double)
+            if out is None:
+                out = np.empty((values_for_variables.shape[0], number_of_equations), dtype=np.double)
+            wrapped_function(values_for_constants, values_for_variables, out)
+            return out
+
+        return f
+
+    @memoised_property
+    def jacobian(self):
+        """
+        The Jacobian of the right hand side with respect to the variables (i.e. the left hand side),
+        as a :class:`sympy.Matrix`.
+        """
+        return self.right_hand_side.jacobian(self.left_hand_side)
+
+    @memoised_property
+    def _jacobian_sparsity(self):
+        """
+        The positions of the non-zero entries in the Jacobian as a pair of arrays (rows, columns).
+        The entries are listed column by column, which is the order of the data in
+        :class:`scipy.sparse.csc_matrix`.
+        """
+        return _nonzero_positions(self.jacobian)
+
+    def _compile_entries(self, matrix, positions):
+        # Only the entries at `positions` (e.g. the non-zero ones) are compiled, in that order
+        rows, columns = positions
+        entries = [matrix[row, column] for row, column in zip(rows, columns)]
+        if self.cse:
+            temporaries, reduced_entries = eliminate_common_subexpressions(entries)
+            return self._compile(reduced_entries, temporaries)
+        return self._compile(entries)
+
+    @memoised_property
+    def _jacobian_as_numeric_function(self):
+        return self._compile_entries(self.jacobian, self._jacobian_sparsity)
+
+    @memoised_property
+    def jacobian_as_function(self):
+        """
+        Generates and returns the Jacobian of the right hand side (see :attr:`jacobian`) as a callable function
+        that takes the same parameters as :attr:`right_hand_side_as_function` and returns
+        a two-dimensional :class:`numpy.ndarray`.
+
+        This function is passed to the solvers in `means.simulation.Simulation` that support it,
+        so they do not need to approximate the Jacobian by finite differences.
+        :return:
+        :rtype: function
+        """
+        wrapped_function = self._jacobian_as_numeric_function
+        rows, columns = self._jacobian_sparsity
+        number_of_equations = self.number_of_equations
 
         def f(values_for_variables, values_for_constants):
-            all_values = np.concatenate((values_for_constants, values_for_variables))
-            ans = np.array([w_f(*all_values) for w_f in wrapped_functions])
+            values = np.empty(len(rows), dtype=np.double)
+            wrapped_function(to_double_array(values_for_constants), to_double_array(values_for_variables), values)
+            ans = np.zeros((number_of_equations, number_of_equations), dtype=np.double)
+            ans[rows, columns] = values
+            return ans
+
+        return f
+
+    @memoised_property
+    def sparse_jacobian_as_function(self):
+        """
+        Same as :attr:`jacobian_as_function`, but the returned function returns
+        a :class:`scipy.sparse.csc_matrix`, which is more efficient for large systems
+        with few non-zero entries in the Jacobian.
+        :return:
+        :rtype: function
+        """
+        from scipy.sparse import csc_matrix
+
+        wrapped_function = self._jacobian_as_numeric_function
+        rows, columns = self._jacobian_sparsity
+        number_of_equations = self.number_of_equations
+        # As the entries are ordered by column, the column pointers of the csc matrix are fixed
+        column_pointers = np.searchsorted(columns, np.arange(number_of_equations + 1))
+
+        def f(values_for_variables, values_for_constants):
+            values = np.empty(len(rows), dtype=np.double)
+            wrapped_function(to_double_array(values_for_constants), to_double_array(values_for_variables), values)
+            return csc_matrix((values, rows, column_pointers), shape=(number_of_equations, number_of_equations))
+
+        return f
+
+    @memoised_property
+    def parameter_jacobian(self):
+        """
+        The derivatives of the right hand side with respect to the parameters, as a :class:`sympy.Matrix`
+        with one row per equation and one column per parameter.
+        """
+        return self.right_hand_side.jacobian(self.parameters)
+
+    @memoised_property
+    def _parameter_jacobian_sparsity(self):
+        return _nonzero_positions(self.parameter_jacobian)
+
+    @memoised_property
+    def parameter_jacobian_as_function(self):
+        """
+        Generates and returns the derivatives of the right hand side with respect to the parameters
+        (see :attr:`parameter_jacobian`) as a callable function that takes the same parameters as
+        :attr:`right_hand_side_as_function` and returns a two-dimensional :class:`numpy.ndarray`.
+        :return:
+        :rtype: function
+        """
+        wrapped_function = self._compile_entries(self.parameter_jacobian, self._parameter_jacobian_sparsity)
+        rows, columns = self._parameter_jacobian_sparsity
+        shape = (self.number_of_equations, len(self.parameters))
+
+        def f(values_for_variables, values_for_constants):
+            values = np.empty(len(rows), dtype=np.double)
+            wrapped_function(to_double_array(values_for_constants), to_double_array(values_for_variables), values)
+            ans = np.zeros(shape, dtype=np.double)
+            ans[rows, columns] = values
+            return ans
+
+        return f
+
+    @memoised_property
+    def sensitivity_right_hand_side_as_function(self):
+        r"""
+        Generates and returns the right hand side of the forward sensitivity equations as a callable function
+        that takes values for variables, values for constants and the current sensitivities :math:`S`,
+        a matrix with one row per equation and one column per parameter,
+        and returns their time derivatives :math:`\frac{dS}{dt} = J S + \frac{\partial f}{\partial p}`,
+        where :math:`J` is the :attr:`jacobian` and :math:`\frac{\partial f}{\partial p}`
+        the :attr:`parameter_jacobian`.
+
+        This function is passed to the solvers in `means.simulation.SimulationWithSensitivities`,
+        so they do not need to approximate the sensitivities by finite differences.
+        :return:
+        :rtype: function
+        """
+        jacobian = self.jacobian_as_function
+        parameter_jacobian = self.parameter_jacobian_as_function
+
+        def f(values_for_variables, values_for_constants, sensitivities):
+            ans = jacobian(values_for_variables, values_for_constants).dot(sensitivities)
+            ans += parameter_jacobian(values_for_variables, values_for_constants)
             return ans
 
         return f
@@ -245,6 +467,8 @@ class ODEProblem(SerialisableObject, LatexPrintableObject, MemoisableObject):
                    ('parameters', map(str, data.parameters)),
                    ('left_hand_side_descriptors', list(data.left_hand_side_descriptors)),
                    ('right_hand_side', map(str, data.right_hand_side))]
+        if data.cse:
+            mapping.append(('cse', data.cse))
 
         return dumper.represent_mapping(cls.yaml_tag, mapping)
 
@@ -263,14 +487,63 @@ class StochasticProblem(Model, MemoisableObject):
     def change(self):
         return self.__change
 
+    @memoised_property
+    def _propensities_as_numeric_function(self):
+        # A single compiled function evaluating all the propensities at once,
+        # called as `f(values_for_species, values_for_parameters, out)`
+        return compile_expressions(self.propensities, [self.species, self.parameters])
+
+    @memoised_property
+    def _reactant_orders(self):
+        """
+        The order of each of the reactions in each of the species, as an array with a row for each reaction.
+        The order is the degree of the numerator of the propensity in the species,
+        or one if the propensity is not a polynomial in it (e.g. a Hill function with a symbolic exponent).
+        """
+        orders = np.zeros((len(self.propensities), len(self.species)), dtype=np.int)
+        for i, propensity in enumerate(self.propensities):
+            numerator, _ = sympy.fraction(sympy.together(propensity))
+            for j, species in enumerate(self.species):
+                if species not in propensity.free_symbols:
+                    continue
+                try:
+                    orders[i, j] = sympy.degree(numerator, species)
+                except sympy.PolynomialError:
+                    orders[i, j] = 1
+        return orders
+
+    @memoised_property
+    def _dependency_graph(self):
+        """
+        For each reaction, the indices of the reactions whose propensities change when it happens,
+        i.e. the reaction itself, and the reactions whose propensities depend on any of the species it changes.
+        """
+        # The reactions whose propensities depend on each species
+        dependent_reactions = [[] for _ in self.species]
+        for i, propensity in enumerate(self.propensities):
+            free_symbols = propensity.free_symbols
+            for j, species in enumerate(self.species):
+                if species in free_symbols:
+                    dependent_reactions[j].append(i)
+
+        graph = []
+        for i, change in enumerate(self.change):
+            reactions = set([i])
+            for j in np.flatnonzero(change):
+                reactions.update(dependent_reactions[j])
+            graph.append(sorted(reactions))
+        return graph
+
     @memoised_property
     def propensities_as_function(self):
-        all_symbols = self.species + self.parameters
-        wrapping_func = lambda x: autowrap(x, args=all_symbols, language='C', backend='Cython')
-        wrapped_functions = map(wrapping_func, self.propensities)
+        number_of_species = len(self.species)
+        number_of_propensities = len(self.propensities)
+        wrapped_function = self._propensities_as_numeric_function
 
         def f(*args):
-            ans = np.array([w_f(*args) for w_f in wrapped_functions])
+            values = to_double_array(args)
+            ans = np.empty(number_of_propensities, dtype=np.double)
+            wrapped_function(values[:number_of_species], values[number_of_species:], ans)
             return ans
 
         return f
\ No newline at end of file
@@ -10,7 +10,7 @@ from collections import namedtuple
 import numpy as np
 from means.core import Moment
 from means.simulation.solvers import NP_FLOATING_POINT_PRECISION
-from scipy.special import gammaln
+from scipy.special import gammaln, psi
 
 def _supported_distances_lookup():
     return {'sum_of_squares': sum_of_squares,
@@ -18,6 +18,12 @@ def _supported_distances_lookup():
             'normal': normal,
             'lognormal': lognormal}
 
+def _supported_distance_gradients_lookup():
+    return {'sum_of_squares': sum_of_squares_gradient,
+            'gamma': gamma_gradient,
+            'normal': normal_gradient,
+            'lognormal': lognormal_gradient}
+
 def get_distance_function(distance):
     """
     Returns the distance function from the string name provided
@@ -33,6 +39,46 @@ def get_distance_function(distance):
     except KeyError:
         raise KeyError('Unsupported distance function {0!r}'.format(distance.lower()))
 
+def get_distance_gradient_function(distance):
+    """
+    Returns the function computing the derivatives of the distance with the string name provided
+    with respect to the values of the simulated trajectories, see :func:`sum_of_squares_gradient`.
+
+    :param distance: The string name of the distributions
+    :return:
+    """
+    try:
+        return _supported_distance_gradients_lookup()[distance]
+    except (KeyError, TypeError):
+        raise KeyError('No gradient available for distance function {0!r}'.format(distance))
+
+def get_distance_outputs(distance, descriptors, observed_descriptors):
+    """
+    Returns the descriptors of the simulated trajectories that the distance with the string name provided
+    depends on, so that the simulations do not need to return the other trajectories
+    (see :meth:`~means.simulation.simulate.Simulation.simulate_system`).
+
+    :param distance: The string name of the distributions, or a distance function
+    :param descriptors: the descriptors of all of the simulated trajectories
+    :param observed_descriptors: the descriptors of the observed trajectories
+    :return: the descriptors the distance depends on, in the same order as in `descriptors`,
+             or None if they are not known, as for distance functions provided by the user
+    """
+    observed_descriptors = set(observed_descriptors)
+    if distance == 'sum_of_squares':
+        return [descriptor for descriptor in descriptors if descriptor in observed_descriptors]
+    elif distance in ['gamma', 'normal', 'lognormal']:
+        # The means of the observed species, and their variances
+        observed_species = set(np.where(moment.n_vector == 1)[0][0] for moment in observed_descriptors
+                               if isinstance(moment, Moment) and moment.order == 1)
+        return [descriptor for descriptor in descriptors
+                if descriptor in observed_descriptors or _is_variance_of(descriptor, observed_species)]
+    return None
+
+def _is_variance_of(descriptor, species):
+    return isinstance(descriptor, Moment) and descriptor.order == 2 and not descriptor.is_mixed \
+        and np.where(descriptor.n_vector == 2)[0][0] in species
+
 def sum_of_squares(simulated_trajectories, observed_trajectories_lookup):
     """
     Returns the sum-of-squares distance between the simulated_trajectories and observed_trajectories
@@ -60,6 +106,34 @@ def sum_of_squares(simulated_trajectories, observed_trajectories_lookup):
 
     return dist
 
+def sum_of_squares_gradient(simulated_trajectories, observed_trajectories_lookup):
+    """
+    Returns the derivatives of :func:`sum_of_squares` with respect to the values of the simulated trajectories.
+
+    :param simulated_trajectories: Simulated trajectories
+    :type simulated_trajectories: list[:class:`means.simulation.Trajectory`]
+    :param observed_trajectories_lookup: A dictionary of (trajectory.description: trajectory) of observed trajectories
+    :type observed_trajectories_lookup: dict
+    :return: a dictionary of (trajectory.description: derivatives) where the derivatives are
+             an array with one value for each of the timepoints of the simulated trajectory.
+             Trajectories the distance does not depend on are not included.
+    :rtype: dict
+    """
+    gradient = {}
+    for simulated_trajectory in simulated_trajectories:
+        try:
+            observed_trajectory = observed_trajectories_lookup[simulated_trajectory.description]
+        except KeyError:
+            continue
+
+        deviations = observed_trajectory.values - simulated_trajectory.values
+        # Missing datapoints do not contribute to the distance
+        deviations[np.isnan(deviations)] = 0
+
+        gradient[simulated_trajectory.description] = -2 * deviations
+
+    return gradient
+
 def gamma(simulated_trajectories, observed_trajectories_lookup):
     """
     Returns the negative log-likelihood of the observed trajectories assuming a gamma distribution
@@ -99,6 +173,27 @@ def lognormal(simulated_trajectories, observed_trajectories_lookup):
     """
     return _distribution_distance(simulated_trajectories, observed_trajectories_lookup, 'lognormal')
 
+def gamma_gradient(simulated_trajectories, observed_trajectories_lookup):
+    """
+    Returns the derivatives of :func:`gamma` with respect to the values of the simulated trajectories.
+    See :func:`sum_of_squares_gradient` for the format of the result.
+    """
+    return _distribution_distance_gradient(simulated_trajectories, observed_trajectories_lookup, 'gamma')
+
+def normal_gradient(simulated_trajectories, observed_trajectories_lookup):
+    """
+    Returns the derivatives of :func:`normal` with respect to the values of the simulated trajectories.
+    See :func:`sum_of_squares_gradient` for the format of the result.
+    """
+    return _distribution_distance_gradient(simulated_trajectories, observed_trajectories_lookup, 'normal')
+
+def lognormal_gradient(simulated_trajectories, observed_trajectories_lookup):
+    """
+    Returns the derivatives of :func:`lognormal` with respect to the values of the simulated trajectories.
+    See :func:`sum_of_squares_gradient` for the format of the result.
+    """
+    return _distribution_distance_gradient(simulated_trajectories, observed_trajectories_lookup, 'lognormal')
+
 _MeanVariance = namedtuple('_MeanVariance', ['mean', 'variance'])
 
 def _distribution_distance(simulated_trajectories, observed_trajectories_lookup, distribution):
@@ -134,6 +229,38 @@ def _distribution_distance(simulated_trajectories, observed_trajectories_lookup,
     dist = -log_likelihood
     return dist
 
+def _distribution_distance_gradient(simulated_trajectories, observed_trajectories_lookup, distribution):
+    """
+    Returns the derivatives of :func:`_distribution_distance` with respect to the means and variances
+    of the simulated trajectories.
+    """
+    mean_descriptions = {}
+    variance_descriptions = {}
+    for trajectory in simulated_trajectories:
+        moment = trajectory.description
+        if not isinstance(moment, Moment):
+            continue
+        if moment.order == 1:
+            mean_descriptions[np.where(moment.n_vector == 1)[0][0]] = moment
+        elif moment.order == 2 and not moment.is_mixed:
+            variance_descriptions[np.where(moment.n_vector == 2)[0][0]] = moment
+
+    mean_variance_lookup = _compile_mean_variance_lookup(simulated_trajectories)
+
+    gradient = {}
+    for trajectory in observed_trajectories_lookup.itervalues():
+        moment = trajectory.description
+        species = np.where(moment.n_vector == 1)[0][0]
+        mean_variance = mean_variance_lookup[species]
+
+        d_mean, d_variance = _eval_density_gradient(mean_variance.mean, mean_variance.variance,
+                                                    trajectory.values, distribution)
+        # The distance is the negative log-likelihood
+        gradient[mean_descriptions[species]] = -d_mean
+        gradient[variance_descriptions[species]] = -d_variance
+
+    return gradient
+
 def _compile_mean_variance_lookup(trajectories):
     means = {}
     variances = {}
@@ -200,4 +327,42 @@ def _eval_density(means, variances,observed_values, distribution):
         raise ValueError('Unsupported distribution {0!r}'.format(distribution))
 
     total_log_density = np.sum(log_density)
-    return total_log_density
\ No newline at end of file
+    return total_log_density
+
+
+def _eval_density_gradient(means, variances, observed_values, distribution):
+    """
+    Calculates the derivatives of :func:`_eval_density` with respect to each of the means and variances.
+    The datapoints that :func:`_eval_density` ignores have zero derivatives.
+
+    :return: a tuple of the derivatives with respect to the means and with respect to the variances
+    """
+    means = np.array(means, dtype=NP_FLOATING_POINT_PRECISION)
+    variances = np.array(variances, dtype=NP_FLOATING_POINT_PRECISION)
+    observed_values = np.array(observed_values, dtype=NP_FLOATING_POINT_PRECISION)
+
+    d_means = np.zeros(means.shape, dtype=NP_FLOATING_POINT_PRECISION)
+    d_variances = np.zeros(variances.shape, dtype=NP_FLOATING_POINT_PRECISION)
+
+    used = ~np.isnan(observed_values) & ~(variances == 0)
+    m = means[used]
+    v = variances[used]
+    x = observed_values[used]
+
+    if distribution == 'gamma':
+        b = v / m
+        a = m / b
+        d_log_density_d_a = np.log(x) - np.log(b) - psi(a)
+        d_log_density_d_b = x / b ** 2 - a / b
+        # a = m^2 / v, b = v / m
+        d_means[used] = d_log_density_d_a * 2 * m / v - d_log_density_d_b * v / m ** 2
+        d_variances[used] = -d_log_density_d_a * m ** 2 / v ** 2 + d_log_density_d_b / m
+    elif distribution in ['normal', 'lognormal']:
+        if distribution == 'lognormal':
+            x = np.log(x)
+        d_means[used] = (x - m) / v
+        d_variances[used] = (x - m) ** 2 / (2 * v ** 2) - 1 / (2 * v)
+    else:
+        raise ValueError('Unsupported distribution {0!r}'.format(distribution))
+
+    return d_means, d_variances
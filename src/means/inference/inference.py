@@ -1,13 +1,16 @@
-from scipy.optimize import fmin
+import numpy as np
+from scipy.optimize import fmin, fmin_l_bfgs_b
 from sympy import Symbol
 
-from means.inference.distances import get_distance_function
+from means.inference.distances import get_distance_function, get_distance_gradient_function, get_distance_outputs
 from means.inference.hypercube import hypercube
 from means.inference.parallelisation import raw_results_in_parallel
 from means.inference.results import InferenceResultsCollection, InferenceResult, SolverErrorConvergenceStatus, \
     NormalConvergenceStatus
 from means.io.serialise import SerialisableObject
 from means.simulation import SolverException, Simulation
+from means.simulation.cache import SimulationCache
+from means.simulation.adjoint import AdjointSimulation
 from means.util.logs import get_logger
 from means.util.memoisation import memoised_property, MemoisableObject
 
@@ -19,6 +22,8 @@ __all__ = ['Inference', 'InferenceWithRestarts']
 
 # value returned if parameters, means or variances < 0
 FTOL = 0.000001
+# Tolerance of L-BFGS-B, relative to the machine precision
+FACTR = 1e7
 MAX_DIST = float('inf')
 
 class TooManySolverExceptions(Exception):
@@ -108,6 +113,26 @@ def _some_params_are_negative(problem, parameters, initial_conditions):
 
     return False
 
+def _bounds(problem, constraints, parameters_with_variability, initial_conditions_with_variability):
+    """
+    Returns the ``(min_value, max_value)`` bounds of each of the values in the optimisation guess
+    (see :func:`_to_guess`), combining the constraints with the values that cannot be negative
+    (see :func:`_some_params_are_negative`).
+    """
+    lower_limits = [0.0 for _, is_variable in parameters_with_variability if is_variable]
+    lower_limits += [0.0 if i < problem.number_of_species else None
+                     for i, (_, is_variable) in enumerate(initial_conditions_with_variability) if is_variable]
+
+    bounds = []
+    for lower_limit, constraint in zip(lower_limits, constraints):
+        upper_limit = None
+        if constraint is not None:
+            if constraint[0] is not None:
+                lower_limit = constraint[0] if lower_limit is None else max(lower_limit, constraint[0])
+            upper_limit = constraint[1]
+        bounds.append((lower_limit, upper_limit))
+    return bounds
+
 
 class InferenceWithRestarts(MemoisableObject):
     """
@@ -124,6 +149,7 @@ class InferenceWithRestarts(MemoisableObject):
     _return_intermediate_solutions = None
 
     __distance_function_type = None
+    __simulation_kwargs = None
 
 
     def _validate_range(self, range_):
@@ -145,7 +171,8 @@ class InferenceWithRestarts(MemoisableObject):
 
     def __init__(self, problem, number_of_samples,
                  starting_parameter_ranges, starting_conditions_ranges,
-                 variable_parameters, observed_trajectories, distance_function_type='sum_of_squares'):
+                 variable_parameters, observed_trajectories, distance_function_type='sum_of_squares',
+                 **simulation_kwargs):
         """
 
         :param problem: Problem to infer parameters for
@@ -167,6 +194,10 @@ class InferenceWithRestarts(MemoisableObject):
               - any callable function, that takes two arguments: simulated trajectories (list)
                 and observed trajectories lookup (dictionary of description: trajectory pairs)
                 see :func:`means.inference.distances.sum_of_squares` for examples of such functions
+        :param simulation_kwargs: Keyword arguments to pass to the :class:`means.simulation.Simulation` instances.
+                                  If ``cache=True`` is given, the inferences from all of the starting points
+                                  share the same :class:`~means.simulation.cache.SimulationCache`
+                                  when they are not run in parallel.
         """
 
         self.__problem = problem
@@ -196,6 +227,7 @@ class InferenceWithRestarts(MemoisableObject):
             raise ValueError('No observed trajectories provided. Need at least one to perform parameter inference')
 
         self.__distance_function_type = distance_function_type
+        self.__simulation_kwargs = simulation_kwargs
 
     @memoised_property
     def _inference_objects(self):
@@ -203,6 +235,10 @@ class InferenceWithRestarts(MemoisableObject):
         full_list_of_ranges = self.starting_parameter_ranges[:] + self.starting_conditions_ranges[:]
         variables_collection = hypercube(self.number_of_samples, full_list_of_ranges)
 
+        simulation_kwargs = self.simulation_kwargs
+        if simulation_kwargs.get('cache') is True:
+            simulation_kwargs['cache'] = SimulationCache()
+
         inference_objects = []
         for variables in variables_collection:
             starting_parameters = variables[:len(self.starting_parameter_ranges)]
@@ -214,7 +250,7 @@ class InferenceWithRestarts(MemoisableObject):
                                                 self.variable_parameters,
                                                 self.observed_trajectories,
                                                 distance_function_type=self.distance_function_type,
-                                                ))
+                                                **simulation_kwargs))
 
         return inference_objects
 
@@ -271,6 +307,10 @@ class InferenceWithRestarts(MemoisableObject):
     def distance_function_type(self):
         return self.__distance_function_type
 
+    @property
+    def simulation_kwargs(self):
+        return self.__simulation_kwargs.copy()
+
 class Inference(SerialisableObject, MemoisableObject):
 
     __problem = None
@@ -452,7 +492,8 @@ class Inference(SerialisableObject, MemoisableObject):
                      timepoints_to_simulate, observed_trajectories_lookup,
                      distance_comparison_function,
                      simulation_instance,
-                     exception_limit, track_distance_landscape=False):
+                     exception_limit, track_distance_landscape=False,
+                     distance_gradient_function=None, adjoint_simulation_instance=None, simulation_outputs=None):
 
             self.problem = problem
             self.constraints = constraints
@@ -468,6 +509,9 @@ class Inference(SerialisableObject, MemoisableObject):
             self.best_so_far_distance = None
             self.best_so_far_guess = None
             self.track_distance_landscape = track_distance_landscape
+            self.distance_gradient_function = distance_gradient_function
+            self.adjoint_simulation_instance = adjoint_simulation_instance
+            self.simulation_outputs = simulation_outputs
             if self.track_distance_landscape:
                 self.distance_landscape = []
             else:
@@ -493,20 +537,74 @@ class Inference(SerialisableObject, MemoisableObject):
             try:
                 simulated_trajectories = simulator.simulate_system(current_parameters,
                                                                    current_initial_conditions,
-                                                                   self.timepoints_to_simulate)
+                                                                   self.timepoints_to_simulate,
+                                                                   outputs=self.simulation_outputs)
             except SolverException as e:
-                logger.warn('Warning: got {0!r} while simulating with '  \
-                             'parameters={1!r}, initial_conditions={2!r}. ' \
-                             'Setting distance to infinity'.format(e, current_parameters, current_initial_conditions))
-                self.exception_count += 1
-                if self.exception_limit is not None and self.exception_count > self.exception_limit:
-                    raise TooManySolverExceptions('Solver exception limit reached while exploring the inference space.')
-                else:
-                    return MAX_DIST
+                self._solver_exception_raised(e, current_parameters, current_initial_conditions)
+                return MAX_DIST
 
             dist = self._distance_to_simulated_trajectories(simulated_trajectories)
             return dist
 
+        def _solver_exception_raised(self, exception, current_parameters, current_initial_conditions):
+            logger.warn('Warning: got {0!r} while simulating with '  \
+                         'parameters={1!r}, initial_conditions={2!r}. ' \
+                         'Setting distance to infinity'.format(exception, current_parameters,
+                                                               current_initial_conditions))
+            self.exception_count += 1
+            if self.exception_limit is not None and self.exception_count > self.exception_limit:
+                raise TooManySolverExceptions('Solver exception limit reached while exploring the inference space.')
+
+        def get_distance_and_gradient(self, current_parameters, current_initial_conditions):
+            """
+            Returns the distance, and its gradient with respect to all of the parameters
+            and all of the initial conditions, computed with the adjoint method
+            (see :class:`~means.simulation.adjoint.AdjointSimulation`).
+            """
+            number_of_values = len(current_parameters) + len(current_initial_conditions)
+            if _some_params_are_negative(self.problem, current_parameters, current_initial_conditions):
+                return MAX_DIST, np.zeros(number_of_values)
+
+            observed_trajectories_lookup = self.observed_trajectories_lookup
+            distance_gradient_function = self.distance_gradient_function
+            try:
+                simulated_trajectories, parameter_gradient, initial_conditions_gradient = \
+                    self.adjoint_simulation_instance.simulate_with_gradient(
+                        current_parameters, current_initial_conditions, self.timepoints_to_simulate,
+                        lambda trajectories: distance_gradient_function(trajectories, observed_trajectories_lookup))
+            except SolverException as e:
+                self._solver_exception_raised(e, current_parameters, current_initial_conditions)
+                return MAX_DIST, np.zeros(number_of_values)
+
+            dist = self._distance_to_simulated_trajectories(simulated_trajectories)
+            if dist == MAX_DIST:
+                return MAX_DIST, np.zeros(number_of_values)
+            return dist, np.concatenate([parameter_gradient, initial_conditions_gradient])
+
+        def _variable_values(self, values):
+            # The values in the same order as in the optimisation guess, see `_to_guess`
+            return np.array([value for value, (_, is_variable)
+                             in zip(values, self.parameters_with_variability + self.initial_conditions_with_variability)
+                             if is_variable])
+
+        def distance_and_gradient(self, current_guess):
+            """
+            Returns the distance for the `current_guess`, and its gradient with respect to each of the values
+            in the guess. Used as the objective of gradient-based optimisers.
+            """
+            # The optimiser may reuse the array for the next guess
+            current_guess = np.array(current_guess)
+            current_parameters, current_initial_conditions = \
+                self.extract_parameters_from_optimisation_guess(current_guess)
+
+            if not self._constraints_are_satisfied(current_guess):
+                dist, gradient = MAX_DIST, np.zeros(len(current_parameters) + len(current_initial_conditions))
+            else:
+                dist, gradient = self.get_distance_and_gradient(current_parameters, current_initial_conditions)
+
+            self._record(current_guess, current_parameters, current_initial_conditions, dist)
+            return dist, self._variable_values(gradient)
+
         def __call__(self, current_guess):
             current_parameters, current_initial_conditions = \
                 self.extract_parameters_from_optimisation_guess(current_guess)
@@ -516,6 +614,10 @@ class Inference(SerialisableObject, MemoisableObject):
             else:
                 dist = self.get_distance(current_parameters, current_initial_conditions)
 
+            self._record(current_guess, current_parameters, current_initial_conditions, dist)
+            return dist
+
+        def _record(self, current_guess, current_parameters, current_initial_conditions, dist):
             # Keep track of the best-so-far score if we cancel early due to too many exceptions
             if dist < self.best_so_far_distance:
                 self.best_so_far_distance = dist
@@ -524,15 +626,35 @@ class Inference(SerialisableObject, MemoisableObject):
             if self.track_distance_landscape:
                 self.distance_landscape.append((current_parameters, current_initial_conditions, dist))
 
-            return dist
 
+    @memoised_property
+    def _distance_gradient_function(self):
+        try:
+            return get_distance_gradient_function(self.distance_function_type)
+        except KeyError as e:
+            raise ValueError(e.message)
 
+    @memoised_property
+    def _simulation_outputs(self):
+        # Only the trajectories that the distance compares to the observed ones are returned by the simulations
+        return get_distance_outputs(self.distance_function_type, self.problem.left_hand_side_descriptors,
+                                    self.observed_trajectories_lookup.keys())
+
+    @memoised_property
+    def _adjoint_simulation(self):
+        return AdjointSimulation(self.problem)
 
     def _infer_raw(self, return_intermediate_solutions=False, return_distance_landscape=False,
-                   solver_exceptions_limit=DEFAULT_SOLVER_EXCEPTIONS_LIMIT):
+                   solver_exceptions_limit=DEFAULT_SOLVER_EXCEPTIONS_LIMIT, use_gradient=False):
 
         initial_guess = _to_guess(self.starting_parameters_with_variability, self.starting_conditions_with_variability)
 
+        if use_gradient:
+            gradient_kwargs = dict(distance_gradient_function=self._distance_gradient_function,
+                                   adjoint_simulation_instance=self._adjoint_simulation)
+        else:
+            gradient_kwargs = {}
+
         distances_calculator = self._DistancesCalculator(self.problem,
                                                          self.constraints,
                                                          self.starting_parameters_with_variability,
@@ -542,11 +664,17 @@ class Inference(SerialisableObject, MemoisableObject):
                                                          self._distance_between_trajectories_function,
                                                          self.simulation,
                                                          exception_limit=solver_exceptions_limit,
-                                                         track_distance_landscape=return_distance_landscape)
+                                                         track_distance_landscape=return_distance_landscape,
+                                                         simulation_outputs=self._simulation_outputs,
+                                                         **gradient_kwargs)
 
         try:
-            result = fmin(distances_calculator, initial_guess, ftol=FTOL, disp=0, full_output=True,
-                          retall=return_intermediate_solutions)
+            if use_gradient:
+                result = self._minimise_with_gradient(distances_calculator, initial_guess,
+                                                      return_intermediate_solutions)
+            else:
+                result = fmin(distances_calculator, initial_guess, ftol=FTOL, disp=0, full_output=True,
+                              retall=return_intermediate_solutions)
         except TooManySolverExceptions as e:
             logger.warn('Reached maximum number of exceptions from solver. Stopping inference here')
             if distances_calculator.best_so_far_guess is not None:
@@ -586,6 +714,72 @@ class Inference(SerialisableObject, MemoisableObject):
         return optimal_parameters, optimal_initial_conditions, distance_at_minimum, convergence_status, \
                solutions, distance_landscape
 
+    def _minimise_with_gradient(self, distances_calculator, initial_guess, return_intermediate_solutions):
+        """
+        Minimises the distance with L-BFGS-B, using the gradients computed by
+        :meth:`_DistancesCalculator.distance_and_gradient`.
+        The constraints, and the values that cannot be negative, are passed to the optimiser as bounds.
+
+        :return: the same values as :func:`scipy.optimize.fmin` with ``full_output=True``
+        """
+        bounds = _bounds(self.problem, self.constraints,
+                         self.starting_parameters_with_variability, self.starting_conditions_with_variability)
+
+        # Positive values are optimised on a logarithmic scale, as parameters often differ by orders of magnitude,
+        # and the others relative to their starting values
+        initial_guess = np.array(initial_guess, dtype=float)
+        logarithmic = np.array([lower_limit is not None and lower_limit >= 0 and value > 0
+                                for value, (lower_limit, _) in zip(initial_guess, bounds)])
+        scale = np.where(initial_guess != 0, np.abs(initial_guess), 1.0)
+
+        lower_limits = np.array([-np.inf if lower_limit is None else lower_limit for lower_limit, _ in bounds])
+        upper_limits = np.array([np.inf if upper_limit is None else upper_limit for _, upper_limit in bounds])
+
+        def to_guess(transformed_guess):
+            guess = np.where(logarithmic, np.exp(transformed_guess), transformed_guess * scale)
+            # Rounding errors must not take the values at the bounds out of them
+            return np.clip(guess, lower_limits, upper_limits)
+
+        def transform(value, is_logarithmic, value_scale):
+            if value is None or (is_logarithmic and value <= 0):
+                return None
+            return np.log(value) if is_logarithmic else value / value_scale
+
+        transformed_bounds = [(transform(lower_limit, is_logarithmic, value_scale),
+                               transform(upper_limit, is_logarithmic, value_scale))
+                              for (lower_limit, upper_limit), is_logarithmic, value_scale
+                              in zip(bounds, logarithmic, scale)]
+
+        # The lowest finite distance so far, and where it was found
+        best = {}
+
+        def transformed_distance_and_gradient(transformed_guess):
+            guess = to_guess(transformed_guess)
+            dist, gradient = distances_calculator.distance_and_gradient(guess)
+            if dist != MAX_DIST:
+                if not best or dist < best['distance']:
+                    best.update(distance=dist, transformed_guess=np.array(transformed_guess))
+                return dist, gradient * np.where(logarithmic, guess, scale)
+
+            if not best:
+                raise TooManySolverExceptions('The distance cannot be computed at the starting values')
+            # The line search cannot deal with infinite distances. Instead, the distance is larger than the best one
+            # so far and grows quadratically with the distance from where it was found, and the gradient is the one
+            # of this quadratic, so the line search backs off towards the best guess
+            step = transformed_guess - best['transformed_guess']
+            penalty = abs(best['distance']) + 1.0
+            return best['distance'] + penalty * (1 + step.dot(step)), 2 * penalty * step
+
+        all_vecs = [initial_guess]
+        transformed_optimum, distance_at_minimum, info = fmin_l_bfgs_b(
+            transformed_distance_and_gradient, np.where(logarithmic, np.log(scale), initial_guess / scale),
+            bounds=transformed_bounds, factr=FACTR, callback=lambda x: all_vecs.append(to_guess(x)))
+
+        result = (to_guess(transformed_optimum), distance_at_minimum, info['nit'], info['funcalls'], info['warnflag'])
+        if return_intermediate_solutions:
+            result += (all_vecs,)
+        return result
+
     def _result_from_raw_result(self, raw_result):
         optimal_parameters, optimal_initial_conditions, distance_at_minimum, convergence_status, solutions, \
             distance_landscape = raw_result
@@ -597,15 +791,24 @@ class Inference(SerialisableObject, MemoisableObject):
 
 
     def infer(self, return_intermediate_solutions=False, return_distance_landscape=False,
-              solver_exceptions_limit=DEFAULT_SOLVER_EXCEPTIONS_LIMIT):
+              solver_exceptions_limit=DEFAULT_SOLVER_EXCEPTIONS_LIMIT, use_gradient=False):
         """
 
         :param return_intermediate_solutions: Return the intermediate parameter solutions that optimisation
         :param return_distance_landscape: Return the distance landscape that was explored
+        :param use_gradient: If set to True, the distance is minimised with L-BFGS-B rather than with the
+                             Nelder-Mead simplex algorithm, using its gradient with respect to the variable
+                             parameters. The gradient is computed with the adjoint method
+                             (see :class:`~means.simulation.adjoint.AdjointSimulation`), so its cost does not grow
+                             with the number of parameters. The system is then simulated with
+                             :func:`scipy.integrate.solve_ivp`, rather than with the solver in `simulation_kwargs`.
+                             Only available for the distance functions provided by
+                             :mod:`means.inference.distances`.
         """
         raw_result = self._infer_raw(return_intermediate_solutions=return_intermediate_solutions,
                                      return_distance_landscape=return_distance_landscape,
                                      solver_exceptions_limit=solver_exceptions_limit,
+                                     use_gradient=use_gradient,
                                      )
         return self._result_from_raw_result(raw_result)
 
@@ -3,8 +3,10 @@ Routines for stochastic and deterministic simulation.
 """
 from means.simulation.descriptors import SensitivityTerm, PerturbedTerm
 from simulate import Simulation, SimulationWithSensitivities
-from trajectory import Trajectory, TrajectoryWithSensitivityData, TrajectoryCollection
+from trajectory import Trajectory, TrajectoryWithSensitivityData, TrajectoryCollection, TrajectoryCollectionBatch
 from solvers import SolverException
 from ssa import SSASimulation
+from tau_leaping import TauLeapingSimulation
+from next_reaction import NextReactionSimulation
 
 import solvers
\ No newline at end of file
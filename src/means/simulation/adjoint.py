@@ -0,0 +1,203 @@
+"""
+Adjoint Gradients
+-----------------
+
+This part of the package computes the gradient of a function of the simulated trajectories
+(e.g. one of the distances in :mod:`means.inference.distances`) with respect to the parameters
+and the initial conditions of an :class:`~means.core.problems.ODEProblem` with the adjoint method.
+
+Unlike :class:`~means.simulation.simulate.SimulationWithSensitivities`, which integrates one set of
+sensitivity equations for each parameter, the adjoint method integrates a single system,
+of the same size as the problem, backwards in time.
+The cost of the gradient is therefore roughly independent of the number of parameters.
+
+>>> from means import mea_approximation
+>>> from means.examples.sample_models import MODEL_P53
+>>> from means.simulation.adjoint import AdjointSimulation
+>>> import numpy as np
+>>>
+>>> ode_problem = mea_approximation(MODEL_P53, max_order=2)
+>>> simulation = AdjointSimulation(ode_problem)
+>>> timepoints = np.arange(0, 40, .1)
+>>> # The gradient of the sum of the final values of all the trajectories
+>>> def trajectory_gradients(trajectories):
+...     return {t.description: np.where(timepoints == timepoints[-1], 1.0, 0.0) for t in trajectories}
+>>> trajectories, parameter_gradient, initial_conditions_gradient = \\
+...     simulation.simulate_with_gradient([90, 0.002, 1.7, 1.1, 0.93, 0.96, 0.01], [70, 30, 60],
+...                                       timepoints, trajectory_gradients)
+
+-------------
+"""
+import numpy as np
+
+from means.simulation.solvers import SolverException, ScipySolverError, NP_FLOATING_POINT_PRECISION
+from means.simulation.trajectory import TrajectoryCollection
+
+# Methods of `scipy.integrate.solve_ivp` that use the Jacobian
+_IMPLICIT_METHODS = ['LSODA', 'BDF', 'Radau']
+# The gradient is only as accurate as the solutions, so the defaults are tighter than those of `solve_ivp`
+DEFAULT_OPTIONS = {'rtol': 1e-6, 'atol': 1e-8}
+# Number of Gauss-Legendre nodes used for the integrals of each step of the adjoint solution
+_QUADRATURE_ORDER = 3
+
+
+class AdjointSimulation(object):
+    """
+    Simulates an :class:`~means.core.problems.ODEProblem` with :func:`scipy.integrate.solve_ivp`
+    and computes the gradient of functions of the simulated trajectories with the adjoint method.
+
+    Given a function :math:`D = \\sum_k g_k(y(t_k))` of the values of the trajectories at the timepoints,
+    the adjoint :math:`\\lambda` is integrated backwards from the last timepoint, following
+    :math:`\\frac{d\\lambda}{dt} = -J^T \\lambda` and jumping by :math:`\\frac{\\partial g_k}{\\partial y}` at each
+    of the timepoints :math:`t_k`. The gradient with respect to the initial conditions is then :math:`\\lambda(t_0)`,
+    and the gradient with respect to the parameters is
+    :math:`\\int_{t_0}^{t_K} \\lambda^T \\frac{\\partial f}{\\partial p} dt`, which is computed along the steps of
+    the backward integration, so it does not need to be integrated with the adjoint.
+    """
+
+    def __init__(self, problem, method='LSODA', **options):
+        """
+        :param problem: Problem to simulate
+        :type problem: :class:`~means.core.problems.ODEProblem`
+        :param method: the method of :func:`scipy.integrate.solve_ivp` to use,
+                       for both the forward and the backward integration
+        :param options: options to pass to :func:`scipy.integrate.solve_ivp`, e.g. ``rtol`` or ``atol``,
+                        see :data:`DEFAULT_OPTIONS`
+        """
+        self.__problem = problem
+        self.__method = method
+        self.__options = DEFAULT_OPTIONS.copy()
+        self.__options.update(options)
+
+    @property
+    def problem(self):
+        return self.__problem
+
+    @property
+    def method(self):
+        return self.__method
+
+    def _solve(self, function, jacobian, time_span, initial_values, **kwargs):
+        from scipy.integrate import solve_ivp
+
+        options = self.__options.copy()
+        options.update(kwargs)
+        if self.__method in _IMPLICIT_METHODS:
+            options['jac'] = jacobian
+
+        result = solve_ivp(function, time_span, initial_values, method=self.__method, **options)
+        if not result.success:
+            raise SolverException(None, ScipySolverError('{0} failed: {1}'.format(self.__method, result.message)))
+        return result
+
+    def _simulate(self, parameters, initial_conditions, timepoints):
+        problem = self.problem
+        rhs = problem.right_hand_side_as_function
+        jacobian = problem.jacobian_as_function
+
+        # Unspecified initial conditions are zero
+        initial_values = np.zeros(problem.number_of_equations, dtype=NP_FLOATING_POINT_PRECISION)
+        initial_values[:len(initial_conditions)] = initial_conditions
+        forward = self._solve(lambda t, x: rhs(x, parameters), lambda t, x: jacobian(x, parameters),
+                              (timepoints[0], timepoints[-1]), initial_values,
+                              t_eval=timepoints, dense_output=True)
+
+        trajectories = TrajectoryCollection.from_array(forward.t, forward.y, problem.left_hand_side_descriptors)
+        return trajectories, forward.sol
+
+    def simulate_system(self, parameters, initial_conditions, timepoints):
+        """
+        Simulates the system for each of the timepoints, like
+        :meth:`~means.simulation.simulate.Simulation.simulate_system`.
+
+        :param parameters: list of the values for the constants in the model, in the same order as in the model
+        :param initial_conditions: List of the initial values for the equations in the problem.
+                                   If not all values specified, the remaining ones will be assumed to be 0.
+        :param timepoints: A list of time points to simulate the system for
+        :return: a list of :class:`~means.simulation.Trajectory` objects,
+                 one for each of the equations in the problem
+        :rtype: :class:`~means.simulation.TrajectoryCollection`
+        """
+        trajectories, _ = self._simulate(*self._validate(parameters, initial_conditions, timepoints))
+        return trajectories
+
+    def _validate(self, parameters, initial_conditions, timepoints):
+        parameters = np.array(parameters, dtype=NP_FLOATING_POINT_PRECISION)
+        initial_conditions = np.array(initial_conditions, dtype=NP_FLOATING_POINT_PRECISION)
+        timepoints = np.array(timepoints, dtype=NP_FLOATING_POINT_PRECISION)
+
+        if len(parameters) != self.problem.number_of_parameters:
+            raise ValueError('Expected {0} parameters, got {1}'.format(self.problem.number_of_parameters,
+                                                                    len(parameters)))
+        if len(initial_conditions) > self.problem.number_of_equations:
+            raise ValueError('Expected at most {0} initial conditions, '
+                             'got {1}'.format(self.problem.number_of_equations, len(initial_conditions)))
+        if len(timepoints) < 2 or (np.diff(timepoints) <= 0).any():
+            raise ValueError('Expected at least two increasing timepoints')
+
+        return parameters, initial_conditions, timepoints
+
+    def simulate_with_gradient(self, parameters, initial_conditions, timepoints, trajectory_gradients):
+        """
+        Simulates the system for each of the timepoints and computes the gradient of a function
+        of the simulated trajectories with respect to the parameters and to the initial conditions.
+
+        :param parameters: list of the values for the constants in the model, in the same order as in the model
+        :param initial_conditions: List of the initial values for the equations in the problem.
+                                   If not all values specified, the remaining ones will be assumed to be 0.
+        :param timepoints: A list of increasing time points to simulate the system for,
+                           the first one is the starting time
+        :param trajectory_gradients: a function that takes the simulated trajectories and returns the derivatives
+                                     of the function with respect to their values, as a dictionary of
+                                     ``{description: derivatives}``, the derivatives being an array with a value
+                                     for each of the timepoints. Trajectories which are not in the dictionary
+                                     are assumed not to change the function,
+                                     see e.g. :func:`means.inference.distances.sum_of_squares_gradient`
+        :return: the simulated trajectories, the gradient with respect to the parameters
+                 and the gradient with respect to all of the initial conditions
+        :rtype: (:class:`~means.simulation.TrajectoryCollection`, :class:`numpy.ndarray`, :class:`numpy.ndarray`)
+        """
+        parameters, initial_conditions, timepoints = self._validate(parameters, initial_conditions, timepoints)
+        problem = self.problem
+        number_of_equations = problem.number_of_equations
+
+        trajectories, forward = self._simulate(parameters, initial_conditions, timepoints)
+
+        jumps = np.zeros((len(timepoints), number_of_equations), dtype=NP_FLOATING_POINT_PRECISION)
+        equation_indices = {description: i for i, description in enumerate(problem.left_hand_side_descriptors)}
+        for description, derivatives in trajectory_gradients(trajectories).iteritems():
+            jumps[:, equation_indices[description]] += derivatives
+
+        jacobian = problem.jacobian_as_function
+        parameter_jacobian = problem.parameter_jacobian_as_function
+
+        def adjoint_jacobian(t, adjoint):
+            return -jacobian(forward(t), parameters).T
+
+        def adjoint_rhs(t, adjoint):
+            return adjoint_jacobian(t, adjoint).dot(adjoint)
+
+        nodes, weights = np.polynomial.legendre.leggauss(_QUADRATURE_ORDER)
+
+        adjoint = np.zeros(number_of_equations, dtype=NP_FLOATING_POINT_PRECISION)
+        parameter_gradient = np.zeros(problem.number_of_parameters, dtype=NP_FLOATING_POINT_PRECISION)
+        for k in range(len(timepoints) - 1, 0, -1):
+            adjoint += jumps[k]
+            backward = self._solve(adjoint_rhs, adjoint_jacobian, (timepoints[k], timepoints[k - 1]), adjoint,
+                                   dense_output=True)
+
+            # Integrate lambda^T df/dp over each of the (backward) steps of the solver
+            step_ends = backward.t
+            midpoints = (step_ends[:-1] + step_ends[1:]) / 2.0
+            half_widths = np.abs(step_ends[:-1] - step_ends[1:]) / 2.0
+            for midpoint, half_width in zip(midpoints, half_widths):
+                for node, weight in zip(nodes, weights):
+                    t = midpoint + half_width * node
+                    parameter_gradient += weight * half_width * \
+                                          parameter_jacobian(forward(t), parameters).T.dot(backward.sol(t))
+
+            adjoint = backward.y[:, -1]
+
+        adjoint += jumps[0]
+
+        return trajectories, parameter_gradient, adjoint
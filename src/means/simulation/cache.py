@@ -0,0 +1,200 @@
+"""
+Simulation Cache
+----------------
+
+This part of the package provides a least-recently-used cache of simulation results,
+that :class:`~means.simulation.simulate.Simulation` uses when it is created with the `cache` argument:
+
+>>> from means import mea_approximation, Simulation
+>>> from means.examples.sample_models import MODEL_P53
+>>> from means.simulation.cache import SimulationCache
+>>> import numpy as np
+>>>
+>>> ode_problem = mea_approximation(MODEL_P53, max_order=2)
+>>> simulation = Simulation(ode_problem, solver='scipy-lsoda', cache=SimulationCache(max_memory=10 * 2 ** 20))
+>>> timepoints = np.arange(0, 40, .1)
+>>> trajectories = simulation.simulate_system([90, 0.002, 1.7, 1.1, 0.93, 0.96, 0.01], [70, 30, 60], timepoints)
+>>> trajectories = simulation.simulate_system([90, 0.002, 1.7, 1.1, 0.93, 0.96, 0.01], [70, 30, 60], timepoints)
+>>> print simulation.cache.hits, simulation.cache.misses
+1 1
+
+This is useful when the same simulations are requested several times, e.g. by the optimisers
+in :mod:`means.inference`.
+
+-------------
+"""
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from means.io.serialise import SerialisableObject
+
+# 64 MiB
+DEFAULT_MAX_MEMORY = 64 * 2 ** 20
+DEFAULT_SIGNIFICANT_DIGITS = 12
+
+
+def _trajectory_memory(trajectory):
+    memory = trajectory.timepoints.nbytes + trajectory.values.nbytes
+    for sensitivity in getattr(trajectory, 'sensitivity_data', []):
+        memory += _trajectory_memory(sensitivity)
+    return memory
+
+
+class SimulationCache(SerialisableObject):
+    """
+    A least-recently-used cache of simulated trajectories, keyed on the parameters, the initial conditions
+    and the timepoints of the simulations, and on the solver that performed them.
+
+    The values in the keys are quantised to `significant_digits` significant digits,
+    so simulations whose values only differ by rounding errors share the same entry.
+    The least recently used entries are dropped when the memory taken by the trajectories
+    goes over `max_memory` bytes.
+
+    The cached trajectories are returned as they are rather than copied, so should not be modified.
+    A cache should only be shared between simulations of the same problem.
+    The entries of the cache are not pickled, nor serialised.
+    """
+
+    yaml_tag = '!simulation-cache'
+
+    def __init__(self, max_memory=DEFAULT_MAX_MEMORY, significant_digits=DEFAULT_SIGNIFICANT_DIGITS):
+        """
+        :param max_memory: the largest number of bytes taken by the cached trajectories
+        :type max_memory: int
+        :param significant_digits: the number of significant digits of the values compared in the keys
+        :type significant_digits: int
+        """
+        if max_memory < 0:
+            raise ValueError('Expected a positive memory budget, got {0!r}'.format(max_memory))
+        if not 0 < significant_digits <= 16:
+            raise ValueError('Expected between 1 and 16 significant digits, got {0!r}'.format(significant_digits))
+
+        self.__max_memory = max_memory
+        self.__significant_digits = significant_digits
+        self.clear()
+
+    @property
+    def max_memory(self):
+        return self.__max_memory
+
+    @property
+    def significant_digits(self):
+        return self.__significant_digits
+
+    @property
+    def hits(self):
+        """
+        The number of simulations whose results were found in the cache
+        """
+        return self._hits
+
+    @property
+    def misses(self):
+        """
+        The number of simulations whose results were not in the cache, and had to be simulated
+        """
+        return self._misses
+
+    @property
+    def memory_used(self):
+        """
+        The number of bytes taken by the cached trajectories
+        """
+        return self._memory_used
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Removes all of the entries of the cache, and resets the counters
+        """
+        self._entries = OrderedDict()
+        self._memory_used = 0
+        self._hits = 0
+        self._misses = 0
+
+    def _quantise(self, values):
+        values = np.asarray(values, dtype=np.double)
+        # Round the mantissas, so the precision is relative to the magnitude of the values
+        mantissas, exponents = np.frexp(values)
+        mantissas = np.round(mantissas * 10 ** self.__significant_digits).astype(np.int64)
+        return mantissas.tostring() + exponents.astype(np.int32).tostring()
+
+    def key(self, solver, parameters, initial_conditions, timepoints):
+        """
+        Returns the key of the cache entry for the simulation.
+
+        :param solver: a description of the solver, and its options
+        :type solver: basestring
+        :param parameters: the values for the constants in the model
+        :param initial_conditions: the initial values for all of the equations in the problem
+        :param timepoints: the timepoints to simulate the system for
+        :rtype: str
+        """
+        hash_ = hashlib.sha1(solver)
+        for values in [parameters, initial_conditions, timepoints]:
+            quantised_values = self._quantise(values)
+            # The lengths separate the arrays, so their values cannot move from one to the other
+            hash_.update(str(len(quantised_values)))
+            hash_.update(quantised_values)
+        return hash_.digest()
+
+    def get(self, key):
+        """
+        Returns the trajectories for the key, or None if they are not in the cache.
+        Updates the hit and miss counters.
+        """
+        try:
+            trajectories, memory = self._entries.pop(key)
+        except KeyError:
+            self._misses += 1
+            return None
+
+        # Move the entry to the end, as the most recently used one
+        self._entries[key] = trajectories, memory
+        self._hits += 1
+        return trajectories
+
+    def put(self, key, trajectories):
+        """
+        Stores the trajectories for the key, dropping the least recently used entries if needed.
+        Trajectories larger than the whole memory budget are not stored.
+        """
+        memory = sum(_trajectory_memory(trajectory) for trajectory in trajectories)
+        if memory > self.__max_memory:
+            return
+
+        if key in self._entries:
+            self._memory_used -= self._entries.pop(key)[1]
+
+        while self._memory_used + memory > self.__max_memory:
+            _, (_, dropped_memory) = self._entries.popitem(last=False)
+            self._memory_used -= dropped_memory
+
+        self._entries[key] = trajectories, memory
+        self._memory_used += memory
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The entries are only useful in the process that computed them
+        state['_entries'] = OrderedDict()
+        state['_memory_used'] = 0
+        return state
+
+    @classmethod
+    def to_yaml(cls, dumper, data):
+        mapping = [('max_memory', data.max_memory),
+                   ('significant_digits', data.significant_digits)]
+        return dumper.represent_mapping(cls.yaml_tag, mapping)
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and self.max_memory == other.max_memory \
+            and self.significant_digits == other.significant_digits
+
+    def __repr__(self):
+        return '<{0} with {1} entries ({2} bytes), {3} hits, {4} misses>'.format(self.__class__.__name__, len(self),
+                                                                                 self.memory_used, self.hits,
+                                                                                 self.misses)
@@ -0,0 +1,229 @@
+"""
+Next Reaction Method
+----
+
+This part of the package provides an implementation of the Next Reaction Method of [Gibson00],
+an exact stochastic simulation algorithm like the direct method of :mod:`means.simulation.ssa`.
+The times of the next occurrence of each reaction are kept in an indexed priority queue,
+and only the propensities that depend on the species changed by a reaction are recomputed when it happens,
+using a graph of the dependencies between the reactions built from the stoichiometry matrix
+and the symbols of the propensities.
+Each step therefore takes a time logarithmic in the number of reactions,
+rather than linear, which is faster for networks with many reactions.
+"""
+
+import __future__
+import math
+import numpy as np
+import sympy
+from sympy.printing.lambdarepr import lambdarepr
+from means.simulation.ssa import SSASimulation, _SSAGenerator, _RANDOM_NUMBERS_CHUNK_SIZE
+
+
+class NextReactionSimulation(SSASimulation):
+    """
+        A class providing an implementation of the Next Reaction Method [Gibson00].
+        It is used as :class:`~means.simulation.ssa.SSASimulation`, and returns the same results.
+
+            >>> from means.examples import MODEL_P53
+            >>> from means import StochasticProblem, NextReactionSimulation
+            >>> import numpy as np
+            >>> PROBLEM = StochasticProblem(MODEL_P53)
+            >>> RATES = [90, 0.002, 1.7, 1.1, 0.93, 0.96, 0.01]
+            >>> INITIAL_CONDITIONS = [70, 30, 60]
+            >>> TIME_RANGE = np.arange(0, 40, .1)
+            >>> N_SSA = 10
+            >>> simulation = NextReactionSimulation(PROBLEM, N_SSA)
+            >>> mean_trajectories = simulation.simulate_system(RATES, INITIAL_CONDITIONS, TIME_RANGE)
+
+
+    .. [Gibson00] Gibson, Michael A., and Jehoshua Bruck. "Efficient exact stochastic simulation of chemical\
+         systems with many species and many channels." The journal of physical chemistry A 104.9 (2000): 1876-1889.
+    """
+    def __init__(self, stochastic_problem, n_simulations, random_seed=None):
+        """
+
+        :param stochastic_problem:
+        :param n_simulations:
+        :param random_seed:
+        """
+        super(NextReactionSimulation, self).__init__(stochastic_problem, n_simulations, random_seed=random_seed)
+        self.__problem = stochastic_problem
+
+    def _generator_class_and_options(self):
+        return _NextReactionGenerator, {'propensities': list(self.__problem.propensities),
+                                        'parameter_symbols': self.__problem.parameters,
+                                        'dependency_graph': self.__problem._dependency_graph}
+
+
+def _propensities_as_python_functions(propensities, species, parameter_symbols, parameters):
+    """
+    Each of the propensities as a python function of the list of the amounts of species,
+    with the values of the parameters in place of their symbols.
+    Evaluating one of these functions only uses the amounts of the species it depends on,
+    so that it does not depend on the size of the system, unlike the compiled function evaluating all of them.
+    """
+    replacements = dict((s, sympy.Symbol('x[{0}]'.format(i))) for i, s in enumerate(species))
+    replacements.update((p, sympy.Float(float(value))) for p, value in zip(parameter_symbols, parameters))
+
+    # All of the functions are compiled at once, with the division of python 3 so that rationals are not truncated
+    functions = ['lambda x: {0}'.format(lambdarepr(sympy.sympify(propensity).xreplace(replacements)))
+                 for propensity in propensities]
+    source = '[{0}]'.format(', '.join(functions))
+    code = compile(source, '<propensities>', 'eval', __future__.division.compiler_flag, True)
+    return eval(code, vars(math).copy())
+
+
+class _IndexedPriorityQueue(object):
+    """
+    A binary heap of the times of the next occurrence of each reaction,
+    which also keeps the position of each reaction in the heap,
+    so that the time of any of the reactions can be changed in a time logarithmic in the number of reactions.
+    """
+    def __init__(self, times):
+        self.times = list(times)
+        # A sorted list is a valid heap
+        self.heap = sorted(range(len(self.times)), key=self.times.__getitem__)
+        self.positions = [0] * len(self.times)
+        for position, index in enumerate(self.heap):
+            self.positions[index] = position
+
+    def top(self):
+        """
+        The reaction that happens first, and its time
+        """
+        index = self.heap[0]
+        return index, self.times[index]
+
+    def update(self, index, time):
+        """
+        Changes the time of the reaction `index` to `time`, and moves it to its new position in the heap
+        """
+        times = self.times
+        heap = self.heap
+        positions = self.positions
+
+        earlier = time < times[index]
+        times[index] = time
+        position = positions[index]
+        if earlier:
+            while position > 0:
+                parent = (position - 1) >> 1
+                parent_index = heap[parent]
+                if times[parent_index] <= time:
+                    break
+                heap[position] = parent_index
+                positions[parent_index] = position
+                position = parent
+        else:
+            size = len(heap)
+            while True:
+                child = 2 * position + 1
+                if child >= size:
+                    break
+                if child + 1 < size and times[heap[child + 1]] < times[heap[child]]:
+                    child += 1
+                child_index = heap[child]
+                if times[child_index] >= time:
+                    break
+                heap[position] = child_index
+                positions[child_index] = position
+                position = child
+
+        heap[position] = index
+        positions[index] = position
+
+
+class _NextReactionGenerator(_SSAGenerator):
+    def __init__(self, propensities_as_function, parameters, change, species, initial_conditions, timepoints, seed,
+                 propensities, parameter_symbols, dependency_graph):
+        """
+        :param propensities: the propensities of the reactions, as :mod:`sympy` expressions
+        :param parameter_symbols: the symbols of the parameters in the propensities
+        :param dependency_graph: for each reaction, the reactions whose propensities change when it happens
+        See :class:`~means.simulation.ssa._SSAGenerator` for the other parameters
+        """
+        super(_NextReactionGenerator, self).__init__(propensities_as_function, parameters, change, species,
+                                                     initial_conditions, timepoints, seed)
+
+        propensity_functions = _propensities_as_python_functions(propensities, species, parameter_symbols,
+                                                                 parameters)
+        # For each reaction, the reactions whose propensities change when it happens, with their propensities
+        self._dependency_graph = [[(dependent, propensity_functions[dependent]) for dependent in reactions]
+                                  for reactions in dependency_graph]
+        # The species changed by each reaction, with their changes
+        self._sparse_changes = [[(int(i), float(row[i])) for i in np.flatnonzero(row)] for row in self._change]
+
+    def _gssa(self, initial_conditions, timepoints):
+        """
+        Simulates the system with the Next Reaction Method, starting at time zero.
+        The amounts of species are only recorded when the simulated time crosses each of the timepoints.
+
+        :param initial_conditions: the initial conditions of the system
+        :param timepoints: the timepoints to record the amounts of species at
+        :return: the amounts of each species at each of the timepoints, with a row for each timepoint
+        """
+        dependency_graph = self._dependency_graph
+        sparse_changes = self._sparse_changes
+        rng = self._rng
+        infinity = float('inf')
+
+        state = np.array(initial_conditions, dtype=np.double)
+        # All of the propensities are only evaluated at once at the start
+        propensities = np.empty(len(sparse_changes), dtype=np.double)
+        self._propensities_as_function(state, self._parameters, propensities)
+        propensities = propensities.tolist()
+        state = state.tolist()
+
+        times = [exponential / propensity if propensity > 0 else infinity
+                 for exponential, propensity in zip(rng.standard_exponential(len(propensities)).tolist(),
+                                                    propensities)]
+        queue = _IndexedPriorityQueue(times)
+        queue_times = queue.times
+
+        species_over_time = np.empty((len(timepoints), len(state)), dtype=np.double)
+        # The timepoints are visited in increasing order
+        order = np.argsort(timepoints, kind='mergesort').tolist()
+        sorted_timepoints = [float(timepoints[i]) for i in order]
+        number_of_timepoints = len(order)
+        next_timepoint = 0
+
+        # The random numbers are drawn in chunks, and only used as python floats
+        random_number_index = _RANDOM_NUMBERS_CHUNK_SIZE
+        while True:
+            reaction, t = queue.top()
+            if t == infinity:
+                # No reaction can happen any more
+                break
+
+            # The amounts are constant between the reactions, so the timepoints before this one get the current amounts
+            while next_timepoint < number_of_timepoints and sorted_timepoints[next_timepoint] < t:
+                species_over_time[order[next_timepoint]] = state
+                next_timepoint += 1
+            if next_timepoint == number_of_timepoints:
+                break
+
+            for i, species_change in sparse_changes[reaction]:
+                state[i] += species_change
+
+            for dependent, propensity_function in dependency_graph[reaction]:
+                old_propensity = propensities[dependent]
+                propensity = propensity_function(state)
+                propensities[dependent] = propensity
+
+                if not propensity > 0:
+                    time = infinity
+                elif dependent != reaction and old_propensity > 0:
+                    # The remaining time is rescaled to the new propensity, rather than drawn again
+                    time = t + (old_propensity / propensity) * (queue_times[dependent] - t)
+                else:
+                    if random_number_index == _RANDOM_NUMBERS_CHUNK_SIZE:
+                        exponentials = rng.standard_exponential(_RANDOM_NUMBERS_CHUNK_SIZE).tolist()
+                        random_number_index = 0
+                    time = t + exponentials[random_number_index] / propensity
+                    random_number_index += 1
+                queue.update(dependent, time)
+
+        # The amounts do not change after the last reaction
+        species_over_time[order[next_timepoint:]] = state
+        return species_over_time
@@ -34,12 +34,19 @@ See the documentation of :class:`Simulation` for additional information.
 -------------
 """
 
+import multiprocessing
 import numpy as np
 from means.io.serialise import SerialisableObject
+from means.simulation import steady_state
+from means.simulation.cache import SimulationCache
 from means.simulation.solvers import available_solvers
-from means.simulation.trajectory import Trajectory, TrajectoryWithSensitivityData, TrajectoryCollection
+from means.simulation.trajectory import Trajectory, TrajectoryWithSensitivityData, TrajectoryCollection, \
+    TrajectoryCollectionBatch
 from means.core import Moment, VarianceTerm
 
+DEFAULT_STEADY_STATE_TOLERANCE = 1e-6
+DEFAULT_MAX_NEWTON_ITERATIONS = 50
+
 def _validate_problem(problem):
 
     problem.validate()
@@ -59,7 +66,8 @@ def _validate_problem(problem):
 class Simulation(SerialisableObject):
     """
     Class that allows to perform simulations of the trajectories for a particular problem.
-    Implements all ODE solvers supported by Assimulo_ package.
+    Implements all ODE solvers supported by Assimulo_ package,
+    as well as the solvers of :func:`scipy.integrate.solve_ivp`.
 
     .. _Assimulo: http://www.jmodelica.org/assimulo_home/
 
@@ -67,10 +75,13 @@ class Simulation(SerialisableObject):
     __problem = None
     _solver_options = None
     _solver = None
+    # The solver of the last simulation, reset for the next one rather than built again
+    _solver_session = None
+    _cache = None
 
     yaml_tag = '!simulation'
 
-    def __init__(self, problem, solver='ode15s', **solver_options):
+    def __init__(self, problem, solver='ode15s', cache=None, **solver_options):
         """
 
         :param problem: Problem to simulate
@@ -100,6 +111,23 @@ class Simulation(SerialisableObject):
                        `'rungekutta4'`
                             Runge-Kutta method of order 4,
                             see :class:`assimulo.solvers.runge_kutta.RungeKutta4`
+                       `'scipy-bdf'`
+                            Implicit multi-step variable-order BDF method, see :class:`scipy.integrate.BDF`
+                       `'scipy-lsoda'`
+                            LSODA solver, see :class:`scipy.integrate.LSODA`
+                       `'scipy-radau'`
+                            Implicit Runge-Kutta method of order 5, see :class:`scipy.integrate.Radau`
+                       `'scipy-rk45'`
+                            Explicit Runge-Kutta method of order 5(4), see :class:`scipy.integrate.RK45`
+
+                       `'ensemble-euler'`
+                            Explicit Euler method, vectorised over the simulations of :meth:`simulate_batch`,
+                            see :class:`~means.simulation.solvers.EnsembleEulerSolver`
+                       `'ensemble-rungekutta4'`
+                            Runge-Kutta method of order 4, vectorised over the simulations of
+                            :meth:`simulate_batch`, see :class:`~means.simulation.solvers.EnsembleRungeKutta4Solver`
+
+                       The `'scipy-'` and `'ensemble-'` solvers do not need Assimulo.
 
                        The list of these solvers is always accessible at runtime
                        from :meth:`Simulation.supported_solvers()` method.
@@ -107,6 +135,11 @@ class Simulation(SerialisableObject):
                        .. _`ode15s`: http://www.mathworks.ch/ch/help/matlab/ref/ode15s.html
 
         :type solver: basestring
+        :param cache: the cache of the results of :meth:`simulate_system`, if any.
+                      If set to True, a new :class:`~means.simulation.cache.SimulationCache` with the default
+                      settings is used. Simulations with the same parameters, initial conditions and timepoints
+                      are then only performed once.
+        :type cache: bool|:class:`~means.simulation.cache.SimulationCache`
         :param solver_options: options to set in the solver. Consult `Assimulo documentation`_ for available options
                                for information on specific options available.
 
@@ -119,6 +152,12 @@ class Simulation(SerialisableObject):
         self._solver = solver.lower()
         self._solver_options = solver_options
 
+        if cache is True:
+            cache = SimulationCache()
+        elif cache is False:
+            cache = None
+        self._cache = cache
+
     def _append_zeros(self, initial_conditions, number_of_equations):
         """If not all intial conditions specified, append zeros to them
            TODO: is this really the best way to do this?
@@ -139,7 +178,8 @@ class Simulation(SerialisableObject):
         List the supported solvers for the simulations.
 
         >>> Simulation.supported_solvers()
-        ['cvode', 'dopri5', 'euler', 'lsodar', 'radau5', 'rodas', 'rungekutta34', 'rungekutta4', 'ode15s']
+        ['cvode', 'dopri5', 'ensemble-euler', 'ensemble-rungekutta4', 'euler', 'lsodar', 'ode15s', 'radau5', 'rodas',
+         'rungekutta34', 'rungekutta4', 'scipy-bdf', 'scipy-lsoda', 'scipy-radau', 'scipy-rk45']
 
         :return: the names of the solvers supported for simulations
         """
@@ -159,11 +199,18 @@ class Simulation(SerialisableObject):
 
     def _initialise_solver(self, initial_conditions, parameters, timepoints):
 
+        solver = self._solver_session
+        if solver is not None:
+            solver.reset(parameters, initial_conditions, starting_time=timepoints[0])
+            return solver
+
         solver = self._solver_class(self.problem, parameters, initial_conditions, starting_time=timepoints[0],
                                     **self._solver_options)
+        if solver._supports_reset:
+            self._solver_session = solver
         return solver
 
-    def simulate_system(self, parameters, initial_conditions, timepoints):
+    def simulate_system(self, parameters, initial_conditions, timepoints, outputs=None):
         """
         Simulates the system for each of the timepoints, starting at initial_constants and initial_values values
 
@@ -173,16 +220,184 @@ class Simulation(SerialisableObject):
                                these equations occur.
                                If not all values specified, the remaining ones will be assumed to be 0.
         :param timepoints: A list of time points to simulate the system for
+        :param outputs: the descriptors of the equations in the problem to return the trajectories of, in that order.
+                        All of the equations are still simulated, but only the trajectories of these ones are built.
+                        If None, the trajectories of all of the equations are returned.
         :return: a list of :class:`~means.simulation.Trajectory` objects,
-                 one for each of the equations in the problem
+                 one for each of the equations in the problem, or for each of the `outputs`
         :rtype: list[:class:`~means.simulation.Trajectory`]
         """
 
         initial_conditions = self._append_zeros(initial_conditions, self.problem.number_of_equations)
+
+        cache = self._cache
+        if cache is not None:
+            description = self._cache_description
+            if outputs is not None:
+                # The simulations of different outputs are cached separately
+                description += repr(list(outputs))
+            key = cache.key(description, parameters, initial_conditions, timepoints)
+            trajectories = cache.get(key)
+            if trajectories is not None:
+                return trajectories
+
         solver = self._initialise_solver(initial_conditions, parameters, timepoints)
-        trajectories = solver.simulate(timepoints)
+        try:
+            trajectories = solver.simulate(timepoints, outputs=outputs)
+        except Exception:
+            # Do not reuse a solver that has failed, as its state is not known
+            self._solver_session = None
+            raise
+
+        trajectories = TrajectoryCollection(trajectories)
+        if cache is not None:
+            cache.put(key, trajectories)
+        return trajectories
+
+    def simulate_to_steady_state(self, parameters, initial_conditions, max_time, starting_time=0.0,
+                                 tolerance=DEFAULT_STEADY_STATE_TOLERANCE, newton=False,
+                                 max_newton_iterations=DEFAULT_MAX_NEWTON_ITERATIONS):
+        """
+        Simulates the system from the initial conditions until it reaches a steady state,
+        rather than up to a fixed time.
+
+        The simulation stops as soon as the :func:`~means.simulation.steady_state.residual` of the right hand side
+        of the equations is within the `tolerance`. The scipy solvers (e.g. `'scipy-lsoda'`) stop exactly
+        when it is, with an event. The other solvers check it at the end of windows of increasing length.
+
+        :param parameters: list of the values for the constants in the model.
+                           Must be in the same order as in the model
+        :param initial_conditions: List of the initial values for the equations in the problem.
+                                   If not all values specified, the remaining ones will be assumed to be 0.
+        :param max_time: the time to stop the simulation at, if the steady state is not reached before
+        :param starting_time: the time the simulation starts at
+        :param tolerance: the largest residual of a steady state
+        :param newton: if set to True, the values reached by the simulation are refined with Newton's method,
+                       see :func:`~means.simulation.steady_state.newton`. They are then usually much more accurate
+                       than the tolerance, and the simulation does not need to reach it if Newton's method does.
+        :param max_newton_iterations: the largest number of iterations of Newton's method
+        :return: the values of each of the equations, with diagnostics of the convergence
+        :rtype: :class:`~means.simulation.steady_state.SteadyState`
+        """
+        if max_time <= starting_time:
+            raise ValueError('Expected the maximum time to be after the starting time, '
+                             'got {0!r} and {1!r}'.format(max_time, starting_time))
+
+        parameters = np.array(parameters, dtype=float)
+        initial_conditions = self._append_zeros(initial_conditions, self.problem.number_of_equations)
+        solver = self._initialise_solver(initial_conditions, parameters, [starting_time])
+        try:
+            time, values, converged = solver.simulate_to_steady_state(tolerance, max_time)
+        except Exception:
+            self._solver_session = None
+            raise
+
+        if converged:
+            message = 'Steady state reached'
+        else:
+            message = 'Maximum time reached before the steady state'
+
+        newton_iterations = None
+        if newton:
+            values, newton_iterations, newton_message = steady_state.newton(self.problem, parameters, values,
+                                                                            max_newton_iterations)
+            message = '{0}. {1}'.format(message, newton_message)
+
+        rhs = self.problem.right_hand_side_as_function
+        residual = steady_state.residual(rhs(values, parameters), values)
+        return steady_state.SteadyState(self.problem.left_hand_side_descriptors, values, time, residual,
+                                        residual <= tolerance, newton_iterations=newton_iterations, message=message)
 
-        return TrajectoryCollection(trajectories)
+    @property
+    def _cache_description(self):
+        # The simulations with different solvers, or different options, are cached separately
+        return repr((self.__class__.__name__, self._solver, sorted(self._solver_options.items())))
+
+    def simulate_batch(self, parameter_matrix, initial_condition_matrix, timepoints, number_of_processes=1,
+                       outputs=None):
+        """
+        Simulates the system for each of the parameter sets in `parameter_matrix`,
+        starting at the corresponding initial conditions in `initial_condition_matrix`.
+
+        The right hand side of the problem is compiled only once (once per process, if `number_of_processes` > 1),
+        and shared between all of the simulations.
+
+        :param parameter_matrix: a matrix with one set of parameters per row,
+                                 each set in the same order as in the model.
+                                 A single set of parameters is used for all the simulations.
+        :param initial_condition_matrix: a matrix with one set of initial conditions per row,
+                                         each set in the same order as the equations in the problem.
+                                         If not all values specified, the remaining ones will be assumed to be 0.
+                                         A single set of initial conditions is used for all the simulations.
+        :param timepoints: A list of time points to simulate the system for
+        :param number_of_processes: if set to more than 1, the simulations are distributed among this many processes.
+                                    Ensemble solvers (e.g. `'ensemble-rungekutta4'`) simulate all of the rows
+                                    at once in the current process, and ignore it.
+        :param outputs: the descriptors of the equations to return the trajectories of,
+                        see :meth:`simulate_system`
+        :return: a list of :class:`~means.simulation.TrajectoryCollection` objects,
+                 one for each row of `parameter_matrix` and `initial_condition_matrix`, in the same order.
+                 Its `values` are the values of all of the simulations stacked in a single array,
+                 with a matrix for each simulation
+        :rtype: :class:`~means.simulation.trajectory.TrajectoryCollectionBatch`
+        """
+        parameter_matrix = np.atleast_2d(np.asarray(parameter_matrix, dtype=float))
+        initial_condition_matrix = np.atleast_2d(np.asarray(initial_condition_matrix, dtype=float))
+
+        if parameter_matrix.shape[1] != len(self.problem.parameters):
+            raise ValueError('Expected {0} parameters per row, '
+                             'got {1}'.format(len(self.problem.parameters), parameter_matrix.shape[1]))
+
+        number_of_equations = self.problem.number_of_equations
+        if initial_condition_matrix.shape[1] > number_of_equations:
+            raise ValueError('Expected at most {0} initial conditions per row, '
+                             'got {1}'.format(number_of_equations, initial_condition_matrix.shape[1]))
+
+        # A single row is used for all simulations
+        number_of_simulations = max(parameter_matrix.shape[0], initial_condition_matrix.shape[0])
+        if parameter_matrix.shape[0] == 1:
+            parameter_matrix = np.repeat(parameter_matrix, number_of_simulations, axis=0)
+        if initial_condition_matrix.shape[0] == 1:
+            initial_condition_matrix = np.repeat(initial_condition_matrix, number_of_simulations, axis=0)
+        if parameter_matrix.shape[0] != initial_condition_matrix.shape[0]:
+            raise ValueError('There are {0} sets of parameters and {1} sets of initial conditions. '
+                             'The same number is expected'.format(parameter_matrix.shape[0],
+                                                                  initial_condition_matrix.shape[0]))
+
+        # Append the zeros once for all the simulations
+        initial_condition_matrix = np.hstack((initial_condition_matrix,
+                                              np.zeros((number_of_simulations,
+                                                        number_of_equations - initial_condition_matrix.shape[1]))))
+
+        if self._solver_class._supports_ensembles:
+            # Ensemble solvers simulate all of the rows at once
+            solver = self._solver_class(self.problem, parameter_matrix, initial_condition_matrix,
+                                        starting_time=timepoints[0], **self._solver_options)
+            return TrajectoryCollectionBatch(solver.simulate_ensemble(timepoints, outputs=outputs))
+        elif number_of_processes == 1:
+            return TrajectoryCollectionBatch(self.simulate_system(parameters, initial_conditions, timepoints,
+                                                                 outputs=outputs)
+                                             for parameters, initial_conditions in zip(parameter_matrix,
+                                                                                       initial_condition_matrix))
+        else:
+            p = multiprocessing.Pool(number_of_processes, initializer=multiprocessing_pool_initialiser,
+                                     initargs=[self, timepoints, outputs])
+            try:
+                results = p.map(multiprocessing_apply_simulation, zip(parameter_matrix, initial_condition_matrix))
+                p.close()
+            except:
+                # Do not leave the processes behind if any of the simulations failed
+                p.terminate()
+                raise
+            finally:
+                p.join()
+
+            # The trajectories come back described by copies of the descriptors of the problem, use the original ones
+            descriptors = self.problem.left_hand_side_descriptors if outputs is None else outputs
+            for trajectories in results:
+                for trajectory, descriptor in zip(trajectories, descriptors):
+                    trajectory.set_description(descriptor)
+            return TrajectoryCollectionBatch(results)
 
     @property
     def problem(self):
@@ -196,11 +411,26 @@ class Simulation(SerialisableObject):
     def solver_options(self):
         return self._solver_options
 
+    @property
+    def cache(self):
+        """
+        The :class:`~means.simulation.cache.SimulationCache` of the simulation results, or None if they are not cached
+        """
+        return self._cache
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The solver cannot be pickled, and is built again when needed
+        state.pop('_solver_session', None)
+        return state
+
     @classmethod
     def to_yaml(cls, dumper, data):
 
         mapping = [('problem', data.problem),
                    ('solver', data._solver)]
+        if data.cache is not None:
+            mapping.append(('cache', data.cache))
         mapping.extend(data._solver_options.items())
 
         return dumper.represent_mapping(cls.yaml_tag, mapping)
@@ -212,6 +442,22 @@ class Simulation(SerialisableObject):
         return self.problem == other.problem and self.solver == other.solver \
             and self.solver_options == other.solver_options
 
+def multiprocessing_pool_initialiser(simulation, timepoints, outputs=None):
+    global batch_simulation, batch_timepoints, batch_outputs
+    batch_simulation = simulation
+    batch_timepoints = timepoints
+    batch_outputs = outputs
+    # Compile the right hand side once, before any of the simulations in this process
+    simulation.problem.right_hand_side_as_function
+
+def multiprocessing_apply_simulation(parameters_and_initial_conditions):
+    """
+    Used in `Simulation.simulate_batch`.
+    Needs to be in global scope for multiprocessing module to pick it up
+    """
+    parameters, initial_conditions = parameters_and_initial_conditions
+    return batch_simulation.simulate_system(parameters, initial_conditions, batch_timepoints, outputs=batch_outputs)
+
 class SimulationWithSensitivities(Simulation):
     """
     A similar class to it's baseclass :class:`~means.simulation.simulate.Simulation`.
@@ -220,7 +466,9 @@ class SimulationWithSensitivities(Simulation):
 
     """
 
-    def __init__(self, problem, solver='ode15s', **solver_options):
+    SENSITIVITY_METHODS = ['staggered', 'simultaneous']
+
+    def __init__(self, problem, solver='ode15s', sensitivity_method=None, cache=None, **solver_options):
         """
 
         :param problem: Problem to simulate
@@ -233,19 +481,38 @@ class SimulationWithSensitivities(Simulation):
                        `'ode15s`:
                             sundials CVODE solver, with default parameters set to mimick the MATLAB's
                             See :class:`~means.simulation.solvers.ODE15sMixin` for the list of these parameters.
+                       `'scipy-bdf'`, `'scipy-lsoda'`, `'scipy-radau'`, `'scipy-rk45'`
+                            The solvers of :func:`scipy.integrate.solve_ivp`,
+                            see :class:`~means.simulation.solvers.ScipySensitivitySolverBase`
 
                        .. _`ode15s`: http://www.mathworks.ch/ch/help/matlab/ref/ode15s.html
 
                        The list of these solvers is always accessible at runtime
                        from :meth:`SimulationWithSensitivities.supported_solvers()` method.
 
+                       The sensitivities are computed from the exact derivatives of the equations
+                       with respect to the parameters.
+
         :type solver: basestring
+        :param sensitivity_method: how the sensitivity equations are solved together with the equations:
+                                   `'staggered'` (after the equations have converged at each step,
+                                   the default for CVODE) or `'simultaneous'` (as a single system,
+                                   the default for the scipy solvers). Sets the ``sensmethod`` option of the solver.
+        :type sensitivity_method: basestring
+        :param cache: the cache of the simulation results, if any, see :class:`Simulation`
+        :type cache: bool|:class:`~means.simulation.cache.SimulationCache`
         :param solver_options: options to set in the solver. Consult `Assimulo documentation`_ for available options
                                for information on specific options available.
 
         .. _`Assimulo documentation`: http://www.jmodelica.org/assimulo_home/
         """
-        super(SimulationWithSensitivities, self).__init__(problem, solver, **solver_options)
+        if sensitivity_method is not None:
+            if sensitivity_method.lower() not in self.SENSITIVITY_METHODS:
+                raise ValueError('Unknown sensitivity method {0!r}, '
+                                 'use one of {1!r}'.format(sensitivity_method, self.SENSITIVITY_METHODS))
+            solver_options['sensmethod'] = sensitivity_method.upper()
+
+        super(SimulationWithSensitivities, self).__init__(problem, solver, cache=cache, **solver_options)
 
     @classmethod
     def _supported_solvers_dict(cls):
@@ -257,14 +524,14 @@ class SimulationWithSensitivities(Simulation):
         List the supported solvers for the simulations.
 
         >>> SimulationWithSensitivities.supported_solvers()
-        ['cvode', 'ode15s']
+        ['cvode', 'ode15s', 'scipy-bdf', 'scipy-lsoda', 'scipy-radau', 'scipy-rk45']
 
         :return: the names of the solvers supported for simulations
         """
         return super(SimulationWithSensitivities, cls).supported_solvers()
 
 
-    def simulate_system(self, parameters, initial_conditions, timepoints):
+    def simulate_system(self, parameters, initial_conditions, timepoints, outputs=None):
         """
         Simulates the system for each of the timepoints, starting at initial_constants and initial_values values
 
@@ -274,8 +541,11 @@ class SimulationWithSensitivities(Simulation):
                                these equations occur.
                                If not all values specified, the remaining ones will be assumed to be 0.
         :param timepoints: A list of time points to simulate the system for
+        :param outputs: the descriptors of the equations to return the trajectories of,
+                        see :meth:`Simulation.simulate_system`
         :return: a list of :class:`~means.simulation.TrajectoryWithSensitivityData` objects,
-                 one for each of the equations in the problem
+                 one for each of the equations in the problem, or for each of the `outputs`
         :rtype: list[:class:`~means.simulation.TrajectoryWithSensitivityData`]
         """
-        return super(SimulationWithSensitivities, self).simulate_system(parameters, initial_conditions, timepoints)
+        return super(SimulationWithSensitivities, self).simulate_system(parameters, initial_conditions, timepoints,
+                                                                        outputs=outputs)
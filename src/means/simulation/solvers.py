@@ -2,18 +2,23 @@
 Solvers
 -------
 
-This part of the package provides wrappers around Assimulo solvers.
+This part of the package provides wrappers around Assimulo solvers,
+and around the solvers of :func:`scipy.integrate.solve_ivp`, which do not require Assimulo.
 """
-from assimulo.problem import Explicit_Problem
 import numpy as np
 import sys
 from means.simulation import SensitivityTerm
-from means.simulation.trajectory import Trajectory, TrajectoryWithSensitivityData
+from means.simulation.steady_state import residual
+from means.simulation.trajectory import Trajectory, TrajectoryWithSensitivityData, TrajectoryCollection
 import inspect
 from means.util.memoisation import memoised_property, MemoisableObject
 from means.util.sympyhelpers import to_one_dim_array
 
 NP_FLOATING_POINT_PRECISION = np.double
+# The number of windows, halving in length towards the start, the steady state is looked for in by default
+_STEADY_STATE_WINDOWS = 16
+# The steady state events locate their roots approximately, so they aim slightly within the tolerance
+_STEADY_STATE_EVENT_MARGIN = 1e-3
 
 #-- Easy initialisation utilities -------------------------------------------------------------
 
@@ -108,18 +113,20 @@ def _set_kwargs_as_attributes(instance, **kwargs):
         setattr(instance, attribute, value)
     return instance
 
-def _wrap_results_to_trajectories(simulated_timepoints, simulated_values, descriptions):
+def _wrap_results_to_trajectories(simulated_timepoints, simulated_values, descriptions, columns=None):
     number_of_timepoints, number_of_simulated_values = simulated_values.shape
 
     assert(len(descriptions) == number_of_simulated_values)
     assert(len(simulated_timepoints) == number_of_timepoints)
 
-    # Wrap results to trajectories
-    trajectories = []
-    for description, simulated_value_column in zip(descriptions, simulated_values.T):
-        trajectories.append(Trajectory(simulated_timepoints, simulated_value_column, description))
+    values = simulated_values.T
+    if columns is not None:
+        # Only the selected columns are copied
+        values = values[columns]
+        descriptions = [descriptions[column] for column in columns]
 
-    return trajectories
+    # Wrap results to a collection that keeps them in a single array, the trajectories are views of its rows
+    return TrajectoryCollection.from_array(simulated_timepoints, values, descriptions)
 
 
 class SolverBase(MemoisableObject):
@@ -135,6 +142,13 @@ class SolverBase(MemoisableObject):
     _starting_time = None
     _options = None
 
+    # Whether the solver can make use of the analytic Jacobian of the problem
+    _supports_jacobian = False
+    # Whether the solver can be reset to simulate from new initial conditions and parameters, see `reset`
+    _supports_reset = True
+    # Whether the solver can simulate many sets of parameters and initial conditions at once, see `EnsembleSolverBase`
+    _supports_ensembles = False
+
     def __init__(self, problem, parameters, initial_conditions, starting_time=0.0, **options):
         """
 
@@ -161,34 +175,156 @@ class SolverBase(MemoisableObject):
         self._problem = problem
         self._options = options
 
-    def simulate(self, timepoints):
+    def reset(self, parameters, initial_conditions, starting_time=0.0):
+        """
+        Resets the solver so the next simulation starts from `initial_conditions` at `starting_time`,
+        with the new `parameters`.
+        The underlying assimulo solver is reinitialised in place rather than built again,
+        so its options are kept, and its memory is reused.
+
+        :param parameters: Parameters of the solver. One entry for each constant in `problem`
+        :type parameters: :class:`iterable`
+        :param initial_conditions: Initial conditions of the system. One for each of the equations.
+        :type initial_conditions: :class:`iterable`
+        :param starting_time: Starting time for the solver, defaults to 0.0
+        :type starting_time: float
+        """
+        if not self._supports_reset:
+            raise NotImplementedError('{0!r} cannot be reset'.format(self.__class__.__name__))
+
+        parameters = to_one_dim_array(parameters, dtype=NP_FLOATING_POINT_PRECISION)
+        initial_conditions = to_one_dim_array(initial_conditions, dtype=NP_FLOATING_POINT_PRECISION)
+
+        assert(parameters.shape == self._parameters.shape)
+        assert(initial_conditions.shape == self._initial_conditions.shape)
+
+        # The right hand side and Jacobian functions given to the solver refer to these arrays,
+        # so they need to be updated in place
+        self._parameters[:] = parameters
+        self._initial_conditions[:] = initial_conditions
+        self._starting_time = float(starting_time)
+
+        self._reset_solver()
+
+    def _reset_solver(self):
+        """
+        Reinitialises the underlying solver from the current initial conditions and starting time.
+        Subclasses that do not keep any state between simulations can override it.
+        """
+        self._solver.re_init(self._starting_time, self._initial_conditions.copy())
+
+    def _integrate(self, solver, timepoints):
+        """
+        Runs the underlying `solver` up to the last of the `timepoints`.
+
+        :return: the simulated timepoints and a matrix of the simulated values, with one row per timepoint
+        """
+        return solver.simulate(timepoints[-1], ncp_list=timepoints)
+
+    def simulate(self, timepoints, outputs=None):
         """
         Simulate initialised solver for the specified timepoints
 
         :param timepoints: timepoints that will be returned from simulation
-        :return: a list of trajectories for each of the equations in the problem.
+        :param outputs: the descriptors of the equations to return the trajectories of, in that order,
+                        or None for all of the equations in the problem
+        :return: a list of trajectories for each of the equations in the problem, or for each of the `outputs`.
         """
+        columns = self._output_columns(outputs)
+
         solver = self._solver
-        last_timepoint = timepoints[-1]
         try:
-            simulated_timepoints, simulated_values = solver.simulate(last_timepoint, ncp_list=timepoints)
+            simulated_timepoints, simulated_values = self._integrate(solver, timepoints)
 
         except (Exception, self._solver_exception_class) as e:
-            # The exceptions thrown by solvers are usually hiding the real cause, try to see if it is
-            # our right_hand_side_as_function that is broken first
-            try:
-                self._problem.right_hand_side_as_function(self._initial_conditions, self._parameters)
-            except:
-                # If it is broken, throw that exception instead
-                raise
-            else:
-                # If it is not, handle the original exception
-                self._handle_solver_exception(e)
-
-        trajectories =  self._results_to_trajectories(simulated_timepoints, simulated_values)
+            self._handle_integration_exception(e)
+
+        trajectories =  self._results_to_trajectories(simulated_timepoints, simulated_values, columns)
 
         return trajectories
 
+    @memoised_property
+    def _equation_indices(self):
+        return {description: i for i, description in enumerate(self._problem.left_hand_side_descriptors)}
+
+    def _output_columns(self, outputs):
+        """
+        The indices of the equations of the `outputs` descriptors, or None for all of the equations.
+
+        :raises ValueError: if some of the outputs are not equations of the problem
+        """
+        if outputs is None:
+            return None
+
+        equation_indices = self._equation_indices
+        try:
+            return [equation_indices[output] for output in outputs]
+        except KeyError as e:
+            raise ValueError('{0!r} is not one of the equations of the problem'.format(e.args[0]))
+
+    def simulate_to_steady_state(self, tolerance, max_time):
+        """
+        Simulate initialised solver until the system reaches a steady state, i.e. until the
+        :func:`~means.simulation.steady_state.residual` of the right hand side is within the `tolerance`,
+        or until `max_time` if it does not.
+
+        :param tolerance: the largest residual of a steady state
+        :param max_time: the time to stop at if the steady state is not reached
+        :return: the time the simulation stopped at, the values of the equations then,
+                 and whether the steady state was reached
+        """
+        solver = self._solver
+        try:
+            return self._integrate_to_steady_state(solver, tolerance, max_time)
+        except (Exception, self._solver_exception_class) as e:
+            self._handle_integration_exception(e)
+
+    def _steady_state_residual(self, values):
+        rhs = self._problem.right_hand_side_as_function
+        return residual(rhs(values, self._parameters), values)
+
+    def _integrate_to_steady_state(self, solver, tolerance, max_time):
+        """
+        Runs the underlying `solver` until a steady state is reached, see :meth:`simulate_to_steady_state`.
+        By default, the solver is run over windows of geometrically increasing length,
+        and the residual is checked at the end of each of them.
+        Solvers that cannot be reset are built again for each window.
+        Subclasses that can stop the solver on an event should override it.
+        """
+        t = self._starting_time
+        values = self._initial_conditions.copy()
+        window = (max_time - t) / 2.0 ** _STEADY_STATE_WINDOWS
+        window_solver = self
+        while True:
+            if self._steady_state_residual(values) <= tolerance:
+                return t, values, True
+            if t >= max_time:
+                return t, values, False
+
+            end = min(t + window, max_time)
+            _, simulated_values = window_solver._integrate(solver, np.array([t, end]))
+            t, values = end, np.array(simulated_values[-1], dtype=NP_FLOATING_POINT_PRECISION)
+            window *= 2
+            if t < max_time:
+                if self._supports_reset:
+                    self.reset(self._parameters.copy(), values, starting_time=t)
+                else:
+                    window_solver = self.__class__(self._problem, self._parameters, values, starting_time=t,
+                                                   **self._options)
+                    solver = window_solver._solver
+
+    def _handle_integration_exception(self, exception):
+        # The exceptions thrown by solvers are usually hiding the real cause, try to see if it is
+        # our right_hand_side_as_function that is broken first
+        try:
+            self._problem.right_hand_side_as_function(self._initial_conditions, self._parameters)
+        except:
+            # If it is broken, throw that exception instead
+            raise
+        else:
+            # If it is not, handle the original exception
+            self._handle_solver_exception(exception)
+
     def _handle_solver_exception(self, solver_exception):
         """
         This function handles any exceptions that occurred in the solver and have been proven not to be
@@ -214,11 +350,43 @@ class SolverBase(MemoisableObject):
     @memoised_property
     def _solver(self):
         solver = self._default_solver_instance()
-        verbosity = self._options.pop('verbosity', 50)
-        return _set_kwargs_as_attributes(solver, verbosity=verbosity, **self._options)
+        # The options are kept as they are, so that the solver can be built again from them
+        options = self._options.copy()
+        verbosity = options.pop('verbosity', 50)
+        return _set_kwargs_as_attributes(solver, verbosity=verbosity, **options)
+
+    @property
+    def _uses_jacobian(self):
+        """
+        Whether the analytic Jacobian should be passed to the solver.
+        It can be turned off by setting the ``usejac`` option to False,
+        in which case the solver approximates it by finite differences.
+        """
+        return self._supports_jacobian and self._options.get('usejac', True)
+
+    @property
+    def _uses_sparse_jacobian(self):
+        """
+        Whether the sparse Jacobian should be used, i.e. whether the ``linear_solver`` option
+        of the solver is set to ``'SPARSE'``.
+        """
+        return str(self._options.get('linear_solver', '')).upper() == 'SPARSE'
+
+    @property
+    def _jacobian_function(self):
+        """
+        The Jacobian function of the problem. The sparse version of it is used if the ``linear_solver`` option
+        of the solver is set to ``'SPARSE'``.
+        """
+        if self._uses_sparse_jacobian:
+            return self._problem.sparse_jacobian_as_function
+        else:
+            return self._problem.jacobian_as_function
 
     @memoised_property
     def _assimulo_problem(self):
+        from assimulo.problem import Explicit_Problem
+
         rhs = self._problem.right_hand_side_as_function
         parameters = self._parameters
         initial_conditions = self._initial_conditions
@@ -227,20 +395,28 @@ class SolverBase(MemoisableObject):
         model = Explicit_Problem(lambda t, x: rhs(x, parameters),
                                  initial_conditions, initial_timepoint)
 
+        if self._uses_jacobian:
+            jacobian = self._jacobian_function
+            model.jac = lambda t, x: jacobian(x, parameters)
+            if self._uses_sparse_jacobian:
+                # The sparse linear solver is sized by the number of non-zero entries of the Jacobian
+                model.jac_nnz = len(self._problem._jacobian_sparsity[0])
+
         return model
 
-    def _results_to_trajectories(self, simulated_timepoints, simulated_values):
+    def _results_to_trajectories(self, simulated_timepoints, simulated_values, columns=None):
         """
         Convert the resulting results into a list of trajectories
 
         :param simulated_timepoints: timepoints output from a solver
         :param simulated_values: values returned by the solver
+        :param columns: the indices of the equations to convert, or None for all of them
         :return:
         """
 
         descriptions = self._problem.left_hand_side_descriptors
 
-        return _wrap_results_to_trajectories(simulated_timepoints, simulated_values, descriptions)
+        return _wrap_results_to_trajectories(simulated_timepoints, simulated_values, descriptions, columns)
 
 
 class CVodeMixin(UniqueNameInitialisationMixin, object):
@@ -267,6 +443,9 @@ class CVodeMixin(UniqueNameInitialisationMixin, object):
 
 class CVodeSolver(SolverBase, CVodeMixin):
 
+    # The solver base comes first, so this is set here rather than in the mixin
+    _supports_jacobian = True
+
     def _default_solver_instance(self):
         solver = self._cvode_instance(self._assimulo_problem, self._options)
         # It is necessary to set usesens to false here as we are non-parametric here
@@ -314,6 +493,9 @@ class ODE15sMixin(CVodeMixin):
 
 class ODE15sLikeSolver(SolverBase, ODE15sMixin):
 
+    # The solver base comes first, so this is set here rather than in the mixin
+    _supports_jacobian = True
+
     def _default_solver_instance(self):
         solver = self._cvode_instance(self._assimulo_problem, self._options)
         # It is necessary to set usesens to false here as we are non-parametric here
@@ -352,6 +534,8 @@ class Dopri5Solver(SolverBase, UniqueNameInitialisationMixin):
 
 class LSODARSolver(SolverBase, UniqueNameInitialisationMixin):
 
+    _supports_jacobian = True
+
     @property
     def _solver_exception_class(self):
         from assimulo.exception import ODEPACK_Exception
@@ -400,15 +584,10 @@ class ExplicitEulerSolver(SolverBase, UniqueNameInitialisationMixin):
     def unique_name(cls):
         return 'euler'
 
-    def simulate(self, timepoints):
+    def simulate(self, timepoints, outputs=None):
         # Euler solver does not return the correct timepoints for some reason, work around that by resampling them
-        trajectories = super(ExplicitEulerSolver, self).simulate(timepoints)
-
-        resampled_trajectories = []
-        for trajectory in trajectories:
-            resampled_trajectories.append(trajectory.resample(timepoints))
-
-        return resampled_trajectories
+        trajectories = super(ExplicitEulerSolver, self).simulate(timepoints, outputs=outputs)
+        return trajectories.resample(timepoints)
 
 
 class RungeKutta4Solver(SolverBase, UniqueNameInitialisationMixin):
@@ -422,15 +601,10 @@ class RungeKutta4Solver(SolverBase, UniqueNameInitialisationMixin):
     def unique_name(cls):
         return 'rungekutta4'
 
-    def simulate(self, timepoints):
+    def simulate(self, timepoints, outputs=None):
         # RungeKutta4 solver does not return the correct timepoints for some reason, work around that by resampling them
-        trajectories = super(RungeKutta4Solver, self).simulate(timepoints)
-
-        resampled_trajectories = []
-        for trajectory in trajectories:
-            resampled_trajectories.append(trajectory.resample(timepoints))
-
-        return resampled_trajectories
+        trajectories = super(RungeKutta4Solver, self).simulate(timepoints, outputs=outputs)
+        return trajectories.resample(timepoints)
 
 class RungeKutta34Solver(SolverBase, UniqueNameInitialisationMixin):
 
@@ -445,6 +619,8 @@ class RungeKutta34Solver(SolverBase, UniqueNameInitialisationMixin):
 
 class Radau5Solver(SolverBase, UniqueNameInitialisationMixin):
 
+    _supports_jacobian = True
+
     def _default_solver_instance(self):
         from assimulo.solvers import Radau5ODE
 
@@ -476,6 +652,8 @@ class Radau5Solver(SolverBase, UniqueNameInitialisationMixin):
 
 class RodasSolver(SolverBase, UniqueNameInitialisationMixin):
 
+    _supports_jacobian = True
+
     def _default_solver_instance(self):
         from assimulo.solvers import RodasODE
         return RodasODE(self._assimulo_problem)
@@ -504,6 +682,301 @@ class RodasSolver(SolverBase, UniqueNameInitialisationMixin):
         # Use the superclass method to rethrow the exception with our wrapper
         super(RodasSolver, self)._handle_solver_exception(exception)
 
+#-- SciPy solvers ------------------------------------------------------------------------------------------------------
+
+class ScipySolverError(Exception):
+    pass
+
+class ScipySolverBase(SolverBase):
+    """
+    A base class for the solvers of :func:`scipy.integrate.solve_ivp`.
+    These use the same compiled right hand side and Jacobian as the Assimulo solvers, but do not need Assimulo.
+
+    The options are passed to :func:`scipy.integrate.solve_ivp`, e.g. ``rtol``, ``atol``, ``max_step``
+    or ``first_step``. The Jacobian is not used if ``usejac`` is set to False.
+    """
+
+    # The name of the method in `scipy.integrate.solve_ivp`
+    _method = None
+    # Whether the method can use a sparse Jacobian, see `SolverBase._jacobian_function`
+    _supports_sparse_jacobian = False
+
+    @property
+    def _scipy_options(self):
+        options = self._options.copy()
+        for option in ['verbosity', 'usejac', 'linear_solver']:
+            options.pop(option, None)
+        return options
+
+    @property
+    def _jacobian_function(self):
+        if self._supports_sparse_jacobian:
+            return super(ScipySolverBase, self)._jacobian_function
+        else:
+            return self._problem.jacobian_as_function
+
+    @property
+    def _solver(self):
+        # A new integration is started for each simulation, so there is no solver to keep
+        return None
+
+    def _reset_solver(self):
+        pass
+
+    def _solve_ivp(self, end_time, **kwargs):
+        from scipy.integrate import solve_ivp
+
+        rhs = self._problem.right_hand_side_as_function
+        parameters = self._parameters
+
+        options = self._scipy_options
+        if self._uses_jacobian:
+            jacobian = self._jacobian_function
+            options['jac'] = lambda t, x: jacobian(x, parameters)
+        options.update(kwargs)
+
+        result = solve_ivp(lambda t, x: rhs(x, parameters), (self._starting_time, end_time),
+                           self._initial_conditions, method=self._method, **options)
+        if not result.success:
+            raise ScipySolverError('{0} failed: {1}'.format(self._method, result.message))
+        return result
+
+    def _integrate(self, solver, timepoints):
+        timepoints = np.asarray(timepoints, dtype=NP_FLOATING_POINT_PRECISION)
+        result = self._solve_ivp(timepoints[-1], t_eval=timepoints)
+        return result.t, result.y.T
+
+    def _integrate_to_steady_state(self, solver, tolerance, max_time):
+        # The integration is stopped by an event as soon as the residual is within the tolerance
+        if self._steady_state_residual(self._initial_conditions) <= tolerance:
+            return self._starting_time, self._initial_conditions.copy(), True
+
+        threshold = tolerance * (1 - _STEADY_STATE_EVENT_MARGIN)
+
+        def event(t, x):
+            return self._steady_state_residual(x) - threshold
+        event.terminal = True
+        event.direction = -1
+
+        result = self._solve_ivp(max_time, events=[event])
+        return result.t[-1], result.y[:, -1], result.status == 1
+
+class ScipyLSODASolver(ScipySolverBase, UniqueNameInitialisationMixin):
+    """
+    LSODA solver, see :class:`scipy.integrate.LSODA`
+    """
+
+    _method = 'LSODA'
+    _supports_jacobian = True
+
+    @classmethod
+    def unique_name(cls):
+        return 'scipy-lsoda'
+
+class ScipyBDFSolver(ScipySolverBase, UniqueNameInitialisationMixin):
+    """
+    Implicit multi-step variable-order BDF solver, see :class:`scipy.integrate.BDF`
+    """
+
+    _method = 'BDF'
+    _supports_jacobian = True
+    _supports_sparse_jacobian = True
+
+    @classmethod
+    def unique_name(cls):
+        return 'scipy-bdf'
+
+class ScipyRadauSolver(ScipySolverBase, UniqueNameInitialisationMixin):
+    """
+    Implicit Runge-Kutta method of the Radau IIA family of order 5, see :class:`scipy.integrate.Radau`
+    """
+
+    _method = 'Radau'
+    _supports_jacobian = True
+    _supports_sparse_jacobian = True
+
+    @classmethod
+    def unique_name(cls):
+        return 'scipy-radau'
+
+class ScipyRK45Solver(ScipySolverBase, UniqueNameInitialisationMixin):
+    """
+    Explicit Runge-Kutta method of order 5(4), see :class:`scipy.integrate.RK45`
+    """
+
+    _method = 'RK45'
+
+    @classmethod
+    def unique_name(cls):
+        return 'scipy-rk45'
+
+#-- Ensemble solvers ---------------------------------------------------------------------------------------------------
+
+class EnsembleSolverBase(SolverBase):
+    """
+    A base class for fixed-step solvers that simulate an ensemble of parameter sets and initial conditions at once.
+    The state of all simulations is kept in a single matrix, with one row per simulation,
+    and the right hand side is evaluated for all of them in a single call to
+    :attr:`~means.core.problems.ODEProblem.right_hand_side_as_batch_function`.
+
+    The parameters and the initial conditions can be given as matrices, with one row per simulation,
+    in which case :meth:`simulate_ensemble` should be used to simulate all of them.
+    :meth:`simulate` can only be used for a single simulation.
+
+    The step size is set by the ``h`` option, defaulting to ``0.01`` as in the Assimulo fixed-step solvers.
+    Steps are shortened so that each of the timepoints is reached exactly.
+    """
+
+    _supports_ensembles = True
+
+    DEFAULT_STEP_SIZE = 0.01
+
+    _parameter_matrix = None
+    _initial_condition_matrix = None
+
+    def __init__(self, problem, parameters, initial_conditions, starting_time=0.0, **options):
+        parameter_matrix = np.atleast_2d(np.asarray(parameters, dtype=NP_FLOATING_POINT_PRECISION))
+        initial_condition_matrix = np.atleast_2d(np.asarray(initial_conditions, dtype=NP_FLOATING_POINT_PRECISION))
+
+        assert(parameter_matrix.shape[0] == initial_condition_matrix.shape[0])
+
+        super(EnsembleSolverBase, self).__init__(problem, parameter_matrix[0], initial_condition_matrix[0],
+                                                 starting_time=starting_time, **options)
+
+        assert(parameter_matrix.shape[1] == len(problem.parameters))
+        assert(initial_condition_matrix.shape[1] == problem.number_of_equations)
+
+        self._parameter_matrix = np.ascontiguousarray(parameter_matrix)
+        self._initial_condition_matrix = np.ascontiguousarray(initial_condition_matrix)
+
+        unknown_options = set(options) - set(['h', 'verbosity'])
+        if unknown_options:
+            raise AttributeError('Unknown options for {0!r}: {1!r}'.format(self.unique_name(),
+                                                                          sorted(unknown_options)))
+
+    @property
+    def _step_size(self):
+        return float(self._options.get('h', self.DEFAULT_STEP_SIZE))
+
+    @property
+    def _solver(self):
+        # The ensemble is integrated directly, without any external solver
+        return None
+
+    def _reset_solver(self):
+        self._parameter_matrix = self._parameters[np.newaxis, :].copy()
+        self._initial_condition_matrix = self._initial_conditions[np.newaxis, :].copy()
+
+    def _step(self, rhs, t, y, h, parameters, buffers):
+        """
+        Advances the state `y` of all of the simulations by a step of size `h` from time `t`, in place.
+
+        :param rhs: the batch right hand side, see :attr:`~means.core.problems.ODEProblem.right_hand_side_as_batch_function`
+        :param buffers: preallocated matrices of the same shape as `y` the step can use
+        """
+        raise NotImplementedError
+
+    # The number of preallocated buffers `_step` needs
+    _number_of_buffers = 1
+
+    def _integrate_ensemble(self, timepoints):
+        """
+        Integrates all the simulations in the ensemble.
+
+        :return: an array of the values of each equation, for each timepoint and simulation,
+                 with the shape (timepoints, simulations, equations)
+        """
+        timepoints = np.asarray(timepoints, dtype=NP_FLOATING_POINT_PRECISION)
+        rhs = self._problem.right_hand_side_as_batch_function
+        parameters = self._parameter_matrix
+        y = self._initial_condition_matrix.copy()
+        buffers = [np.empty_like(y) for _ in range(self._number_of_buffers)]
+        maximum_step_size = self._step_size
+
+        values = np.empty((len(timepoints),) + y.shape, dtype=NP_FLOATING_POINT_PRECISION)
+        t = self._starting_time
+        for i, next_timepoint in enumerate(timepoints):
+            if next_timepoint > t:
+                number_of_steps = int(np.ceil((next_timepoint - t) / maximum_step_size))
+                h = (next_timepoint - t) / number_of_steps
+                for step in range(number_of_steps):
+                    self._step(rhs, t + step * h, y, h, parameters, buffers)
+                t = next_timepoint
+            values[i] = y
+
+        return values
+
+    def _integrate(self, solver, timepoints):
+        if self._parameter_matrix.shape[0] != 1:
+            raise ValueError('The solver has been initialised with {0} simulations, '
+                             'use simulate_ensemble() to simulate them'.format(self._parameter_matrix.shape[0]))
+        return np.asarray(timepoints, dtype=NP_FLOATING_POINT_PRECISION), self._integrate_ensemble(timepoints)[:, 0, :]
+
+    def simulate_ensemble(self, timepoints, outputs=None):
+        """
+        Simulate all of the parameter sets and initial conditions in the ensemble for the specified timepoints.
+
+        :param timepoints: timepoints that will be returned from simulation
+        :param outputs: the descriptors of the equations to return the trajectories of, in that order,
+                        or None for all of the equations in the problem
+        :return: a list of :class:`~means.simulation.trajectory.TrajectoryCollection` objects,
+                 one for each of the rows of the parameter and initial condition matrices, in the same order
+        """
+        columns = self._output_columns(outputs)
+        timepoints = np.asarray(timepoints, dtype=NP_FLOATING_POINT_PRECISION)
+        values = self._integrate_ensemble(timepoints)
+        return [TrajectoryCollection(self._results_to_trajectories(timepoints, values[:, i, :], columns))
+                for i in range(values.shape[1])]
+
+class EnsembleEulerSolver(EnsembleSolverBase, UniqueNameInitialisationMixin):
+    """
+    Explicit Euler method, for ensembles of simulations.
+    """
+
+    def _step(self, rhs, t, y, h, parameters, buffers):
+        derivatives, = buffers
+        rhs(y, parameters, out=derivatives)
+        derivatives *= h
+        y += derivatives
+
+    @classmethod
+    def unique_name(cls):
+        return 'ensemble-euler'
+
+class EnsembleRungeKutta4Solver(EnsembleSolverBase, UniqueNameInitialisationMixin):
+    """
+    Runge-Kutta method of order 4, for ensembles of simulations.
+    """
+
+    _number_of_buffers = 3
+
+    def _step(self, rhs, t, y, h, parameters, buffers):
+        k, intermediate, increment = buffers
+
+        rhs(y, parameters, out=k)
+        increment[:] = k
+        np.multiply(k, h / 2.0, out=intermediate)
+        intermediate += y
+
+        rhs(intermediate, parameters, out=k)
+        increment += 2 * k
+        np.multiply(k, h / 2.0, out=intermediate)
+        intermediate += y
+
+        rhs(intermediate, parameters, out=k)
+        increment += 2 * k
+        np.multiply(k, h, out=intermediate)
+        intermediate += y
+
+        rhs(intermediate, parameters, out=k)
+        increment += k
+        increment *= h / 6.0
+        y += increment
+
+    @classmethod
+    def unique_name(cls):
+        return 'ensemble-rungekutta4'
+
 #-- Solvers with sensitivity support -----------------------------------------------------------------------------------
 
 
@@ -532,8 +1005,13 @@ def _add_sensitivity_data_to_trajectories(trajectories, raw_sensitivity_data, pa
 
 class SensitivitySolverBase(SolverBase):
 
+    # Reinitialising the solver does not reset the sensitivities, so these solvers are always built again
+    _supports_reset = False
+
     @property
     def _assimulo_problem(self):
+        from assimulo.problem import Explicit_Problem
+
         rhs = self._problem.right_hand_side_as_function
         parameters = self._parameters
         initial_conditions = self._initial_conditions
@@ -544,14 +1022,33 @@ class SensitivitySolverBase(SolverBase):
         model = Explicit_Problem(lambda t, x, p: rhs(x, p),
                                  initial_conditions, initial_timepoint)
 
+        if self._uses_jacobian:
+            jacobian = self._jacobian_function
+            model.jac = lambda t, x, p: jacobian(x, p)
+            if self._uses_sparse_jacobian:
+                model.jac_nnz = len(self._problem._jacobian_sparsity[0])
+
+        # The exact right hand side of the sensitivity equations, so the solver does not need to approximate
+        # the derivatives with respect to the parameters by finite differences
+        sensitivity_rhs = self._problem.sensitivity_right_hand_side_as_function
+        model.rhs_sens = lambda t, x, s, p: sensitivity_rhs(x, p, s)
+
         model.p0 = np.array(parameters)
         return model
 
+    @property
+    def _sensitivities(self):
+        """
+        The sensitivities from the last simulation, as an array indexed by parameter, timepoint and equation.
+        """
+        return np.array(self._solver.p_sol)
 
-    def _results_to_trajectories(self, simulated_timepoints, simulated_values):
+    def _results_to_trajectories(self, simulated_timepoints, simulated_values, columns=None):
         trajectories = super(SensitivitySolverBase, self)._results_to_trajectories(simulated_timepoints,
-                                                                                   simulated_values)
-        sensitivities_raw = np.array(self._solver.p_sol)
+                                                                                   simulated_values, columns)
+        sensitivities_raw = self._sensitivities
+        if columns is not None:
+            sensitivities_raw = sensitivities_raw[:, :, columns]
 
         trajectories_with_sensitivity_data = _add_sensitivity_data_to_trajectories(trajectories, sensitivities_raw,
                                                                                    self._problem.parameters)
@@ -560,6 +1057,9 @@ class SensitivitySolverBase(SolverBase):
 
 class CVodeSolverWithSensitivities(SensitivitySolverBase, CVodeMixin):
 
+    # The solver base comes first, so this is set here rather than in the mixin
+    _supports_jacobian = True
+
     def _default_solver_instance(self):
         solver = self._cvode_instance(self._assimulo_problem, self._options)
         # It is necessary to set usesens to true here as we are non-parametric here
@@ -569,7 +1069,10 @@ class CVodeSolverWithSensitivities(SensitivitySolverBase, CVodeMixin):
 
 class ODE15sSolverWithSensitivities(SensitivitySolverBase, ODE15sMixin):
 
-     def _default_solver_instance(self):
+    # The solver base comes first, so this is set here rather than in the mixin
+    _supports_jacobian = True
+
+    def _default_solver_instance(self):
         solver = self._cvode_instance(self._assimulo_problem, self._options)
         # It is necessary to set usesens to true here as we are non-parametric here
         solver.usesens = True
@@ -577,6 +1080,142 @@ class ODE15sSolverWithSensitivities(SensitivitySolverBase, ODE15sMixin):
         return solver
 
 
+class ScipySensitivitySolverBase(SensitivitySolverBase, ScipySolverBase):
+    """
+    A base class for the solvers of :func:`scipy.integrate.solve_ivp` that also compute the sensitivities
+    of the trajectories to the parameters, by integrating the forward sensitivity equations given by
+    :attr:`~means.core.problems.ODEProblem.sensitivity_right_hand_side_as_function`.
+
+    The ``sensmethod`` option sets how the sensitivity equations are integrated:
+
+    ``'SIMULTANEOUS'``
+        Together with the equations of the problem, as a single system (the default)
+    ``'STAGGERED'``
+        After the equations of the problem, using the interpolated solution of the problem.
+    """
+
+    SENSITIVITY_METHODS = ['SIMULTANEOUS', 'STAGGERED']
+
+    __sensitivities = None
 
+    @property
+    def _sensitivity_method(self):
+        method = str(self._options.get('sensmethod', 'SIMULTANEOUS')).upper()
+        if method not in self.SENSITIVITY_METHODS:
+            raise ValueError('Unknown sensitivity method {0!r}, '
+                             'use one of {1!r}'.format(method, self.SENSITIVITY_METHODS))
+        return method
+
+    @property
+    def _scipy_options(self):
+        options = super(ScipySensitivitySolverBase, self)._scipy_options
+        options.pop('sensmethod', None)
+        return options
+
+    @property
+    def _sensitivities(self):
+        return self.__sensitivities
+
+    def _block_diagonal_jacobian(self, x, number_of_blocks):
+        """
+        The Jacobian of the problem at `x`, repeated `number_of_blocks` times along the diagonal.
+        """
+        jacobian = self._jacobian_function(x, self._parameters)
+        if self._supports_sparse_jacobian and not isinstance(jacobian, np.ndarray):
+            from scipy.sparse import identity, kron
+            return kron(identity(number_of_blocks), jacobian, format='csc')
+        else:
+            return np.kron(np.eye(number_of_blocks), jacobian)
+
+    def _integrate(self, solver, timepoints):
+        from scipy.integrate import solve_ivp
+
+        timepoints = np.asarray(timepoints, dtype=NP_FLOATING_POINT_PRECISION)
+        rhs = self._problem.right_hand_side_as_function
+        sensitivity_rhs = self._problem.sensitivity_right_hand_side_as_function
+        parameters = self._parameters
+        number_of_equations = self._problem.number_of_equations
+        number_of_parameters = len(parameters)
+        time_span = (self._starting_time, timepoints[-1])
+        options = self._scipy_options
+
+        def solve(function, initial_values, jacobian, **kwargs):
+            if self._uses_jacobian:
+                kwargs['jac'] = jacobian
+            kwargs.update(options)
+            result = solve_ivp(function, time_span, initial_values, method=self._method, t_eval=timepoints, **kwargs)
+            if not result.success:
+                raise ScipySolverError('{0} failed: {1}'.format(self._method, result.message))
+            return result
+
+        # The sensitivities are stored one parameter after another, i.e. as the transpose of the sensitivity matrix
+        initial_sensitivities = np.zeros(number_of_equations * number_of_parameters)
+
+        if self._sensitivity_method == 'SIMULTANEOUS':
+            def augmented_rhs(t, z):
+                x = z[:number_of_equations]
+                sensitivities = z[number_of_equations:].reshape(number_of_parameters, number_of_equations).T
+                return np.concatenate((rhs(x, parameters),
+                                       sensitivity_rhs(x, parameters, sensitivities).T.ravel()))
+
+            # The derivatives of the sensitivity equations with respect to the state are left out,
+            # as in the simultaneous corrector of CVODES. This only affects the convergence of the corrector.
+            result = solve(augmented_rhs, np.concatenate((self._initial_conditions, initial_sensitivities)),
+                           lambda t, z: self._block_diagonal_jacobian(z[:number_of_equations],
+                                                                      number_of_parameters + 1))
+            values = result.y[:number_of_equations].T
+            sensitivity_values = result.y[number_of_equations:].T
+        else:
+            state = solve(lambda t, x: rhs(x, parameters), self._initial_conditions,
+                          lambda t, x: self._jacobian_function(x, parameters), dense_output=True)
+
+            def staggered_rhs(t, z):
+                sensitivities = z.reshape(number_of_parameters, number_of_equations).T
+                return sensitivity_rhs(state.sol(t), parameters, sensitivities).T.ravel()
+
+            # The sensitivity equations are linear, with the Jacobian of the problem in each of the blocks
+            result = solve(staggered_rhs, initial_sensitivities,
+                           lambda t, z: self._block_diagonal_jacobian(state.sol(t), number_of_parameters))
+            values = state.y.T
+            sensitivity_values = result.y.T
+
+        self.__sensitivities = sensitivity_values.reshape(len(timepoints), number_of_parameters,
+                                                          number_of_equations).transpose(1, 0, 2)
+        return timepoints, values
+
+class ScipyLSODASolverWithSensitivities(ScipySensitivitySolverBase, UniqueNameInitialisationMixin):
+
+    _method = 'LSODA'
+    _supports_jacobian = True
+
+    @classmethod
+    def unique_name(cls):
+        return 'scipy-lsoda'
+
+class ScipyBDFSolverWithSensitivities(ScipySensitivitySolverBase, UniqueNameInitialisationMixin):
+
+    _method = 'BDF'
+    _supports_jacobian = True
+    _supports_sparse_jacobian = True
+
+    @classmethod
+    def unique_name(cls):
+        return 'scipy-bdf'
+
+class ScipyRadauSolverWithSensitivities(ScipySensitivitySolverBase, UniqueNameInitialisationMixin):
 
+    _method = 'Radau'
+    _supports_jacobian = True
+    _supports_sparse_jacobian = True
 
+    @classmethod
+    def unique_name(cls):
+        return 'scipy-radau'
+
+class ScipyRK45SolverWithSensitivities(ScipySensitivitySolverBase, UniqueNameInitialisationMixin):
+
+    _method = 'RK45'
+
+    @classmethod
+    def unique_name(cls):
+        return 'scipy-rk45'
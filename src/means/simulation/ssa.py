@@ -2,20 +2,29 @@
 Gillespie Stochastic Simulation Algorithm
 ----
 
-This part of the package provides a simple implementation of GSSA.
-This is designed for experimental purposes much more than for performance.
-If you would like to use SSA for parameter inference, or for high
-number of species, there are many superior implementations available.
+This part of the package provides an implementation of the direct method of GSSA.
+The propensities of all the reactions are evaluated by a single compiled function (see :mod:`means.util.codegen`),
+the reactions are selected from the cumulative sum of the propensities,
+and the amounts of species are only recorded at the requested timepoints.
 """
 
+import itertools
 import multiprocessing
 import numpy as np
-from means.simulation.trajectory import Trajectory, TrajectoryCollection
+from scipy.special import comb
+from means.simulation.trajectory import TrajectoryCollection
 from means.io.serialise import SerialisableObject
 from means.util.moment_counters import generate_n_and_k_counters
-from means.util.sympyhelpers import product, substitute_all
+from means.util.sympyhelpers import to_one_dim_array
 from means.core import Moment
 
+# Number of random numbers drawn at once
+_RANDOM_NUMBERS_CHUNK_SIZE = 1024
+# Number of simulations whose moments are computed together, before being merged into the accumulated ones
+_MOMENT_BLOCK_SIZE = 256
+# Number of sets of simulations given to each of the processes, when computing moments in parallel
+_CHUNKS_PER_PROCESS = 4
+
 
 class SSASimulation(SerialisableObject):
     """
@@ -63,7 +72,8 @@ class SSASimulation(SerialisableObject):
                         max_moment_order=1, number_of_processes=1):
         """
         Perform Gillespie SSA simulations and returns trajectories for of each species.
-        Each trajectory is interpolated at the given time points.
+        Each trajectory holds the amounts of species at the given time points,
+        i.e. after all of the reactions that happened until then.
         By default, the average amounts of species for all simulations is returned.
 
         :param parameters: list of the initial values for the constants in the model.
@@ -89,94 +99,255 @@ class SSASimulation(SerialisableObject):
 
         n_simulations = self.__n_simulations
         self._validate_parameters(parameters, initial_conditions)
-        t_max= max(timepoints)
+        timepoints = to_one_dim_array(timepoints)
 
-        substitution_pairs = dict(zip(self.__problem.parameters, parameters))
-        propensities = substitute_all(self.__problem.propensities, substitution_pairs)
-        # lambdify the propensities for fast evaluation
-        propensities_as_function = self.__problem.propensities_as_function
-        def f(*species_parameters):
-            return propensities_as_function(*(np.concatenate((species_parameters, parameters))))
+        parameters = to_one_dim_array(parameters)
+        # Compile the propensities before any of the simulations, so that the processes do not all compile them
+        propensities_as_function = self.__problem._propensities_as_numeric_function
 
-        population_rates_as_function = f
+        # Each simulation is started with the next seed, or with the current random state if there is no seed
+        first_seed = self.__random_seed or None
+        species = self.__problem.species
 
-        if not self.__random_seed:
-            seed_for_processes = [None] * n_simulations
+        if max_moment_order == 0:
+            seeds = _seeds(first_seed, n_simulations)
         else:
-            seed_for_processes = [i for i in range(self.__random_seed, n_simulations + self.__random_seed)]
-
+            n_vectors = self._central_moments(max_moment_order)
+            accumulator = _MomentAccumulator([n.n_vector for n in n_vectors], (len(species), len(timepoints)))
 
+        generator_class, generator_options = self._generator_class_and_options()
 
         if number_of_processes ==1:
-            ssa_generator = _SSAGenerator(population_rates_as_function,
-                                        self.__problem.change, self.__problem.species,
-                                        initial_conditions, t_max, seed=self.__random_seed)
-
-            results = map(ssa_generator.generate_single_simulation, seed_for_processes)
+            ssa_generator = generator_class(propensities_as_function, parameters,
+                                            self.__problem.change, species,
+                                            initial_conditions, timepoints, seed=self.__random_seed,
+                                            **generator_options)
 
+            if max_moment_order == 0:
+                results = map(ssa_generator.generate_single_simulation, seeds)
+            else:
+                _accumulate_moments(ssa_generator, _seeds(first_seed, n_simulations), accumulator)
 
         else:
             p = multiprocessing.Pool(number_of_processes,
                     initializer=multiprocessing_pool_initialiser,
-                    initargs=[population_rates_as_function, self.__problem.change,
-                              self.__problem.species,
-                              initial_conditions, t_max, self.__random_seed])
-
-            results = p.map(multiprocessing_apply_ssa, seed_for_processes)
+                    initargs=[generator_class, generator_options,
+                              propensities_as_function, parameters, self.__problem.change,
+                              species,
+                              initial_conditions, timepoints, self.__random_seed])
+
+            if max_moment_order == 0:
+                results = p.map(multiprocessing_apply_ssa, seeds)
+            else:
+                # Each process accumulates the moments of its own simulations, which are then merged
+                chunks = _chunks(first_seed, n_simulations, number_of_processes * _CHUNKS_PER_PROCESS)
+                for chunk_accumulator in p.map(multiprocessing_accumulate_moments,
+                                               [(chunk, accumulator) for chunk in chunks]):
+                    accumulator.merge(chunk_accumulator)
 
             p.close()
             p.join()
 
-        resampled_results = [[traj.resample(timepoints, extrapolate=True) for traj in res] for res in results]
-        for i in resampled_results:
-            idx = len(i[0].values) - 1
-
         if max_moment_order == 0:
             # Return a list of TrajectoryCollection objects
-            return map(TrajectoryCollection, resampled_results)
-
-        moments = self._compute_moments(resampled_results, max_moment_order)
-        return TrajectoryCollection(moments)
+            return results
 
-    def _compute_moments(self, all_trajectories, max_moment_order):
+        values = np.vstack([accumulator.mean] + [accumulator.central_moment(n.n_vector) for n in n_vectors])
+        return TrajectoryCollection.from_array(timepoints, values, _mean_descriptors(species) + n_vectors)
 
-        mean_trajectories = [sum(trajs)/float(len(trajs)) for trajs in zip(*all_trajectories)]
+    def _generator_class_and_options(self):
+        """
+        The class generating each of the simulations, and the keyword arguments to create it with,
+        besides the ones of :class:`_SSAGenerator`
+        """
+        return _SSAGenerator, {}
 
-        if max_moment_order == 1:
-            return mean_trajectories
+    def _central_moments(self, max_moment_order):
+        """
+        The descriptors of the central moments of second order and above, up to `max_moment_order`
+        """
         n_counter, _ = generate_n_and_k_counters(max_moment_order - 1, self.__problem.species)
+        return [n for n in n_counter if n.order > 1]
 
-        out_trajects = mean_trajectories[:]
-        for n in n_counter:
-            if n.order == 0:
-                continue
-            out_trajects.append(self._compute_one_moment(all_trajectories, mean_trajectories, n))
-        return out_trajects
 
-    def _compute_one_moment(self, all_trajectories, mean_trajectories, moment):
+def _mean_descriptors(species):
+    # build descriptors for first order raw moments aka expectations (e.g. [1, 0, 0], [0, 1, 0] and [0, 0, 1])
+    descriptors = []
+    for i, s in enumerate(species):
+        row = [0] * len(species)
+        row[i] = 1
+        descriptors.append(Moment(row, s))
+    return descriptors
 
-        # the expectation of the product:
-        #products_of_sps = [product(trajs) for trajs in all_trajectories]
-        n_vec = moment.n_vector
 
-        to_multipl = []
+def _seeds(first_seed, number_of_simulations):
+    """
+    The seeds of each of the simulations, consecutive integers from `first_seed`,
+    or None for all of them if `first_seed` is None
+    """
+    if first_seed is None:
+        return itertools.repeat(None, number_of_simulations)
+    return xrange(first_seed, first_seed + number_of_simulations)
 
-        for i, trajs in enumerate(zip(*all_trajectories)):
-            mean_of_sp = mean_trajectories[i]
-            order_of_sp = n_vec[i]
-            xi_minus_ex = [(t - mean_of_sp) ** order_of_sp for t in trajs]
-            for x in xi_minus_ex:
-                x.set_description(moment)
-            to_multipl.append(xi_minus_ex)
 
-        to_sum = [product(xs) for xs in zip(*to_multipl)]
+def _chunks(first_seed, number_of_simulations, number_of_chunks):
+    """
+    Splits the simulations into at most `number_of_chunks` sets of consecutive simulations,
+    as pairs of the seed of the first simulation of the set, and of the number of simulations in it
+    """
+    chunks = []
+    start = 0
+    for size in np.diff(np.linspace(0, number_of_simulations, number_of_chunks + 1).astype(int)):
+        if size > 0:
+            chunks.append((None if first_seed is None else first_seed + start, int(size)))
+        start += size
+    return chunks
+
+
+def _accumulate_moments(ssa_generator, seeds, accumulator):
+    """
+    Performs the simulations for each of the `seeds`, and adds their amounts of species to the `accumulator`,
+    in blocks of :data:`_MOMENT_BLOCK_SIZE` simulations
+    """
+    block = None
+    size = 0
+    for seed in seeds:
+        amounts = ssa_generator.simulate_amounts(seed)
+        if block is None:
+            block = np.empty((_MOMENT_BLOCK_SIZE,) + amounts.shape, dtype=np.double)
+        block[size] = amounts
+        size += 1
+        if size == _MOMENT_BLOCK_SIZE:
+            accumulator.add(block)
+            size = 0
+    if size > 0:
+        accumulator.add(block[:size])
+    return accumulator
+
+
+class _MomentAccumulator(object):
+    """
+    Accumulates the means, and the sums of the products of the deviations from the means of the amounts of species,
+    over simulations, so that the simulations do not need to be kept in memory.
 
-        return sum(to_sum)/ float(len(to_sum))
+    The simulations are added in blocks, whose sums are merged into the accumulated ones with the pairwise formulas
+    of [Pebay08]. These generalise the updates of Welford's algorithm to mixed central moments of any order.
+    Accumulators of different sets of simulations, e.g. from different processes, are merged in the same way.
 
+    .. [Pebay08] Pebay, Philippe. "Formulas for robust, one-pass parallel computation of covariances and
+       arbitrary-order statistical moments." Sandia Report SAND2008-6212 (2008).
+    """
 
+    def __init__(self, n_vectors, shape):
+        """
+        :param n_vectors: the orders of the central moments for each of the species, all of second order or above.
+                          All of the central moments of second order and above that are below them
+                          (i.e. of lower or equal order for each species) need to be in the list.
+        :param shape: the number of species and the number of timepoints
+        """
+        self.__n_vectors = [tuple(int(order) for order in n_vector) for n_vector in n_vectors]
+        self.__shape = tuple(shape)
+
+        # The terms of the binomial expansion of each of the sums of products of deviations,
+        # as (lower orders, binomial coefficient, remaining orders), see `merge`
+        self.__expansions = {}
+        for n_vector in self.__n_vectors:
+            terms = []
+            for k_vector in itertools.product(*[range(order + 1) for order in n_vector]):
+                # The sums of the first order deviations from the means are zero
+                if sum(k_vector) == 1:
+                    continue
+                coefficient = np.prod([comb(order, k, exact=True) for order, k in zip(n_vector, k_vector)])
+                remaining = tuple(order - k for order, k in zip(n_vector, k_vector))
+                terms.append((k_vector, coefficient, remaining))
+            self.__expansions[n_vector] = terms
+
+        self.count = 0
+        self.mean = np.zeros(self.__shape, dtype=np.double)
+        self.sums = {n_vector: np.zeros(self.__shape[1], dtype=np.double) for n_vector in self.__n_vectors}
+
+    def central_moment(self, n_vector):
+        """
+        The central moment for the `n_vector` orders of each species, at each of the timepoints
+        """
+        return self.sums[tuple(n_vector)] / float(self.count)
 
-def multiprocessing_pool_initialiser(population_rates_as_function, change, species,
-                                     initial_conditions, t_max, seed):
+    def add(self, amounts):
+        """
+        Adds simulations to the accumulated ones.
+
+        :param amounts: the amounts of each of the species at each of the timepoints,
+                        as an array of shape (number of simulations, number of species, number of timepoints)
+        """
+        amounts = np.asarray(amounts, dtype=np.double)
+        mean = amounts.mean(axis=0)
+        deviations = amounts - mean
+        sums = {}
+        for n_vector in self.__n_vectors:
+            products = 1.0
+            for species_deviations, order in zip(np.rollaxis(deviations, 1), n_vector):
+                if order:
+                    products = products * species_deviations ** order
+            sums[n_vector] = products.sum(axis=0)
+
+        self._merge(len(amounts), mean, sums)
+
+    def merge(self, other):
+        """
+        Merges the simulations accumulated by `other`, with the same moments, into this accumulator
+        """
+        self._merge(other.count, other.mean, other.sums)
+
+    def _merge(self, count, mean, sums):
+        if count == 0:
+            return
+        if self.count == 0:
+            self.count = count
+            self.mean = mean.copy()
+            self.sums = {n_vector: values.copy() for n_vector, values in sums.iteritems()}
+            return
+
+        total_count = self.count + count
+        delta = mean - self.mean
+        # The differences between the means of each set and the mean of both
+        shift = -delta * (count / float(total_count))
+        other_shift = delta * (self.count / float(total_count))
+
+        def powers(values):
+            max_order = max([max(n_vector) for n_vector in self.__n_vectors] or [0])
+            return [[None] + [species_values ** order for order in range(1, max_order + 1)]
+                    for species_values in values]
+        shift_powers, other_shift_powers = powers(shift), powers(other_shift)
+
+        def product_of_powers(species_powers, orders):
+            result = 1.0
+            for powers_, order in zip(species_powers, orders):
+                if order:
+                    result = result * powers_[order]
+            return result
+
+        # The sum of the products of the deviations from the mean of both sets, expanded into the sums
+        # of the products of the deviations from the mean of each set
+        new_sums = {}
+        for n_vector, terms in self.__expansions.iteritems():
+            new_sum = 0.0
+            for k_vector, coefficient, remaining in terms:
+                if sum(k_vector) == 0:
+                    own_sum, other_sum = self.count, count
+                else:
+                    own_sum, other_sum = self.sums[k_vector], sums[k_vector]
+                new_sum = new_sum + coefficient * (own_sum * product_of_powers(shift_powers, remaining) +
+                                                   other_sum * product_of_powers(other_shift_powers, remaining))
+            new_sums[n_vector] = new_sum
+
+        self.count = total_count
+        self.mean = self.mean - shift
+        self.sums = new_sums
+
+
+def multiprocessing_pool_initialiser(generator_class, generator_options,
+                                     propensities_as_function, parameters, change, species,
+                                     initial_conditions, timepoints, seed):
     global ssa_generator
     current = multiprocessing.current_process()
     #increment the random seed inside each process at creation, so the result should be reproducible
@@ -184,7 +355,8 @@ def multiprocessing_pool_initialiser(population_rates_as_function, change, speci
         seed += current._identity[0]
     else:
         seed = current._identity[0]
-    ssa_generator = _SSAGenerator(population_rates_as_function, change, species, initial_conditions, t_max, seed)
+    ssa_generator = generator_class(propensities_as_function, parameters, change, species, initial_conditions,
+                                    timepoints, seed, **generator_options)
 
 def multiprocessing_apply_ssa(x):
     """
@@ -194,80 +366,124 @@ def multiprocessing_apply_ssa(x):
     result = ssa_generator.generate_single_simulation(x)
     return result
 
+def multiprocessing_accumulate_moments(chunk_and_accumulator):
+    """
+    Used in the SSASimulation class, to accumulate the moments of a set of simulations in a process.
+    Needs to be in global scope for multiprocessing module to pick it up
+    """
+    (first_seed, number_of_simulations), accumulator = chunk_and_accumulator
+    return _accumulate_moments(ssa_generator, _seeds(first_seed, number_of_simulations), accumulator)
+
 
 class _SSAGenerator(object):
-    def __init__(self, population_rates_as_function, change, species, initial_conditions, t_max, seed):
+    def __init__(self, propensities_as_function, parameters, change, species, initial_conditions, timepoints, seed):
         """
-        :param population_rates_as_function: function to evaluate propensities given the amount of species
+        :param propensities_as_function: the compiled function evaluating all of the propensities at once,
+                                         called as `f(amounts_of_species, parameters, out)`
+        :param parameters: the values of the parameters, as an array of doubles
         :param change: the change matrix (transpose of the stoichiometry matrix) as an numpy in array
+        :param species: the species of the system
         :param initial_conditions: the initial conditions of the system
-        :param t_max: the time when the simulation should stop
+        :param timepoints: the timepoints to record the amounts of species at,
+                           the simulation stops after the last one
         :param seed: an integer to initialise the random seed. If `None`, the random seed will be set
                 automatically (e.g. from /dev/random) once for all.
         """
-        self.__rng = np.random.RandomState(seed)
-        self.__population_rates_as_function = population_rates_as_function
-        self.__change = change
+        self._rng = np.random.RandomState(seed)
+        self._propensities_as_function = propensities_as_function
+        self._parameters = parameters
+        # The amounts of species are kept as doubles, so that they can be passed to the propensities directly
+        self._change = np.asarray(change, dtype=np.double)
         self.__initial_conditions = initial_conditions
-        self.__t_max = t_max
+        self.__timepoints = timepoints
         self.__species = species
 
-    def _gssa(self, initial_conditions, t_max):
+        self.__descriptors = _mean_descriptors(species)
+
+    def _gssa(self, initial_conditions, timepoints):
         """
-        This function is inspired from Yoav Ram's code available at:
-        http://nbviewer.ipython.org/github/yoavram/ipython-notebooks/blob/master/GSSA.ipynb
+        Simulates the system with the direct method of Gillespie, starting at time zero.
+        The amounts of species are only recorded when the simulated time crosses each of the timepoints,
+        so that the memory used does not depend on the number of events.
 
         :param initial_conditions: the initial conditions of the system
-        :param t_max:  the time when the simulation should stop
-        :return:
+        :param timepoints: the timepoints to record the amounts of species at
+        :return: the amounts of each species at each of the timepoints, with a row for each timepoint
         """
-        # set the initial conditions and t0 = 0.
-        species_over_time = [np.array(initial_conditions).astype("int16")]
-        t = 0
-        time_points = [t]
-        while t < t_max and species_over_time[-1].sum() > 0:
-            last = species_over_time[-1]
-            e, dt = self._draw(last)
-            t += dt
-            species_over_time.append(last + self.__change[e,:])
-            time_points.append(t)
-        return time_points, np.array(species_over_time).T
-
-    def _draw(self, population):
-        population_rates = np.array(self.__population_rates_as_function(*population))
-        sum_rates = population_rates.sum()
-        time = self.__rng.exponential(1.0/sum_rates)
-        event_distribution = population_rates.flatten()
-        event_distribution /= event_distribution.sum()
-        event = self.__rng.multinomial(1, event_distribution).argmax()
-        return event, time
-
-    def generate_single_simulation(self, x):
+        propensities_as_function = self._propensities_as_function
+        parameters = self._parameters
+        change = self._change
+        rng = self._rng
+
+        state = np.array(initial_conditions, dtype=np.double)
+        # The total amount of species is updated with each event, rather than summed
+        total_amount = float(state.sum())
+        changes = list(change)
+        total_changes = change.sum(axis=1).tolist()
+        accumulate = np.add.accumulate
+        propensities = np.empty(len(change), dtype=np.double)
+        cumulative_propensities = np.empty(len(change), dtype=np.double)
+
+        species_over_time = np.empty((len(timepoints), len(state)), dtype=np.double)
+        # The timepoints are visited in increasing order
+        order = np.argsort(timepoints, kind='mergesort').tolist()
+        sorted_timepoints = [float(timepoints[i]) for i in order]
+        number_of_timepoints = len(order)
+        next_timepoint = 0
+
+        # The random numbers are drawn in chunks, and only used as python floats
+        random_number_index = _RANDOM_NUMBERS_CHUNK_SIZE
+        t = 0.0
+        while next_timepoint < number_of_timepoints and total_amount > 0:
+            propensities_as_function(state, parameters, propensities)
+            accumulate(propensities, out=cumulative_propensities)
+            total_propensity = float(cumulative_propensities[-1])
+            if not total_propensity > 0:
+                # No reaction can happen any more
+                break
+
+            if random_number_index == _RANDOM_NUMBERS_CHUNK_SIZE:
+                exponentials = rng.standard_exponential(_RANDOM_NUMBERS_CHUNK_SIZE).tolist()
+                uniforms = rng.random_sample(_RANDOM_NUMBERS_CHUNK_SIZE).tolist()
+                random_number_index = 0
+
+            t += exponentials[random_number_index] / total_propensity
+            # The first reaction whose cumulative propensity is above the uniform number
+            event = cumulative_propensities.searchsorted(uniforms[random_number_index] * total_propensity,
+                                                         side='right')
+            random_number_index += 1
+
+            # The amounts are constant between the events, so the timepoints before this one get the current amounts
+            while next_timepoint < number_of_timepoints and sorted_timepoints[next_timepoint] < t:
+                species_over_time[order[next_timepoint]] = state
+                next_timepoint += 1
+
+            state += changes[event]
+            total_amount += total_changes[event]
+
+        # The amounts do not change after the last event
+        species_over_time[order[next_timepoint:]] = state
+        return species_over_time
+
+    def simulate_amounts(self, x):
         """
-        Generate a single SSA simulation
+        Performs a single SSA simulation
         :param x: an integer to reset the random seed. If None, the initial random number generator is used
-        :return: a list of :class:`~means.simulation.Trajectory` one per species in the problem
-        :rtype: list[:class:`~means.simulation.Trajectory`]
+        :return: the amounts of each species at each of the timepoints, with a row for each species
         """
         #reset random seed
         if x:
-            self.__rng = np.random.RandomState(x)
+            self._rng = np.random.RandomState(x)
 
         # perform one stochastic simulation
-        time_points, species_over_time = self._gssa(self.__initial_conditions, self.__t_max)
-
-        # build descriptors for first order raw moments aka expectations (e.g. [1, 0, 0], [0, 1, 0] and [0, 0, 1])
-        descriptors = []
-        for i, s in enumerate(self.__species):
-            row = [0] * len(self.__species)
-            row[i] = 1
-            descriptors.append(Moment(row, s))
+        return self._gssa(self.__initial_conditions, self.__timepoints).T
 
+    def generate_single_simulation(self, x):
+        """
+        Generate a single SSA simulation
+        :param x: an integer to reset the random seed. If None, the initial random number generator is used
+        :return: a collection of :class:`~means.simulation.Trajectory` one per species in the problem
+        :rtype: :class:`~means.simulation.TrajectoryCollection`
+        """
         # build trajectories
-        trajectories = [Trajectory(time_points, spot, desc) for
-                        spot, desc in zip(species_over_time, descriptors)]
-
-        return trajectories
-
-
-
+        return TrajectoryCollection.from_array(self.__timepoints, self.simulate_amounts(x), self.__descriptors)
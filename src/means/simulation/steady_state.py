@@ -0,0 +1,148 @@
+"""
+Steady States
+-------------
+
+This part of the package finds the stationary values of the equations of an :class:`~means.core.problems.ODEProblem`,
+see :meth:`~means.simulation.simulate.Simulation.simulate_to_steady_state`:
+
+>>> from means import mea_approximation, Simulation
+>>> from means.examples.sample_models import MODEL_DIMERISATION
+>>>
+>>> ode_problem = mea_approximation(MODEL_DIMERISATION, max_order=2)
+>>> simulation = Simulation(ode_problem, solver='scipy-lsoda')
+>>> steady_state = simulation.simulate_to_steady_state([0.001, 0.5, 330.0], [320.0], max_time=1000, newton=True)
+>>> steady_state.converged
+True
+
+The system is integrated until the right hand side of the equations is small enough, see :func:`residual`,
+and, optionally, the values reached are refined by Newton's method.
+
+-------------
+"""
+import numpy as np
+
+# Newton's method stops when its steps are this small, relative to the values
+_NEWTON_STEP_TOLERANCE = 1e-12
+# Steps of Newton's method are halved at most this many times, when they do not reduce the residual
+_MAX_NEWTON_STEP_HALVINGS = 20
+
+
+def residual(right_hand_side_values, values):
+    """
+    The measure of how far from a steady state the `values` are: the largest absolute value of the right hand side
+    of the equations, relative to the largest absolute value of the equations, if it is larger than one.
+
+    :param right_hand_side_values: the right hand side of the equations for the `values`
+    :param values: the values of the equations
+    :rtype: float
+    """
+    return np.max(np.abs(right_hand_side_values)) / max(1.0, np.max(np.abs(values)))
+
+
+class SteadyState(object):
+    """
+    The result of :meth:`~means.simulation.simulate.Simulation.simulate_to_steady_state`:
+    the values of each of the equations of the problem, and how they were found.
+    """
+
+    def __init__(self, descriptions, values, time, residual, converged, newton_iterations=None, message=None):
+        """
+        :param descriptions: the descriptions of each of the equations
+        :param values: the values of each of the equations
+        :param time: the time the integration stopped at
+        :param residual: the :func:`residual` at the `values`
+        :param converged: whether the residual is within the tolerance
+        :param newton_iterations: the number of iterations of Newton's method, or None if it was not used
+        :param message: a description of how the values were found
+        """
+        self.__descriptions = list(descriptions)
+        self.__values = np.asarray(values)
+        self.__time = time
+        self.__residual = residual
+        self.__converged = converged
+        self.__newton_iterations = newton_iterations
+        self.__message = message
+
+    @property
+    def descriptions(self):
+        return self.__descriptions
+
+    @property
+    def values(self):
+        return self.__values
+
+    @property
+    def time(self):
+        return self.__time
+
+    @property
+    def residual(self):
+        return self.__residual
+
+    @property
+    def converged(self):
+        return self.__converged
+
+    @property
+    def newton_iterations(self):
+        return self.__newton_iterations
+
+    @property
+    def message(self):
+        return self.__message
+
+    def __getitem__(self, description):
+        """
+        The value of the equation with the `description`
+        """
+        return self.__values[self.__descriptions.index(description)]
+
+    def __repr__(self):
+        return '<{0} at t={1!r}, residual={2!r}: {3}>'.format(self.__class__.__name__, self.time,
+                                                              self.residual, self.message)
+
+
+def newton(problem, parameters, values, max_iterations):
+    """
+    Refines the `values` of the equations of the `problem` towards a steady state with Newton's method,
+    using the compiled right hand side and Jacobian of the problem.
+    The steps are damped so that the :func:`residual` decreases at each iteration, and the iterations stop
+    when it cannot be decreased any more.
+
+    :param problem: the problem
+    :type problem: :class:`~means.core.problems.ODEProblem`
+    :param parameters: the values of the parameters of the problem
+    :param values: the values to start from, usually close to the steady state
+    :param max_iterations: the largest number of iterations
+    :return: the refined values, the number of iterations and a description of why the iterations stopped
+    """
+    rhs = problem.right_hand_side_as_function
+    jacobian = problem.jacobian_as_function
+
+    values = np.array(values, dtype=np.double)
+    right_hand_side_values = rhs(values, parameters)
+    current_residual = residual(right_hand_side_values, values)
+
+    for iteration in range(max_iterations):
+        try:
+            step = np.linalg.solve(jacobian(values, parameters), -right_hand_side_values)
+        except np.linalg.LinAlgError:
+            return values, iteration, 'Newton iterations stopped: singular Jacobian'
+
+        for _ in range(_MAX_NEWTON_STEP_HALVINGS):
+            candidate = values + step
+            candidate_right_hand_side_values = rhs(candidate, parameters)
+            candidate_residual = residual(candidate_right_hand_side_values, candidate)
+            if candidate_residual < current_residual:
+                break
+            step /= 2
+        else:
+            return values, iteration, 'Newton iterations stopped: the residual cannot be reduced further'
+
+        values, right_hand_side_values, current_residual = \
+            candidate, candidate_right_hand_side_values, candidate_residual
+
+        if np.max(np.abs(step)) <= _NEWTON_STEP_TOLERANCE * max(1.0, np.max(np.abs(values))):
+            return values, iteration + 1, 'Newton iterations converged'
+
+    return values, max_iterations, 'Newton iterations stopped: maximum number of iterations reached'
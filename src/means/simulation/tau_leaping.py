@@ -0,0 +1,246 @@
+"""
+Tau-Leaping
+----
+
+This part of the package provides an implementation of explicit tau-leaping for stochastic simulations,
+with the adaptive selection of the steps of [Cao06].
+Rather than simulating every reaction, the number of times each reaction happens during a step is drawn
+from a Poisson distribution, which is much faster than the exact SSA (see :mod:`means.simulation.ssa`)
+when the amounts of species are large.
+The reactions that could exhaust one of their reactants (critical reactions) happen at most once per step,
+and exact SSA steps are performed instead of leaps when the steps would be too short to be worthwhile.
+"""
+
+import numpy as np
+from means.simulation.ssa import SSASimulation, _SSAGenerator, _RANDOM_NUMBERS_CHUNK_SIZE
+
+# A few exact SSA steps are performed when the step would not be longer than this number of exact steps
+_EXACT_STEPS_THRESHOLD = 10.0
+# The number of exact SSA steps performed then, before trying to leap again
+_NUMBER_OF_EXACT_STEPS = 100
+
+
+class TauLeapingSimulation(SSASimulation):
+    """
+        A class providing an implementation of the explicit tau-leaping method,
+        with the selection of steps of [Cao06].
+        It is used as :class:`~means.simulation.ssa.SSASimulation`, and returns the same results.
+
+            >>> from means.examples import MODEL_P53
+            >>> from means import StochasticProblem, TauLeapingSimulation
+            >>> import numpy as np
+            >>> PROBLEM = StochasticProblem(MODEL_P53)
+            >>> RATES = [90, 0.002, 1.7, 1.1, 0.93, 0.96, 0.01]
+            >>> INITIAL_CONDITIONS = [70, 30, 60]
+            >>> TIME_RANGE = np.arange(0, 40, .1)
+            >>> N_SSA = 10
+            >>> simulation = TauLeapingSimulation(PROBLEM, N_SSA, epsilon=0.05)
+            >>> mean_trajectories = simulation.simulate_system(RATES, INITIAL_CONDITIONS, TIME_RANGE)
+
+
+    .. [Cao06] Cao, Yang, Daniel T. Gillespie, and Linda R. Petzold. "Efficient step size selection for the\
+         tau-leaping simulation method." The Journal of chemical physics 124.4 (2006): 044109.
+    """
+    def __init__(self, stochastic_problem, n_simulations, random_seed=None, epsilon=0.03, critical_threshold=10):
+        """
+
+        :param stochastic_problem:
+        :param n_simulations:
+        :param random_seed:
+        :param epsilon: the tolerance on the relative change of the propensities during a step.
+                        Larger values allow longer steps, i.e. faster but less accurate simulations.
+        :param critical_threshold: the reactions that could happen fewer times than this before exhausting one of
+                                   their reactants are critical, and happen at most once per step
+        """
+        super(TauLeapingSimulation, self).__init__(stochastic_problem, n_simulations, random_seed=random_seed)
+        if not 0 < epsilon < 1:
+            raise ValueError("The tolerance should be between zero and one, got {0!r}".format(epsilon))
+        self.__problem = stochastic_problem
+        self.__epsilon = epsilon
+        self.__critical_threshold = critical_threshold
+
+    @property
+    def epsilon(self):
+        return self.__epsilon
+
+    def _generator_class_and_options(self):
+        return _TauLeapingGenerator, {'reactant_orders': self.__problem._reactant_orders,
+                                      'epsilon': self.__epsilon,
+                                      'critical_threshold': self.__critical_threshold}
+
+
+class _TauLeapingGenerator(_SSAGenerator):
+    def __init__(self, propensities_as_function, parameters, change, species, initial_conditions, timepoints, seed,
+                 reactant_orders, epsilon, critical_threshold):
+        """
+        :param reactant_orders: the order of each of the reactions in each of the species,
+                                with a row for each reaction
+        :param epsilon: the tolerance on the relative change of the propensities during a step
+        :param critical_threshold: the number of times a reaction can happen before exhausting one of its reactants,
+                                   under which it is critical
+        See :class:`~means.simulation.ssa._SSAGenerator` for the other parameters
+        """
+        super(_TauLeapingGenerator, self).__init__(propensities_as_function, parameters, change, species,
+                                                   initial_conditions, timepoints, seed)
+        self._epsilon = epsilon
+        self._critical_threshold = critical_threshold
+
+        reactant_orders = np.asarray(reactant_orders, dtype=np.int)
+        self._reactants = reactant_orders > 0
+        # The number of molecules of each species used by each reaction
+        self._consumption = np.clip(-self._change, 0, None)
+        self._squared_change = self._change ** 2
+
+        # The highest order of the reactions each species is a reactant of,
+        # and the order in the species of these reactions, which give the `g_i` of [Cao06]
+        total_orders = reactant_orders.sum(axis=1)
+        highest_orders = np.zeros(len(species), dtype=np.int)
+        species_orders = np.zeros(len(species), dtype=np.int)
+        for i in range(len(species)):
+            reactions = self._reactants[:, i]
+            if reactions.any():
+                highest_orders[i] = total_orders[reactions].max()
+                species_orders[i] = reactant_orders[reactions & (total_orders == highest_orders[i]), i].max()
+        self._highest_orders = highest_orders.astype(np.double)
+        self._second_order_in_species = (highest_orders == 2) & (species_orders == 2)
+        self._higher_order_and_second_order_in_species = (highest_orders >= 3) & (species_orders == 2)
+        self._higher_order_and_third_order_in_species = (highest_orders >= 3) & (species_orders >= 3)
+
+    def _highest_order_factors(self, state):
+        """
+        The factors `g_i` of [Cao06], that bound the relative changes of the propensities
+        for the relative changes of the amount of each species
+        """
+        factors = self._highest_orders.copy()
+        first = 1.0 / np.maximum(state - 1, 1)
+        second = 2.0 / np.maximum(state - 2, 1)
+        factors[self._second_order_in_species] = (2 + first)[self._second_order_in_species]
+        mask = self._higher_order_and_second_order_in_species
+        factors[mask] = (1.5 * (2 + first))[mask]
+        mask = self._higher_order_and_third_order_in_species
+        factors[mask] = (3 + first + second)[mask]
+        return factors
+
+    def _non_critical_step(self, state, non_critical_propensities, critical):
+        """
+        The longest step for which the expected relative changes of the propensities of the non critical reactions,
+        and their standard deviations, are below the tolerance (equation 33 of [Cao06])
+        """
+        reactant_species = self._reactants[~critical].any(axis=0)
+        if not reactant_species.any():
+            return np.inf
+
+        means = np.abs(non_critical_propensities.dot(self._change))[reactant_species]
+        variances = non_critical_propensities.dot(self._squared_change)[reactant_species]
+        factors = self._highest_order_factors(state)[reactant_species]
+        bounds = np.maximum(self._epsilon * state[reactant_species] / factors, 1.0)
+        with np.errstate(divide='ignore'):
+            return float(min((bounds / means).min(), (bounds ** 2 / variances).min()))
+
+    def _gssa(self, initial_conditions, timepoints):
+        """
+        Simulates the system with the tau-leaping method of [Cao06], starting at time zero.
+        The steps end at each of the timepoints, at which the amounts of species are recorded.
+
+        :param initial_conditions: the initial conditions of the system
+        :param timepoints: the timepoints to record the amounts of species at
+        :return: the amounts of each species at each of the timepoints, with a row for each timepoint
+        """
+        propensities_as_function = self._propensities_as_function
+        parameters = self._parameters
+        change = self._change
+        consumption = self._consumption
+        critical_threshold = self._critical_threshold
+        rng = self._rng
+
+        state = np.array(initial_conditions, dtype=np.double)
+        changes = list(change)
+        accumulate = np.add.accumulate
+        propensities = np.empty(len(change), dtype=np.double)
+        cumulative_propensities = np.empty(len(change), dtype=np.double)
+
+        species_over_time = np.empty((len(timepoints), len(state)), dtype=np.double)
+        # The timepoints are visited in increasing order
+        order = np.argsort(timepoints, kind='mergesort').tolist()
+        sorted_timepoints = [float(timepoints[i]) for i in order]
+        number_of_timepoints = len(order)
+        next_timepoint = 0
+
+        # The random numbers of the exact steps are drawn in chunks, and only used as python floats
+        random_number_index = _RANDOM_NUMBERS_CHUNK_SIZE
+        remaining_exact_steps = 0
+        t = 0.0
+        while True:
+            while next_timepoint < number_of_timepoints and sorted_timepoints[next_timepoint] <= t:
+                species_over_time[order[next_timepoint]] = state
+                next_timepoint += 1
+            if next_timepoint == number_of_timepoints:
+                break
+            next_time = sorted_timepoints[next_timepoint]
+
+            propensities_as_function(state, parameters, propensities)
+            accumulate(propensities, out=cumulative_propensities)
+            total_propensity = float(cumulative_propensities[-1])
+            if not total_propensity > 0:
+                # No reaction can happen any more
+                break
+
+            if remaining_exact_steps > 0:
+                remaining_exact_steps -= 1
+                if random_number_index == _RANDOM_NUMBERS_CHUNK_SIZE:
+                    exponentials = rng.standard_exponential(_RANDOM_NUMBERS_CHUNK_SIZE).tolist()
+                    uniforms = rng.random_sample(_RANDOM_NUMBERS_CHUNK_SIZE).tolist()
+                    random_number_index = 0
+
+                t += exponentials[random_number_index] / total_propensity
+                if t >= next_time:
+                    # The time to the next reaction does not depend on the time already waited for
+                    t = next_time
+                else:
+                    event = cumulative_propensities.searchsorted(uniforms[random_number_index] * total_propensity,
+                                                                 side='right')
+                    state += changes[event]
+                random_number_index += 1
+                continue
+
+            # The reactions that could exhaust one of their reactants within a few more reactions
+            with np.errstate(divide='ignore', invalid='ignore'):
+                maximum_numbers_of_reactions = np.where(consumption > 0, np.floor(state / consumption),
+                                                        np.inf).min(axis=1)
+            critical = (propensities > 0) & (maximum_numbers_of_reactions < critical_threshold)
+            non_critical_propensities = np.where(critical, 0.0, propensities)
+            non_critical_step = self._non_critical_step(state, non_critical_propensities, critical)
+
+            if non_critical_step < _EXACT_STEPS_THRESHOLD / total_propensity:
+                # Leaping would not be worth it
+                remaining_exact_steps = _NUMBER_OF_EXACT_STEPS
+                continue
+
+            critical_propensities = np.where(critical, propensities, 0.0)
+            critical_propensity = float(critical_propensities.sum())
+            while True:
+                if critical_propensity > 0:
+                    critical_step = rng.standard_exponential() / critical_propensity
+                else:
+                    critical_step = np.inf
+                step = min(non_critical_step, critical_step, next_time - t)
+
+                new_state = state + rng.poisson(non_critical_propensities * step).dot(change)
+                # The step is halved until none of the amounts of species becomes negative
+                if (new_state >= 0).all():
+                    break
+                non_critical_step /= 2
+
+            if critical_step == step:
+                # One of the critical reactions happens at the end of the step
+                event = np.cumsum(critical_propensities).searchsorted(rng.random_sample() * critical_propensity,
+                                                                      side='right')
+                new_state += change[min(event, len(change) - 1)]
+
+            state = new_state
+            # The steps up to the next timepoint end exactly at it
+            t = next_time if step == next_time - t else t + step
+
+        # The amounts do not change after the last reaction
+        species_over_time[order[next_timepoint:]] = state
+        return species_over_time
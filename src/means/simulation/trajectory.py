@@ -11,6 +11,8 @@ or from observation/measurement.
 
 The `TrajectoryCollection` class is a container of trajectories.
 It can be used like other containers such as lists.
+The results of simulations are collections created with :meth:`~TrajectoryCollection.from_array`,
+which keep the values of all of their trajectories in a single matrix.
 
 Both `~means.simulation.trajectory.TrajectoryCollection` and `~means.simulation.trajectory.Trajectory` have there own `.plot()`
 method to help representation.
@@ -37,7 +39,7 @@ class Trajectory(SerialisableObject):
 
     yaml_tag = u'!trajectory'
 
-    def __init__(self, timepoints, values, description):
+    def __init__(self, timepoints, values, description, copy=True):
         """
 
         :param timepoints: timepoints the trajectory was simulated for
@@ -46,9 +48,12 @@ class Trajectory(SerialisableObject):
         :type values: :class:`iterable`
         :param description: description of the trajectory
         :type description: :class:`~means.core.descriptors.Descriptor`
+        :param copy: whether to copy the timepoints and the values. If False, and they are arrays already,
+                     the trajectory is a view of them, so they should not be modified afterwards
+        :type copy: bool
         """
-        self._timepoints = np.array(timepoints)
-        self._values = np.array(values)
+        self._timepoints = np.array(timepoints, copy=copy)
+        self._values = np.array(values, copy=copy)
         self._description = description
 
         assert(isinstance(description, Descriptor))
@@ -67,8 +72,7 @@ class Trajectory(SerialisableObject):
         """
 
         file.write("time,value\n")
-        for t,v in self:
-            file.write("%f,%f\n"% (t, v))
+        _write_csv_lines(file, self.timepoints, [self.values])
 
     @property
     def timepoints(self):
@@ -161,10 +165,7 @@ class Trajectory(SerialisableObject):
         :rtype: :class:`~means.simulation.trajectory.Trajectory`
         """
         if not extrapolate:
-            if min(self.timepoints) > min(new_timepoints):
-                raise Exception("Some of the new time points are before any time points. If you really want to extrapolate, use `extrapolate=True`")
-            if max(self.timepoints) < max(new_timepoints):
-                raise Exception("Some of the new time points are after any time points. If you really want to extrapolate, use `extrapolate=True`")
+            _check_resampling_range(self.timepoints, new_timepoints)
         new_values = np.interp(new_timepoints, self.timepoints, self.values)
         return Trajectory(new_timepoints, new_values, self.description)
 
@@ -354,6 +355,53 @@ class TrajectoryWithSensitivityData(Trajectory):
         return dumper.represent_mapping(cls.yaml_tag, mapping)
 
 
+def _write_csv_lines(file, timepoints, values, prefixes=None):
+    """
+    Writes the 'time,value' lines of several trajectories with the same `timepoints` to a csv file.
+    The numbers are formatted all at once, and the timepoints only once.
+
+    :param file: a file object to write to
+    :param timepoints: the timepoints of the trajectories
+    :param values: the values of each of the trajectories, as rows of a matrix
+    :param prefixes: the text before the time on the lines of each of the trajectories, if any
+    """
+    if len(timepoints) == 0:
+        return
+    times = np.char.add(np.char.mod('%f', timepoints), ',')
+    values = np.char.mod('%f', np.asarray(values))
+    if prefixes is None:
+        prefixes = [''] * len(values)
+    for prefix, row in zip(prefixes, values):
+        file.write(prefix + ('\n' + prefix).join(np.char.add(times, row)) + '\n')
+
+
+def _linear_interpolation(timepoints, values, new_timepoints):
+    """
+    Linearly interpolates each of the rows of the `values` matrix at the `new_timepoints`.
+    Like :func:`numpy.interp`, the values are constant outside of the `timepoints`.
+    The interpolation weights are computed once for all of the rows.
+    """
+    new_timepoints = np.asarray(new_timepoints, dtype=np.double)
+    if len(timepoints) == 1:
+        return np.repeat(values, len(new_timepoints), axis=1).astype(np.double)
+
+    right = np.clip(np.searchsorted(timepoints, new_timepoints, side='right'), 1, len(timepoints) - 1)
+    left = right - 1
+    widths = timepoints[right] - timepoints[left]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = np.where(widths > 0, (new_timepoints - timepoints[left]) / widths, 1.0)
+    weights = np.clip(weights, 0.0, 1.0)
+
+    return values[:, left] * (1.0 - weights) + values[:, right] * weights
+
+
+def _check_resampling_range(timepoints, new_timepoints):
+    if min(timepoints) > min(new_timepoints):
+        raise Exception("Some of the new time points are before any time points. If you really want to extrapolate, use `extrapolate=True`")
+    if max(timepoints) < max(new_timepoints):
+        raise Exception("Some of the new time points are after any time points. If you really want to extrapolate, use `extrapolate=True`")
+
+
 def perturbed_trajectory(trajectory, sensitivity_trajectory, delta=1e-4):
     """
     Slightly perturb trajectory wrt the parameter specified in sensitivity_trajectory.
@@ -381,18 +429,151 @@ class TrajectoryCollection(SerialisableObject):
     """
     A container of trajectories with representation functions for matplotlib and IPythonNoteBook.
     In most cases, it simply behaves as list.
+
+    Collections created with :meth:`from_array` own a single matrix with the values of all of their trajectories,
+    which share the same timepoints. Their trajectories are views of the rows of this matrix,
+    and :meth:`resample`, :meth:`to_csv` and the arithmetic operations work on the whole matrix at once.
     """
 
     yaml_tag = '!trajectory-collection'
 
     trajectories = None
 
+    _timepoints = None
+    _values = None
+    _descriptions = None
+
     def __init__(self, trajectories):
         # Hack to allow passing instantiated TrajectoryCollection objects as well
         if isinstance(trajectories, self.__class__):
+            self._timepoints = trajectories._timepoints
+            self._values = trajectories._values
+            self._descriptions = trajectories._descriptions
             trajectories = trajectories.trajectories
         self._trajectories = trajectories
 
+    @classmethod
+    def from_array(cls, timepoints, values, descriptions):
+        """
+        Creates a collection of trajectories that share their timepoints from the matrix of their values.
+        The values are not copied if they are a C-contiguous array already.
+
+        :param timepoints: the timepoints of all of the trajectories
+        :type timepoints: :class:`iterable`
+        :param values: the values of the trajectories, with a row for each of the `descriptions`
+                       and a column for each of the `timepoints`
+        :type values: :class:`numpy.ndarray`
+        :param descriptions: the descriptions of each of the trajectories
+        :type descriptions: list[:class:`~means.core.descriptors.Descriptor`]
+        :rtype: :class:`TrajectoryCollection`
+        """
+        timepoints = np.asarray(timepoints)
+        values = np.ascontiguousarray(values)
+        descriptions = list(descriptions)
+        if values.shape != (len(descriptions), len(timepoints)):
+            raise ValueError('Expected the values of {0} trajectories at {1} timepoints, '
+                             'got an array of shape {2!r}'.format(len(descriptions), len(timepoints), values.shape))
+
+        collection = cls([])
+        collection._timepoints = timepoints
+        collection._values = values
+        collection._descriptions = descriptions
+        # The trajectories are only created when they are needed
+        collection._trajectories = None
+        return collection
+
+    @property
+    def timepoints(self):
+        """
+        The timepoints of all of the trajectories, for collections created with :meth:`from_array`, otherwise None.
+
+        :rtype: :class:`numpy.ndarray`
+        """
+        return self._timepoints
+
+    @property
+    def values(self):
+        """
+        The values of the trajectories, with a row for each trajectory and a column for each of the timepoints,
+        for collections created with :meth:`from_array`, otherwise None.
+
+        :rtype: :class:`numpy.ndarray`
+        """
+        return self._values
+
+    @property
+    def descriptions(self):
+        """
+        The descriptions of each of the trajectories
+
+        :rtype: list[:class:`~means.core.descriptors.Descriptor`]
+        """
+        if self._trajectories is None:
+            return list(self._descriptions)
+        return [trajectory.description for trajectory in self._trajectories]
+
+    def resample(self, new_timepoints, extrapolate=False):
+        """
+        Use linear interpolation to resample the values of all of the trajectories,
+        see :meth:`Trajectory.resample`.
+
+        :param new_timepoints: the new time points
+        :param extrapolate: whether extrapolation should be performed when some new time points
+            are out of the current time range. if extrapolate=False, it would raise an exception.
+        :return: a new collection of trajectories
+        :rtype: :class:`~means.simulation.trajectory.TrajectoryCollection`
+        """
+        if self._values is None:
+            return self.__class__([trajectory.resample(new_timepoints, extrapolate=extrapolate)
+                                   for trajectory in self])
+
+        if not extrapolate:
+            _check_resampling_range(self._timepoints, new_timepoints)
+        new_values = _linear_interpolation(self._timepoints, self._values, new_timepoints)
+        return self.from_array(new_timepoints, new_values, self.descriptions)
+
+    def __add__(self, other):
+        return self._arithmetic_operation(other, operator.add)
+    def __div__(self, other):
+        return self._arithmetic_operation(other, operator.div)
+    def __mul__(self, other):
+        return self._arithmetic_operation(other, operator.mul)
+    def __sub__(self, other):
+        return self._arithmetic_operation(other, operator.sub)
+    def __pow__(self, other):
+        return self._arithmetic_operation(other, operator.pow)
+
+    def __radd__(self, other):
+        # for `sum()`    to work
+        return self + other
+
+    def _arithmetic_operation(self, other, operation):
+        """
+        Applies an operation between the respective trajectories of two collections, or between each of the
+        trajectories of the collection and a scalar, see :meth:`Trajectory._arithmetic_operation`.
+        """
+        if isinstance(other, TrajectoryCollection):
+            if len(self) != len(other):
+                raise Exception("Cannot add collections with different numbers of trajectories")
+            if self._values is None or other._values is None:
+                return self.__class__([operation(trajectory, other_trajectory)
+                                       for trajectory, other_trajectory in zip(self, other)])
+
+            descriptions = self.descriptions
+            if descriptions != other.descriptions:
+                raise Exception("Cannot add trajectories with different descriptions")
+            if not np.array_equal(self._timepoints, other._timepoints):
+                raise Exception("Cannot add trajectories with different time points")
+            return self.from_array(self._timepoints, operation(self._values, other._values), descriptions)
+
+        elif isinstance(other, numbers.Real):
+            if self._values is None:
+                return self.__class__([operation(trajectory, other) for trajectory in self])
+            return self.from_array(self._timepoints, operation(self._values, float(other)), self.descriptions)
+        else:
+            raise Exception("Arithmetic operations is between two `TrajectoryCollection` objects "
+                            "or a `TrajectoryCollection` and a scalar.")
+
     def to_csv(self, file):
         """
         Write all the trajectories of a collection to a csv file with the headers 'description', 'time' and 'value'.
@@ -402,9 +583,13 @@ class TrajectoryCollection(SerialisableObject):
         :return:
         """
         file.write("description,time,value\n")
+        if self._values is not None:
+            prefixes = ["%s," % description.symbol for description in self.descriptions]
+            _write_csv_lines(file, self._timepoints, self._values, prefixes)
+            return
+
         for traj in self:
-            for t,v in traj:
-                file.write("%s,%f,%f\n"% (traj.description.symbol, t, v))
+            _write_csv_lines(file, traj.timepoints, [traj.values], ["%s," % traj.description.symbol])
 
 
     @property
@@ -413,6 +598,10 @@ class TrajectoryCollection(SerialisableObject):
         Return a list of all trajectories in the collection
         :rtype: list[:class:`~means.simulation.trajectory.Trajectory`]
         """
+        if self._trajectories is None:
+            # Views of the rows of the values, rather than copies
+            self._trajectories = [Trajectory(self._timepoints, values, description, copy=False)
+                                  for values, description in zip(self._values, self._descriptions)]
         return self._trajectories
 
     def __iter__(self):
@@ -422,6 +611,9 @@ class TrajectoryCollection(SerialisableObject):
         return len(self.trajectories)
 
     def __getitem__(self, item):
+        if isinstance(item, slice) and self._values is not None:
+            return self.from_array(self._timepoints, self._values[item], self.descriptions[item])
+
         answer = self.trajectories[item]
         if isinstance(answer, list):
             # Wrap around self class if we return a list of trajectories
@@ -520,6 +712,14 @@ class TrajectoryCollection(SerialisableObject):
     def __repr__(self):
         return str(self)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._values is not None:
+            # The trajectories are views of the values, so are not pickled
+            state['_descriptions'] = self.descriptions
+            state['_trajectories'] = None
+        return state
+
     @classmethod
     def to_yaml(cls, dumper, data):
         mapping = {'trajectories': data.trajectories}
@@ -532,3 +732,50 @@ class TrajectoryCollection(SerialisableObject):
     def __ne__(self, other):
         return not self == other
 
+
+
+class TrajectoryCollectionBatch(list):
+    """
+    The results of a batch of simulations, see :meth:`~means.simulation.simulate.Simulation.simulate_batch`.
+    It is a list of :class:`TrajectoryCollection` objects, one for each simulation,
+    which also gives the values of all of them stacked in a single array.
+    """
+
+    @property
+    def timepoints(self):
+        """
+        The timepoints of all of the trajectories, if all of the collections share them, otherwise None.
+
+        :rtype: :class:`numpy.ndarray`
+        """
+        if not self or any(collection.timepoints is None for collection in self):
+            return None
+        timepoints = self[0].timepoints
+        for collection in self[1:]:
+            if not np.array_equal(collection.timepoints, timepoints):
+                return None
+        return timepoints
+
+    @property
+    def values(self):
+        """
+        The values of all of the trajectories, with a matrix for each simulation, which has a row for
+        each trajectory and a column for each of the timepoints,
+        if all of the collections keep their values in a single matrix and share their timepoints, otherwise None.
+
+        :rtype: :class:`numpy.ndarray`
+        """
+        if self.timepoints is None or any(collection.values is None for collection in self):
+            return None
+        return np.array([collection.values for collection in self])
+
+    @property
+    def descriptions(self):
+        """
+        The descriptions of each of the trajectories of the first simulation
+
+        :rtype: list[:class:`~means.core.descriptors.Descriptor`]
+        """
+        if not self:
+            return []
+        return self[0].descriptions
@@ -0,0 +1,65 @@
+import unittest
+
+from means.approximation.mea import MomentExpansionApproximation
+from means.benchmarks import mass_action_network, benchmark_case, default_cases
+from means.benchmarks.approximation import _run_mea, _StageTimer
+from means.examples.sample_models import MODEL_P53
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_mass_action_network(self):
+        """
+        Given the number of species, a mass action network should be generated with a production and degradation
+        reaction for each species and a parameter for each reaction. The same seed should give the same network.
+        """
+        model = mass_action_network(3, number_of_reactions=4, seed=1)
+        self.assertEqual(len(model.species), 3)
+        self.assertEqual(len(model.propensities), 3 * 2 + 4)
+        self.assertEqual(len(model.parameters), len(model.propensities))
+        self.assertEqual(model.stoichiometry_matrix.shape, (3, 10))
+
+        self.assertEqual(model, mass_action_network(3, number_of_reactions=4, seed=1))
+        self.assertRaises(ValueError, mass_action_network, 0)
+
+    def test_timed_stages_give_the_same_problem(self):
+        """
+        Given the stages of MEA timed one by one, the resulting problem should be the same as the one
+        computed by `MomentExpansionApproximation.run()`.
+        """
+        timer = _StageTimer()
+        problem = _run_mea(MODEL_P53, 3, 'normal', timer)
+        expected = MomentExpansionApproximation(MODEL_P53, 3, closure='normal').run()
+
+        self.assertEqual(problem, expected)
+        self.assertEqual(timer.stages.keys(), ['moment_equations', 'closure'])
+
+    def test_benchmark_case(self):
+        """
+        Given a benchmark case, the result should describe the case, the time of each stage
+        and the size of the equations.
+        """
+        result = benchmark_case({'model': 'dimerisation', 'method': 'MEA', 'max_order': 2, 'closure': 'scalar'},
+                                compile_equations=False)
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['model'], 'dimerisation')
+        self.assertEqual(result['number_of_species'], 1)
+        self.assertEqual(result['number_of_equations'], 2)
+        self.assertGreater(result['operations'], 0)
+        self.assertAlmostEqual(result['approximation_time'], sum(result['stages'].values()))
+        self.assertGreater(result['peak_rss_kb'], 0)
+
+        result = benchmark_case({'model': 'no-such-model', 'method': 'LNA'})
+        self.assertIsNotNone(result['error'])
+
+    def test_default_cases(self):
+        """
+        Given the default cases, the first order should only be benchmarked with the scalar closure,
+        and there should be synthetic networks up to the requested number of species.
+        """
+        cases = default_cases(max_order=2, max_species=2)
+        self.assertNotIn({'model': 'p53', 'method': 'MEA', 'max_order': 1, 'closure': 'normal'}, cases)
+        self.assertIn({'model': 'p53', 'method': 'MEA', 'max_order': 1, 'closure': 'scalar'}, cases)
+        self.assertIn({'model': 'mass-action-2', 'method': 'MEA', 'max_order': 2, 'closure': 'gamma'}, cases)
+        self.assertIn({'model': 'mass-action-1', 'method': 'LNA'}, cases)
+        self.assertNotIn({'model': 'mass-action-3', 'method': 'LNA'}, cases)
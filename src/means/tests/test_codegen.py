@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+import sympy
+
+from means.util import codegen
+from means.util.codegen import compile_expressions, count_operations, eliminate_common_subexpressions
+
+
+class TestCompileExpressions(unittest.TestCase):
+
+    def setUp(self):
+        self.x, self.y = sympy.symbols(['x', 'y'])
+        self.c = sympy.Symbol('c')
+        expressions = [self.x + self.y * self.c, sympy.exp(self.x) / self.y, sympy.Integer(3)]
+        self.f = compile_expressions(expressions, [[self.c], [self.x, self.y]])
+
+    def test_all_expressions_are_written_to_output_buffer(self):
+        """
+        Given a function compiled from a list of expressions, a single call should
+        fill the provided output buffer with the values of each of the expressions.
+        """
+        out = np.zeros(3)
+        self.f(np.array([2.0]), np.array([1.0, 4.0]), out)
+        assert_array_almost_equal(out, [9.0, np.exp(1.0) / 4.0, 3.0])
+
+    def test_wrong_number_of_values_raises_value_error(self):
+        """
+        Given arrays whose lengths do not match the compiled arguments, the function should raise
+        a ValueError rather than read or write outside of the buffers.
+        """
+        self.assertRaises(ValueError, self.f, np.array([2.0]), np.array([1.0]), np.zeros(3))
+        self.assertRaises(ValueError, self.f, np.array([2.0]), np.array([1.0, 4.0]), np.zeros(2))
+
+    def test_batched_function_evaluates_each_row(self):
+        """
+        Given a batched function, a single call should evaluate the expressions for each row of the arguments,
+        and rows of the wrong length, or a different number of rows, should raise a ValueError.
+        """
+        expressions = [self.x + self.y * self.c, sympy.exp(self.x) / self.y, sympy.Integer(3)]
+        f = compile_expressions(expressions, [[self.c], [self.x, self.y]], batched=True)
+
+        out = np.zeros((2, 3))
+        f(np.array([[2.0], [1.0]]), np.array([[1.0, 4.0], [0.0, 2.0]]), out)
+        assert_array_almost_equal(out, [[9.0, np.exp(1.0) / 4.0, 3.0], [2.0, 0.5, 3.0]])
+
+        self.assertRaises(ValueError, f, np.array([[2.0]]), np.array([[1.0, 4.0], [0.0, 2.0]]), out)
+        self.assertRaises(ValueError, f, np.array([[2.0], [1.0]]), np.array([[1.0], [0.0]]), out)
+
+    def test_symbols_not_in_arguments_raise_value_error(self):
+        """
+        Given an expression with a symbol that is not among the arguments, compilation should fail early.
+        """
+        self.assertRaises(ValueError, compile_expressions, [self.x + self.y], [[self.x]])
+
+    def test_common_subexpressions_are_evaluated_as_temporaries(self):
+        """
+        Given expressions sharing a subexpression, eliminating the common subexpressions should reduce
+        the number of operations, and the function compiled with the temporaries should give the same values.
+        """
+        shared = sympy.log(1 + self.y / self.x ** 2)
+        expressions = [self.c * shared, shared + self.x ** 2, shared ** 2]
+        temporaries, reduced_expressions = eliminate_common_subexpressions(expressions)
+
+        self.assertLess(count_operations(reduced_expressions, temporaries), count_operations(expressions))
+
+        expected = np.zeros(3)
+        compile_expressions(expressions, [[self.c], [self.x, self.y]])(np.array([2.0]), np.array([1.0, 4.0]),
+                                                                       expected)
+        out = np.zeros(3)
+        compile_expressions(reduced_expressions, [[self.c], [self.x, self.y]], temporaries)(np.array([2.0]),
+                                                                                           np.array([1.0, 4.0]),
+                                                                                           out)
+        assert_array_almost_equal(out, expected)
+
+
+class TestCompiledCodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_directory = tempfile.mkdtemp()
+        self.__environment = os.environ.copy()
+        os.environ[codegen.CACHE_DIRECTORY_ENVIRONMENT_VARIABLE] = self.cache_directory
+        # Make sure we do not get the functions loaded by other tests
+        codegen._loaded_functions.clear()
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.__environment)
+        codegen._loaded_functions.clear()
+        shutil.rmtree(self.cache_directory)
+
+    def _cached_modules(self):
+        return sorted([entry for entry in os.listdir(self.cache_directory)
+                       if entry.startswith(codegen._MODULE_PREFIX)])
+
+    def test_compiled_module_is_reused_from_cache(self):
+        """
+        Given the same expressions compiled twice (e.g. by two different processes),
+        the second compilation should load the module from the cache rather than build a new one.
+        """
+        x, y = sympy.symbols(['x', 'y'])
+        compile_expressions([x * y], [[x, y]])
+        cached_modules = self._cached_modules()
+        self.assertEqual(len(cached_modules), 1)
+
+        codegen._loaded_functions.clear()
+        build_module = codegen._build_module
+        codegen._build_module = None
+        try:
+            f = compile_expressions([x * y], [[x, y]])
+        finally:
+            codegen._build_module = build_module
+
+        out = np.zeros(1)
+        f(np.array([2.0, 3.0]), out)
+        self.assertEqual(out[0], 6.0)
+        self.assertEqual(self._cached_modules(), cached_modules)
+
+    def test_least_recently_used_modules_are_evicted(self):
+        """
+        Given a cache that can only fit a single module, compiling a new module should evict the old one.
+        """
+        os.environ[codegen.CACHE_SIZE_ENVIRONMENT_VARIABLE] = '1'
+        x, y = sympy.symbols(['x', 'y'])
+
+        compile_expressions([x + y], [[x, y]])
+        first_modules = self._cached_modules()
+        compile_expressions([x - y], [[x, y]])
+        second_modules = self._cached_modules()
+
+        self.assertEqual(len(first_modules), 1)
+        self.assertEqual(len(second_modules), 1)
+        self.assertNotEqual(first_modules, second_modules)
+
+    def test_cache_can_be_disabled(self):
+        """
+        Given an empty cache directory setting, nothing should be written to disk.
+        """
+        os.environ[codegen.CACHE_DIRECTORY_ENVIRONMENT_VARIABLE] = ''
+        x, y = sympy.symbols(['x', 'y'])
+        f = compile_expressions([x / y], [[x, y]])
+
+        out = np.zeros(1)
+        f(np.array([3.0, 2.0]), out)
+        self.assertEqual(out[0], 1.5)
+        self.assertEqual(self._cached_modules(), [])
@@ -5,8 +5,12 @@ from sympy import Symbol, Float, MutableDenseMatrix
 from means.core import Moment, ODEProblem
 import numpy as np
 from means.inference import Inference, InferenceWithRestarts
+from means.inference.inference import MAX_DIST, TooManySolverExceptions
+from means.inference.distances import get_distance_function, get_distance_gradient_function
+from means.simulation.adjoint import AdjointSimulation
+from means.simulation.cache import SimulationCache
 # We need renaming as otherwise nose picks it up as a test
-from means.simulation import Trajectory
+from means.simulation import Trajectory, Simulation
 
 
 def _generate_ode_problem():
@@ -200,6 +204,28 @@ class TestInference(unittest.TestCase):
                           [1, 2, 3], [1, 2, 3])
 
 
+    def test_simulations_only_return_the_trajectories_the_distance_needs(self):
+        """
+        Given observed means, the simulations should only return the observed trajectories for the sum of squares,
+        the observed trajectories and their variances for the likelihood distances,
+        and all of the trajectories for custom distance functions.
+        """
+        observed_means = self.observed_trajectories[:1]
+        mean, variance = self.dimer_problem.left_hand_side_descriptors
+
+        for distance, expected in [('sum_of_squares', [mean]), ('normal', [mean, variance]),
+                                   ('gamma', [mean, variance]), (lambda x, y: 0.0, None)]:
+            inference = Inference(self.dimer_problem, [0.001, 0.5, 330.0], [320.0, 0], ['c_0'],
+                                  observed_means, distance_function_type=distance)
+            self.assertEqual(inference._simulation_outputs, expected)
+
+            if expected is not None:
+                simulation = Simulation(self.dimer_problem, solver='scipy-lsoda')
+                trajectories = simulation.simulate_system([0.001, 0.5, 330.0], [320.0, 0],
+                                                          observed_means[0].timepoints, outputs=expected)
+                self.assertEqual([trajectory.description for trajectory in trajectories], expected)
+
+
 class _TestInferenceForRegressions(unittest.TestCase):
     def setUp(self):
         self.dimer_problem = _generate_ode_problem()
@@ -357,6 +383,117 @@ class TestLogNormalInferenceForRegressions(_TestInferenceForRegressions):
         self.assertAlmostEqual(inference_result.distance_at_minimum, 2083.9377399579698)
 
 
+class TestInferenceWithGradient(unittest.TestCase):
+    def setUp(self):
+        self.dimer_problem = _generate_ode_problem()
+        self.observed_trajectories = _generate_observed_trajectories()
+
+    def test_distance_gradients_match_finite_differences(self):
+        """
+        Given each of the distances that support gradients, the gradients computed with the adjoint method
+        should match the finite-difference approximations of the derivatives of the distance.
+        """
+        parameters = np.array([0.0003, 0.2, 300.0])
+        initial_conditions = np.array([310.0, 5.0])
+        timepoints = self.observed_trajectories[0].timepoints
+        simulation = AdjointSimulation(self.dimer_problem, rtol=1e-10, atol=1e-10)
+
+        for distance in ['sum_of_squares', 'normal', 'gamma', 'lognormal']:
+            if distance == 'sum_of_squares':
+                observed_trajectories = self.observed_trajectories
+            else:
+                # Only the means can be compared with the likelihood distances
+                observed_trajectories = self.observed_trajectories[:1]
+            lookup = {trajectory.description: trajectory for trajectory in observed_trajectories}
+            distance_function = get_distance_function(distance)
+            gradient_function = get_distance_gradient_function(distance)
+
+            _, parameter_gradient, initial_conditions_gradient = simulation.simulate_with_gradient(
+                parameters, initial_conditions, timepoints, lambda trajectories: gradient_function(trajectories,
+                                                                                                   lookup))
+
+            def d(parameters, initial_conditions):
+                return distance_function(simulation.simulate_system(parameters, initial_conditions, timepoints),
+                                         lookup)
+
+            for values, gradient, index in [(parameters, parameter_gradient, i) for i in range(3)] + \
+                                           [(initial_conditions, initial_conditions_gradient, i) for i in range(2)]:
+                step = 1e-5 * values[index]
+                increased, decreased = values.copy(), values.copy()
+                increased[index] += step
+                decreased[index] -= step
+                if values is parameters:
+                    difference = d(increased, initial_conditions) - d(decreased, initial_conditions)
+                else:
+                    difference = d(parameters, increased) - d(parameters, decreased)
+
+                self.assertAlmostEqual(gradient[index] / (difference / (2 * step)), 1.0, places=3)
+
+    def test_sum_of_squares_inference_with_gradient(self):
+        """
+        Given the sum of squares regression problem, the inference using the gradients should
+        find a distance at least as small as the simplex algorithm does.
+        """
+        inference = TestSumOfSquaresForRegressions('test')
+        inference.setUp()
+        result = inference.generate_inference_object().infer(use_gradient=True)
+
+        self.assertTrue(result.convergence_status.convergence_achieved)
+        self.assertLess(result.distance_at_minimum, 0.43629439037027307)
+        assert_array_almost_equal(result.optimal_parameters, [1.27060389e-04, 8.91720586e-02, 3.01089632e+02],
+                                  decimal=3)
+
+    def test_normal_inference_with_gradient(self):
+        """
+        Given the normal distribution regression problem, the inference using the gradients should
+        converge to the same parameters as the simplex algorithm.
+        """
+        inference = TestNormalInferenceForRegressions('test')
+        inference.setUp()
+        result = inference.generate_inference_object().infer(use_gradient=True)
+
+        assert_array_almost_equal(result.optimal_parameters, [9.87875974e-05, 1.15097593e-01, 2.60000000e+02],
+                                  decimal=2)
+        self.assertAlmostEqual(result.distance_at_minimum, 115.45347133557553, places=0)
+
+    def test_inference_with_gradient_backs_off_from_failed_simulations(self):
+        """
+        Given a distance that cannot be computed beyond some value of the parameter, past its minimum,
+        the inference using the gradients should back off from the guesses it fails at and converge to the minimum.
+        If the distance cannot be computed at the starting values, it should fail with TooManySolverExceptions.
+        """
+        class DistancesCalculatorStub(object):
+            def __init__(self, limit):
+                self.limit = limit
+                self.failures = 0
+
+            def distance_and_gradient(self, guess):
+                if guess[0] > self.limit:
+                    self.failures += 1
+                    return MAX_DIST, np.zeros(1)
+                return 1e6 * (guess[0] - 0.004) ** 2, 2e6 * (guess[0] - 0.004) * np.ones(1)
+
+        inference = Inference(self.dimer_problem, [0.001, 0.5, 330.0], [320.0, 0], ['c_0'],
+                              self.observed_trajectories)
+        distances_calculator = DistancesCalculatorStub(0.005)
+        guess, distance, _, _, warning_flag = inference._minimise_with_gradient(distances_calculator, [0.001],
+                                                                                False)
+        self.assertGreater(distances_calculator.failures, 0)
+        self.assertEqual(warning_flag, 0)
+        self.assertAlmostEqual(guess[0], 0.004)
+        self.assertAlmostEqual(distance, 0.0)
+
+        self.assertRaises(TooManySolverExceptions, inference._minimise_with_gradient,
+                          DistancesCalculatorStub(0.0005), [0.001], False)
+
+    def test_gradient_is_not_available_for_custom_distances(self):
+        """
+        Given a custom distance function, inference with gradients should fail with ValueError.
+        """
+        inference = Inference(self.dimer_problem, [0.001, 0.5, 330.0], [320.0, 0], ['c_0'],
+                              self.observed_trajectories, distance_function_type=lambda x, y: 0.0)
+        self.assertRaises(ValueError, inference.infer, use_gradient=True)
+
 class InferenceWithRestartsStub(InferenceWithRestarts):
     def __init__(self, inference_objects):
         self.__inference_objects = inference_objects
@@ -415,6 +552,20 @@ class TestInferenceWithRestarts(unittest.TestCase):
         self.assertEqual(results.results[1].distance_at_minimum, 3)
         self.assertEqual(results.results[2].distance_at_minimum, 5)
 
+    def test_inference_with_restarts_shares_the_simulation_cache(self):
+        """
+        Given an InferenceWithRestarts with ``cache=True``, all of its inference objects should
+        simulate the system with the same cache.
+        """
+        inference = InferenceWithRestarts(_generate_ode_problem(), 3, [(0.0001, 0.001), (0.1, 0.5), (260.0, 330.0)],
+                                          [(290.0, 320.0)], ['c_0'], _generate_observed_trajectories(),
+                                          solver='scipy-lsoda', cache=True)
+        caches = [inference_object.simulation.cache for inference_object in inference._inference_objects]
+
+        self.assertIsInstance(caches[0], SimulationCache)
+        for cache in caches[1:]:
+            self.assertIs(cache, caches[0])
+
     def test_inference_with_restarts_for_regressions(self):
         """
         Given all the regression tests for inference that have passed already, create a InferenceWithRestarts instance
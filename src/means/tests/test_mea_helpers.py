@@ -1,6 +1,7 @@
 import unittest
 import sympy as sp
-from means.approximation.mea.mea_helpers import get_one_over_n_factorial, derive_expr_from_counter_entry
+from means.approximation.mea.mea_helpers import get_one_over_n_factorial, derive_expr_from_counter_entry, \
+    DerivativeLattice
 from means.util.sympyhelpers import assert_sympy_expressions_equal
 
 
@@ -34,6 +35,26 @@ class TaylorExpansionTestCase(unittest.TestCase):
         assert_sympy_expressions_equal(c_expected, c_result)
 
 
+    def test_derivative_lattice(self):
+        """
+        Given a derivative lattice, the derivatives should be the same as when computed directly,
+        the lower derivatives should be memoised on the way, and no more than `max_size` derivatives should be kept.
+        """
+        expr = sp.simplify("c_0*y_0*(y_0 + y_1 - 181)/(y_2+c_1*y_1)")
+        vars = sp.simplify(["y_0", "y_1", "y_2"])
+
+        lattice = DerivativeLattice(vars)
+        assert_sympy_expressions_equal(sp.diff(sp.diff(expr, "y_0"), "y_1"), lattice.derive(expr, (1, 1, 0)))
+        # (1, 0, 0) and (1, 1, 0)
+        self.assertEqual(len(lattice), 2)
+        assert_sympy_expressions_equal(sp.diff(expr, "y_0"), lattice.derive(expr, (1, 0, 0)))
+        self.assertEqual(len(lattice), 2)
+        assert_sympy_expressions_equal(sp.diff(expr, "y_1", 2), lattice.derive(expr, (0, 2, 0)))
+
+        small_lattice = DerivativeLattice(vars, max_size=2)
+        assert_sympy_expressions_equal(sp.diff(sp.diff(expr, "y_2", 3), "y_1"), small_lattice.derive(expr, (0, 1, 3)))
+        self.assertEqual(len(small_lattice), 2)
+
     def test_get_factorial_term(self):
         """
         Given the tuples of integers a and b,
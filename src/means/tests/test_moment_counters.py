@@ -0,0 +1,45 @@
+import itertools
+import unittest
+
+import sympy as sp
+
+from means.core import Moment
+from means.util.moment_counters import compositions, generate_n_and_k_counters, MomentLattice
+
+
+class TestCompositions(unittest.TestCase):
+
+    def test_compositions_are_the_vectors_of_the_given_order(self):
+        """
+        Given an order and a number of parts, the compositions should be exactly the vectors
+        of that length and sum, in lexicographic order.
+        """
+        for order, number_of_parts in [(0, 3), (1, 1), (3, 2), (4, 3)]:
+            expected = [v for v in itertools.product(range(order + 1), repeat=number_of_parts) if sum(v) == order]
+            self.assertEqual(list(compositions(order, number_of_parts)), expected)
+
+
+class TestMomentLattice(unittest.TestCase):
+
+    def setUp(self):
+        self.species = sp.symbols(['y_0', 'y_1', 'y_2'])
+        self.n_counter, self.k_counter = generate_n_and_k_counters(3, self.species)
+        self.lattice = MomentLattice(self.k_counter)
+
+    def test_lookup_by_n_vector(self):
+        """
+        Given a lattice of moments, each moment should be found by its n-vector.
+        """
+        for moment in self.k_counter:
+            self.assertEqual(self.lattice[moment.n_vector], moment)
+        self.assertEqual(self.lattice[(0, 1, 0)], Moment([0, 1, 0], self.species[1]))
+        self.assertFalse((5, 0, 0) in self.lattice)
+        self.assertRaises(KeyError, self.lattice.__getitem__, (5, 0, 0))
+
+    def test_lower_moments_are_the_same_as_scanning_the_counter(self):
+        """
+        Given a lattice of moments, the lower moments of each moment should be the moments `k` such that
+        `moment >= k`, in the order of the counter.
+        """
+        for moment in self.n_counter:
+            self.assertEqual(self.lattice.lower_moments(moment), [k for k in self.k_counter if moment >= k])
@@ -1,5 +1,6 @@
 import unittest
 import sympy
+import means
 from numpy import array
 from means.approximation.mea.moment_expansion_approximation import MomentExpansionApproximation
 from means.core import Moment, ODEProblem, Model
@@ -451,6 +452,64 @@ class TestMomentExpansionApproximationOnMaxOrderIsTwo(unittest.TestCase):
 
 class TestMomentExpansionApproximation(unittest.TestCase):
 
+    def test_run_in_parallel(self):
+        """
+        Given a number of processes larger than one, the problem generated in parallel
+        should be the same as the one generated serially, with the equations in the same order.
+        """
+        mm_model = Model(parameters=['c_0', 'c_1', 'c_2'],
+                         species=['y_0', 'y_1'],
+                         propensities=['c_0*y_0*(120-301+y_0+y_1)',
+                                       'c_1*(301-(y_0+y_1))',
+                                       'c_2*(301-(y_0+y_1))'],
+                         stoichiometry_matrix=[[-1, 1, 0],
+                                               [0, 0, 1]])
+
+        for closure in ['scalar', 'normal']:
+            expected = MomentExpansionApproximation(mm_model, max_order=3, closure=closure).run()
+            mea = MomentExpansionApproximation(mm_model, max_order=3, closure=closure, number_of_processes=2)
+            answer = mea.run()
+
+            self.assertEqual(answer.left_hand_side_descriptors, expected.left_hand_side_descriptors)
+            self.assertEqual(answer.right_hand_side, expected.right_hand_side)
+
+    def test_cse_is_passed_to_the_problem(self):
+        """
+        Given `cse`, the problems generated by the moment expansion and the linear noise approximations
+        should eliminate common subexpressions, and not otherwise, with the same equations.
+        """
+        model = Model(parameters=['c_0', 'c_1'], species=['y_0'], propensities=['c_0', 'c_1*y_0'],
+                      stoichiometry_matrix=[[1, -1]])
+
+        for approximate in [lambda **kwargs: means.mea_approximation(model, 2, **kwargs),
+                            lambda **kwargs: means.mea_approximation(model, 2, closure='normal', **kwargs),
+                            lambda **kwargs: means.lna_approximation(model, **kwargs)]:
+            expected = approximate()
+            problem = approximate(cse=True)
+            self.assertFalse(expected.cse)
+            self.assertTrue(problem.cse)
+            self.assertEqual(problem.right_hand_side, expected.right_hand_side)
+
+    def test_run_for_increasing_and_decreasing_orders(self):
+        """
+        Given an approximation that is run for several orders in turn, each of the problems
+        should be the same as the one obtained by a new approximation for that order.
+        """
+        mm_model = Model(parameters=['c_0', 'c_1', 'c_2'],
+                         species=['y_0', 'y_1'],
+                         propensities=['c_0*y_0*(120-301+y_0+y_1)',
+                                       'c_1*(301-(y_0+y_1))',
+                                       'c_2*(301-(y_0+y_1))'],
+                         stoichiometry_matrix=[[-1, 1, 0],
+                                               [0, 0, 1]])
+
+        mea = MomentExpansionApproximation(mm_model, max_order=1)
+        for max_order in [1, 2, 3, 2]:
+            expected = MomentExpansionApproximation(mm_model, max_order=max_order).run()
+            answer = mea.run(max_order=max_order)
+
+            self.assertEqual(answer.left_hand_side_descriptors, expected.left_hand_side_descriptors)
+            self.assertEqual(answer.right_hand_side, expected.right_hand_side)
 
     def test_substitute_raw_with_central(self):
         n_counter = [
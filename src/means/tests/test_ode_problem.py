@@ -1,7 +1,7 @@
 import unittest
 
 import numpy as np
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_array_almost_equal
 import sympy
 
 from means.core import ODEProblem, Moment, VarianceTerm
@@ -31,6 +31,41 @@ class TestODEProblem(unittest.TestCase):
                                               # otherwise ExplicitEuler solver would fail.
         assert_array_equal(actual_ans, expected_ans)
 
+    def test_ode_rhs_as_function_fills_preallocated_buffer(self):
+        """
+        Given an output buffer, rhs_as_function should write the values of all equations into it
+        and return that same buffer.
+        """
+        lhs = [Moment(np.ones(3),i) for i in sympy.Matrix(['y_1', 'y_2', 'y_3'])]
+        rhs = to_sympy_matrix(['y_1+y_2+c_2', 'y_2+y_3+c_3', 'y_3+c_1'])
+
+        p = ODEProblem('MEA', lhs, rhs, parameters=sympy.symbols(['c_1', 'c_2', 'c_3']))
+
+        out = np.zeros(3)
+        actual_ans = p.right_hand_side_as_function([4, 5, 6], [1, 2, 3], out=out)
+
+        self.assertIs(actual_ans, out)
+        assert_array_equal(out, np.array([11, 14, 7]))
+
+    def test_ode_rhs_as_batch_function(self):
+        """
+        Given matrices of values for the variables and constants, the batch function should evaluate
+        the right hand side for each of their rows, giving the same values as the single function.
+        """
+        lhs = [Moment(np.ones(3),i) for i in sympy.Matrix(['y_1', 'y_2', 'y_3'])]
+        rhs = to_sympy_matrix(['y_1+y_2+c_2', 'y_2*y_3+c_3', 'exp(y_3)*c_1'])
+
+        for cse in [False, True]:
+            p = ODEProblem('MEA', lhs, rhs, parameters=sympy.symbols(['c_1', 'c_2', 'c_3']), cse=cse)
+
+            values = np.array([[4, 5, 6], [1, 0, 2], [0.5, 0.25, 1]])
+            constants = np.array([[1, 2, 3], [3, 2, 1], [0, 0, 0.5]])
+            actual_ans = p.right_hand_side_as_batch_function(values, constants)
+
+            self.assertEqual(actual_ans.shape, (3, 3))
+            for row, (v, c) in enumerate(zip(values, constants)):
+                assert_array_almost_equal(actual_ans[row], p.right_hand_side_as_function(v, c))
+
     def _check_ode_rhs_as_function_ans(self, p1_rhs_as_function, p2_rhs_as_function):
 
         constants = [1, 2, 3]
@@ -85,6 +120,70 @@ class TestODEProblem(unittest.TestCase):
         assert_array_equal(p1_ans_after_p2, p1_expected_ans)
 
 
+    def test_ode_jacobian_as_function(self):
+        """
+        Given an ODEProblem, the value of jacobian_as_function should be the same as
+        the jacobian of the rhs evaluated for the same values, and the sparse version of it
+        should represent the same matrix.
+        """
+        lhs = [Moment(np.ones(3), i) for i in sympy.Matrix(['y_1', 'y_2', 'y_3'])]
+        rhs = to_sympy_matrix(['y_1*y_2+c_2', 'c_1*y_3**2', 'y_3+c_1'])
+        p = ODEProblem('MEA', lhs, rhs, parameters=sympy.symbols(['c_1', 'c_2', 'c_3']))
+
+        values = [2, 3, 5]
+        constants = [7, 11, 13]
+        expected_ans = np.array([[3, 2, 0],
+                                 [0, 0, 70],
+                                 [0, 0, 1]], dtype=float)
+
+        assert_array_equal(p.jacobian_as_function(values, constants), expected_ans)
+        assert_array_equal(p.sparse_jacobian_as_function(values, constants).toarray(), expected_ans)
+        self.assertEqual(p.sparse_jacobian_as_function(values, constants).nnz, 4)
+
+    def test_ode_sensitivity_rhs_as_function(self):
+        """
+        Given an ODEProblem, the derivatives with respect to the parameters should be the same as
+        differentiating the right hand side symbolically, and the right hand side of the sensitivity equations
+        should be the Jacobian times the sensitivities plus these derivatives.
+        """
+        lhs = [Moment(np.ones(2), i) for i in sympy.Matrix(['y_1', 'y_2'])]
+        rhs = to_sympy_matrix(['c_1*y_1*y_2', 'c_2*y_1 - c_1*c_3'])
+        p = ODEProblem('MEA', lhs, rhs, parameters=sympy.symbols(['c_1', 'c_2', 'c_3']))
+
+        values = [2, 3]
+        constants = [5, 7, 11]
+        # d/dc_1, d/dc_2, d/dc_3
+        expected_parameter_jacobian = np.array([[6, 0, 0],
+                                                [-11, 2, -5]])
+        assert_array_equal(p.parameter_jacobian_as_function(values, constants), expected_parameter_jacobian)
+
+        sensitivities = np.array([[1, 2, 3], [4, 5, 6]])
+        expected_ans = p.jacobian_as_function(values, constants).dot(sensitivities) + expected_parameter_jacobian
+        assert_array_equal(p.sensitivity_right_hand_side_as_function(values, constants, sensitivities), expected_ans)
+
+    def test_ode_cse_gives_same_values(self):
+        """
+        Given an ODEProblem with common subexpressions eliminated, the right hand side and the jacobian
+        should evaluate to the same values as without the elimination, and the report should show
+        the reduction in the number of operations.
+        """
+        lhs = [Moment(np.ones(3), i) for i in sympy.Matrix(['y_1', 'y_2', 'y_3'])]
+        rhs = to_sympy_matrix(['c_1*log(1+y_2/y_1**2)', 'y_3*log(1+y_2/y_1**2)', 'c_2*log(1+y_2/y_1**2)**2'])
+        parameters = sympy.symbols(['c_1', 'c_2', 'c_3'])
+        p = ODEProblem('MEA', lhs, rhs, parameters=parameters)
+        p_cse = ODEProblem('MEA', lhs, rhs, parameters=parameters, cse=True)
+
+        values = [2, 3, 5]
+        constants = [7, 11, 13]
+        assert_array_almost_equal(p_cse.right_hand_side_as_function(values, constants),
+                                  p.right_hand_side_as_function(values, constants))
+        assert_array_almost_equal(p_cse.jacobian_as_function(values, constants),
+                                  p.jacobian_as_function(values, constants))
+
+        report = p_cse.common_subexpression_report
+        self.assertLess(report['operations_after'], report['operations_before'])
+        self.assertGreater(report['temporaries'], 0)
+
     def test_ode_moment_no_description_from_variance_terms(self):
         """
         Given  Variance terms as left hand side terms, the generated descriptions
@@ -3,11 +3,19 @@ import means
 from means.util.sympyhelpers import to_sympy_matrix
 from means.core import ODEProblem, ODETermBase, Moment, VarianceTerm
 from means.simulation import Simulation
-from numpy.testing import assert_array_almost_equal
+from means.simulation.solvers import SolverBase, ScipyLSODASolverWithSensitivities
+from means.examples.sample_models import MODEL_P53
+from numpy.testing import assert_array_almost_equal, assert_array_equal
 import numpy as np
 import random
 from sympy import Symbol, MutableDenseMatrix, symbols, Float
 
+try:
+    from assimulo.solvers import CVode
+    ASSIMULO_AVAILABLE = True
+except ImportError:
+    ASSIMULO_AVAILABLE = False
+
 
 class ConstantDerivativesProblem(ODEProblem):
     def __init__(self):
@@ -42,11 +50,224 @@ class TestSimulate(unittest.TestCase):
         for solver in Simulation.supported_solvers():
             self.check_simple_problem(solver=solver)
 
+    @unittest.skipIf(not ASSIMULO_AVAILABLE, 'Assimulo is not installed')
+    def test_cvode_with_sparse_jacobian(self):
+        """
+        Given CVode with the sparse linear solver, the sparse Jacobian should be passed with its number of
+        non-zero entries, and the results should be the same as with the dense Jacobian.
+        """
+        problem = means.mea_approximation(MODEL_P53, 2)
+        timepoints = np.arange(0, 40, 1.0)
+        parameters = [90, 0.002, 1.7, 1.1, 0.93, 0.96, 0.01]
+        initial_conditions = [70, 30, 60]
+
+        expected = Simulation(problem, solver='cvode', rtol=1e-8, atol=1e-8).simulate_system(
+            parameters, initial_conditions, timepoints)
+        trajectories = Simulation(problem, solver='cvode', linear_solver='SPARSE', rtol=1e-8, atol=1e-8)\
+            .simulate_system(parameters, initial_conditions, timepoints)
+        for expected_trajectory, trajectory in zip(expected, trajectories):
+            assert_array_almost_equal(expected_trajectory.values, trajectory.values, decimal=3)
+
+    def test_scipy_solvers(self):
+        """
+        Given the scipy solvers, the simple problem should be simulated correctly without Assimulo,
+        with or without the Jacobian, and the results of a nonlinear problem should agree between the solvers.
+        """
+        for solver in ['scipy-lsoda', 'scipy-bdf', 'scipy-radau', 'scipy-rk45']:
+            self.assertIn(solver, Simulation.supported_solvers())
+            self.check_simple_problem(solver=solver)
+            self.check_simple_problem(solver=solver, usejac=False)
+
+        problem = means.mea_approximation(MODEL_P53, 2)
+        timepoints = np.arange(0, 40, 1.0)
+        parameters = [90, 0.002, 1.7, 1.1, 0.93, 0.96, 0.01]
+        initial_conditions = [70, 30, 60]
+
+        expected = Simulation(problem, solver='scipy-lsoda', rtol=1e-8, atol=1e-8).simulate_system(
+            parameters, initial_conditions, timepoints)
+        for solver in ['scipy-bdf', 'scipy-radau', 'scipy-rk45']:
+            trajectories = Simulation(problem, solver=solver, rtol=1e-8, atol=1e-8).simulate_system(
+                parameters, initial_conditions, timepoints)
+            for expected_trajectory, trajectory in zip(expected, trajectories):
+                assert_array_almost_equal(expected_trajectory.values, trajectory.values, decimal=3)
+
+    def test_solver_is_reset_between_simulations(self):
+        """
+        Given several simulations with the same simulation object, the solver should be reset rather than
+        built again, and the results should be the same as the ones of a new simulation object.
+        """
+        solvers = Simulation.supported_solvers()
+        if not ASSIMULO_AVAILABLE:
+            # Only the scipy and ensemble solvers can be used without Assimulo
+            solvers = [solver for solver in solvers if solver.startswith('scipy-') or solver.startswith('ensemble-')]
+
+        # The descriptors of the equations are only equal to themselves, so both simulations use the same problem
+        problem = ConstantDerivativesProblem()
+        for solver in solvers:
+            simulation_object = Simulation(problem, solver=solver)
+            timepoints = [0, 1, 2, 3]
+
+            first = simulation_object.simulate_system([0, 1], [3, 2], timepoints)
+            solver_instance = simulation_object._solver_session
+
+            second = simulation_object.simulate_system([1, 2], [1, 1], [1, 2, 3, 4])
+            self.assertIs(solver_instance, simulation_object._solver_session)
+            self.assertEqual(Simulation(problem, solver=solver).simulate_system([1, 2], [1, 1], [1, 2, 3, 4]), second)
+
+            self.assertEqual(first, simulation_object.simulate_system([0, 1], [3, 2], timepoints))
+
+    def test_simulate_batch(self):
+        """
+        Given a matrix of parameters and a single set of initial conditions,
+        the batch of simulations should be the same as simulating each of the parameter sets one by one,
+        in the same order, whether or not they are simulated in parallel.
+        Their values should be stacked in a single array.
+        """
+        simulation_object = Simulation(ConstantDerivativesProblem(), solver='scipy-lsoda')
+        parameter_matrix = [[0, 1], [1, 2], [2, 3]]
+        timepoints = [0, 1, 2, 3]
+
+        expected = [simulation_object.simulate_system(parameters, [3, 2], timepoints)
+                    for parameters in parameter_matrix]
+
+        self.assertEqual(expected, simulation_object.simulate_batch(parameter_matrix, [3, 2], timepoints))
+        results = simulation_object.simulate_batch(parameter_matrix, [[3, 2]] * 3, timepoints, number_of_processes=2)
+        self.assertEqual(expected, results)
+
+        assert_array_equal(results.timepoints, timepoints)
+        assert_array_equal(results.values, [trajectories.values for trajectories in expected])
+        self.assertEqual(results.descriptions, expected[0].descriptions)
+
+    def test_ensemble_solvers(self):
+        """
+        Given the ensemble solvers, a batch of simulations of a nonlinear problem should be the same
+        as simulating each of the parameter sets one by one, and close to the results of an adaptive solver.
+        The simple problem should be simulated exactly.
+        """
+        for solver in ['ensemble-euler', 'ensemble-rungekutta4']:
+            self.check_simple_problem(solver=solver)
+
+        problem = means.mea_approximation(MODEL_P53, 2)
+        timepoints = np.arange(0, 10, 0.5)
+        parameter_matrix = [[90, 0.002, 1.7, 1.1, 0.93, 0.96, 0.01],
+                            [80, 0.002, 1.5, 1.1, 0.93, 0.96, 0.01],
+                            [90, 0.003, 1.7, 1.0, 0.90, 0.96, 0.02]]
+        initial_conditions = [70, 30, 60]
+
+        ensemble = Simulation(problem, solver='ensemble-rungekutta4', h=0.01)
+        results = ensemble.simulate_batch(parameter_matrix, initial_conditions, timepoints)
+        self.assertEqual(len(results), 3)
+
+        reference = Simulation(problem, solver='scipy-lsoda', rtol=1e-8, atol=1e-8)
+        for parameters, trajectories in zip(parameter_matrix, results):
+            self.assertEqual(trajectories, ensemble.simulate_system(parameters, initial_conditions, timepoints))
+            expected = reference.simulate_system(parameters, initial_conditions, timepoints)
+            for expected_trajectory, trajectory in zip(expected, trajectories):
+                assert_array_almost_equal(expected_trajectory.timepoints, trajectory.timepoints)
+                assert_array_almost_equal(expected_trajectory.values, trajectory.values, decimal=3)
+
+    def test_simulate_batch_checks_the_shapes(self):
+        """
+        Given matrices of parameters and initial conditions with a different number of rows,
+        or rows of the wrong length, the batch simulation should fail before simulating anything.
+        """
+        simulation_object = Simulation(ConstantDerivativesProblem())
+        timepoints = [0, 1, 2, 3]
+        self.assertRaises(ValueError, simulation_object.simulate_batch, [[0, 1], [1, 2]], [[3, 2]] * 3, timepoints)
+        self.assertRaises(ValueError, simulation_object.simulate_batch, [[0, 1, 2]], [3, 2], timepoints)
+        self.assertRaises(ValueError, simulation_object.simulate_batch, [[0, 1]], [3, 2, 1], timepoints)
+
+    def test_simulate_outputs(self):
+        """
+        Given a selection of outputs, the simulation should only return their trajectories, in the same order,
+        and with the same values as when all of the trajectories are returned.
+        Outputs that are not equations of the problem should fail with ValueError.
+        """
+        problem = means.mea_approximation(MODEL_P53, 2)
+        descriptors = problem.left_hand_side_descriptors
+        outputs = [descriptors[4], descriptors[0]]
+        timepoints = np.arange(0, 10, 0.5)
+        parameters = [90, 0.002, 1.7, 1.1, 0.93, 0.96, 0.01]
+        initial_conditions = [70, 30, 60]
+
+        for solver in ['scipy-lsoda', 'ensemble-rungekutta4']:
+            simulation_object = Simulation(problem, solver=solver)
+            trajectories = simulation_object.simulate_system(parameters, initial_conditions, timepoints)
+            selected = simulation_object.simulate_system(parameters, initial_conditions, timepoints, outputs=outputs)
+
+            self.assertEqual(list(selected), [trajectories[4], trajectories[0]])
+            self.assertEqual(simulation_object.simulate_batch([parameters], initial_conditions, timepoints,
+                                                              outputs=outputs), [selected])
+            self.assertRaises(ValueError, simulation_object.simulate_system, parameters, initial_conditions,
+                              timepoints, outputs=[Moment([5, 0, 0], symbol='x')])
+
+    def test_simulate_to_steady_state(self):
+        """
+        Given a linear problem with a known steady state, the simulation should stop before the maximum time,
+        within the tolerance of the steady state, and be refined to it by Newton's method.
+        If the maximum time is too short, it should not be converged.
+        """
+        problem = ODEProblem(method=None, left_hand_side_descriptors=[ODETermBase('y_1'), ODETermBase('y_2')],
+                             right_hand_side=['c_1 - c_2 * y_1', 'c_2 * y_1 - y_2'], parameters=['c_1', 'c_2'])
+        expected = [4.0, 2.0]
+
+        for solver in ['scipy-lsoda', 'scipy-bdf', 'ensemble-rungekutta4']:
+            simulation_object = Simulation(problem, solver=solver)
+
+            result = simulation_object.simulate_to_steady_state([2.0, 0.5], [0.0], max_time=1000.0, tolerance=1e-4)
+            self.assertTrue(result.converged)
+            self.assertLess(result.time, 100.0)
+            self.assertLessEqual(result.residual, 1e-4)
+            assert_array_almost_equal(result.values, expected, decimal=2)
+            self.assertIsNone(result.newton_iterations)
+
+            result = simulation_object.simulate_to_steady_state([2.0, 0.5], [0.0], max_time=1000.0, tolerance=1e-4,
+                                                                newton=True)
+            self.assertTrue(result.converged)
+            self.assertGreater(result.newton_iterations, 0)
+            assert_array_almost_equal(result.values, expected, decimal=10)
+            self.assertAlmostEqual(result[problem.left_hand_side_descriptors[0]], 4.0)
+
+            result = simulation_object.simulate_to_steady_state([2.0, 0.5], [0.0], max_time=1.0, tolerance=1e-4)
+            self.assertFalse(result.converged)
+            self.assertAlmostEqual(result.time, 1.0)
+
+        self.assertRaises(ValueError, Simulation(problem, solver='scipy-lsoda').simulate_to_steady_state,
+                          [2.0, 0.5], [0.0], max_time=0.0)
+
+
+
+class _WindowedLSODASolverWithSensitivities(ScipyLSODASolverWithSensitivities):
+    # Checks the steady state at the end of windows, as the solvers that cannot stop on an event do
+    _integrate_to_steady_state = SolverBase._integrate_to_steady_state.im_func
 
 
 class TestSimulateWithSensitivities(unittest.TestCase):
 
 
+    def _problem_in_paper(self):
+        return ODEProblem('MNA',
+                          [Moment([1, 0], 'x_1'),
+                           Moment([0, 1], 'x_2'),
+                           Moment([0, 2], 'yx1'),
+                           Moment([1, 1], 'yx2'),
+                           Moment([2, 0], 'yx3')],
+                          to_sympy_matrix(['-2*k_1*x_1*(x_1 - 1) - 2*k_1*yx3 + 2*k_2*x_2',
+                                           'k_1*x_1*(x_1 - 1) + k_1*yx3 - k_2*x_2',
+
+                                           'k_1*x_1**2 - k_1*x_1 + 2*k_1*yx2*(2*x_1 - 1) '
+                                           '+ k_1*yx3 + k_2*x_2 - 2*k_2*yx1',
+
+                                           '-2*k_1*x_1**2 + 2*k_1*x_1 + k_1*yx3*(2*x_1 - 3) '
+                                           '- 2*k_2*x_2 + 2*k_2*yx1 - yx2*(4*k_1*x_1 '
+                                           '- 2*k_1 + k_2)',
+
+                                           '4*k_1*x_1**2 - 4*k_1*x_1 - 8*k_1*yx3*(x_1 - 1)'
+                                           ' + 4*k_2*x_2 + 4*k_2*yx2'
+                          ]),
+                          ['k_1', 'k_2']
+                          )
+
     def test_model_in_paper(self):
         """
         Given the model in the Ale et. al Paper, and the initial parameters,
@@ -57,28 +278,7 @@ class TestSimulateWithSensitivities(unittest.TestCase):
         initial_conditions = [301, 0]
         timepoints = np.arange(0, 20, 0.1)
 
-        problem = ODEProblem('MNA',
-                             [Moment([1, 0], 'x_1'),
-                              Moment([0, 1], 'x_2'),
-                              Moment([0, 2], 'yx1'),
-                              Moment([1, 1], 'yx2'),
-                              Moment([2, 0], 'yx3')],
-                             to_sympy_matrix(['-2*k_1*x_1*(x_1 - 1) - 2*k_1*yx3 + 2*k_2*x_2',
-                                              'k_1*x_1*(x_1 - 1) + k_1*yx3 - k_2*x_2',
-
-                                              'k_1*x_1**2 - k_1*x_1 + 2*k_1*yx2*(2*x_1 - 1) '
-                                              '+ k_1*yx3 + k_2*x_2 - 2*k_2*yx1',
-
-                                              '-2*k_1*x_1**2 + 2*k_1*x_1 + k_1*yx3*(2*x_1 - 3) '
-                                              '- 2*k_2*x_2 + 2*k_2*yx1 - yx2*(4*k_1*x_1 '
-                                              '- 2*k_1 + k_2)',
-
-                                              '4*k_1*x_1**2 - 4*k_1*x_1 - 8*k_1*yx3*(x_1 - 1)'
-                                              ' + 4*k_2*x_2 + 4*k_2*yx2'
-                             ]),
-                             ['k_1', 'k_2']
-                             )
-
+        problem = self._problem_in_paper()
         simulation = means.simulation.SimulationWithSensitivities(problem)
         trajectories = simulation.simulate_system(parameters, initial_conditions, timepoints)
 
@@ -109,6 +309,118 @@ class TestSimulateWithSensitivities(unittest.TestCase):
         self.assertEqual(len(seen_answers), len(answers), msg='Some of the trajectories for moments were not returned')
 
 
+    def test_scipy_solvers_with_sensitivities(self):
+        """
+        Given the model in the Ale et. al Paper, the sensitivities computed by the scipy solvers
+        should be close to the ones described in the paper, with either of the sensitivity methods.
+        """
+        parameters = [1.66e-3, 0.2]
+        initial_conditions = [301, 0]
+        timepoints = np.arange(0, 20, 0.1)
+
+        problem = self._problem_in_paper()
+
+        # Trajectory value, sensitivity wrt k_1, sensitivity wrt k_2
+        answers = {Moment([1, 0], 'x_1'): (107.94814091151031, -25415.418060971126, 210.94691048709868),
+                   Moment([0, 1], 'x_2'): (96.525929544244818, 12707.709030485566, -105.47345524354937)}
+
+        for solver in ['scipy-lsoda', 'scipy-bdf', 'scipy-radau']:
+            for sensitivity_method in ['simultaneous', 'staggered']:
+                simulation = means.simulation.SimulationWithSensitivities(problem, solver=solver,
+                                                                          sensitivity_method=sensitivity_method,
+                                                                          rtol=1e-10, atol=1e-10)
+                trajectories = simulation.simulate_system(parameters, initial_conditions, timepoints)
+                for trajectory in trajectories:
+                    self.assertEqual(len(trajectory.sensitivity_data), len(parameters))
+                    try:
+                        answer = answers[trajectory.description]
+                    except KeyError:
+                        continue
+                    actual = [trajectory.values[-1]] + [s.values[-1] for s in trajectory.sensitivity_data]
+                    np.testing.assert_allclose(actual, answer, rtol=1e-5)
+
+        self.assertRaises(ValueError, means.simulation.SimulationWithSensitivities, problem,
+                          sensitivity_method='unknown')
+
+    def test_simulate_to_steady_state(self):
+        """
+        Given a linear problem with a known steady state, the solvers with sensitivities, which cannot be reset,
+        should reach it whether they stop on an event or check it at the end of windows.
+        """
+        problem = ODEProblem(method=None, left_hand_side_descriptors=[ODETermBase('y_1'), ODETermBase('y_2')],
+                             right_hand_side=['c_1 - c_2 * y_1', 'c_2 * y_1 - y_2'], parameters=['c_1', 'c_2'])
+        expected = [4.0, 2.0]
+
+        result = means.simulation.SimulationWithSensitivities(problem, solver='scipy-lsoda').simulate_to_steady_state(
+            [2.0, 0.5], [0.0], max_time=1000.0, tolerance=1e-4)
+        self.assertTrue(result.converged)
+        assert_array_almost_equal(result.values, expected, decimal=2)
+
+        solver = _WindowedLSODASolverWithSensitivities(problem, [2.0, 0.5], [0.0, 0.0])
+        self.assertFalse(solver._supports_reset)
+        time, values, converged = solver.simulate_to_steady_state(1e-4, 1000.0)
+        self.assertTrue(converged)
+        self.assertLess(time, 1000.0)
+        assert_array_almost_equal(values, expected, decimal=2)
+
+    @unittest.skipIf(not ASSIMULO_AVAILABLE, 'Assimulo is not installed')
+    def test_cvode_sensitivities_match_the_scipy_ones(self):
+        """
+        Given the model in the Ale et. al Paper, the sensitivities computed by CVODE from the exact
+        sensitivity equations should be close to the ones computed by the scipy solvers,
+        with either of the sensitivity methods.
+        """
+        parameters = [1.66e-3, 0.2]
+        initial_conditions = [301, 0]
+        timepoints = np.arange(0, 20, 0.1)
+
+        problem = self._problem_in_paper()
+        expected = means.simulation.SimulationWithSensitivities(problem, solver='scipy-lsoda', rtol=1e-10,
+                                                                atol=1e-10).simulate_system(parameters,
+                                                                                            initial_conditions,
+                                                                                            timepoints)
+        for sensitivity_method in ['simultaneous', 'staggered']:
+            simulation = means.simulation.SimulationWithSensitivities(problem, solver='cvode',
+                                                                      sensitivity_method=sensitivity_method,
+                                                                      rtol=1e-10, atol=1e-10)
+            trajectories = simulation.simulate_system(parameters, initial_conditions, timepoints)
+            for trajectory, expected_trajectory in zip(trajectories, expected):
+                self.assertEqual(trajectory.description, expected_trajectory.description)
+                for sensitivity, expected_sensitivity in zip(trajectory.sensitivity_data,
+                                                             expected_trajectory.sensitivity_data):
+                    np.testing.assert_allclose(sensitivity.values, expected_sensitivity.values,
+                                               rtol=1e-5, atol=1e-5)
+
+    def test_adjoint_gradient(self):
+        """
+        Given the model in the Ale et. al Paper, the gradient of the last value of a trajectory computed
+        with the adjoint method should be the same as the sensitivities described in the paper.
+        """
+        from means.simulation.adjoint import AdjointSimulation
+
+        parameters = [1.66e-3, 0.2]
+        initial_conditions = [301, 0]
+        timepoints = np.arange(0, 20, 0.1)
+
+        problem = self._problem_in_paper()
+
+        # Trajectory value, sensitivity wrt k_1, sensitivity wrt k_2
+        answers = {Moment([1, 0], 'x_1'): (107.94814091151031, -25415.418060971126, 210.94691048709868),
+                   Moment([0, 1], 'x_2'): (96.525929544244818, 12707.709030485566, -105.47345524354937)}
+
+        for method in ['LSODA', 'BDF', 'Radau']:
+            simulation = AdjointSimulation(problem, method=method, rtol=1e-10, atol=1e-10)
+            for description, answer in answers.iteritems():
+                trajectory_gradients = lambda trajectories: {description: np.arange(len(timepoints)) ==
+                                                                          len(timepoints) - 1}
+                trajectories, parameter_gradient, initial_conditions_gradient = \
+                    simulation.simulate_with_gradient(parameters, initial_conditions, timepoints,
+                                                      trajectory_gradients)
+                trajectory = [t for t in trajectories if t.description == description][0]
+                np.testing.assert_allclose([trajectory.values[-1]] + list(parameter_gradient), answer, rtol=1e-5)
+                self.assertEqual(len(initial_conditions_gradient), problem.number_of_equations)
+
+
 class TestSimulateRegressionForPopularModels(unittest.TestCase):
 
     def setUp(self):
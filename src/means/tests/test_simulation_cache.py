@@ -0,0 +1,108 @@
+import pickle
+import unittest
+
+import numpy as np
+
+from means.core import ODEProblem, ODETermBase, Moment
+from means.io.serialise import dump, load
+from means.simulation import Simulation, Trajectory
+from means.simulation.cache import SimulationCache
+
+
+class DecayProblem(ODEProblem):
+    def __init__(self):
+        super(DecayProblem, self).__init__(method=None,
+                                           left_hand_side_descriptors=[ODETermBase('y_1'), ODETermBase('y_2')],
+                                           right_hand_side=['-c_1 * y_1', 'c_1 * y_1 - c_2 * y_2'],
+                                           parameters=['c_1', 'c_2'])
+
+
+class TestSimulationCache(unittest.TestCase):
+
+    def setUp(self):
+        self.timepoints = np.linspace(0, 5, 11)
+
+    def _trajectories(self, number_of_timepoints=10):
+        return [Trajectory(np.arange(number_of_timepoints, dtype=float), np.zeros(number_of_timepoints),
+                           Moment([1], symbol='x'))]
+
+    def test_repeated_simulations_are_cached(self):
+        """
+        Given a simulation with a cache, simulating the system twice with the same values
+        should only simulate it once, and return the same trajectories.
+        """
+        simulation = Simulation(DecayProblem(), solver='scipy-lsoda', cache=True)
+        first = simulation.simulate_system([1.0, 0.5], [10.0, 0.0], self.timepoints)
+        second = simulation.simulate_system([1.0, 0.5], [10.0], self.timepoints)
+
+        self.assertIs(first, second)
+        self.assertEqual(simulation.cache.hits, 1)
+        self.assertEqual(simulation.cache.misses, 1)
+
+        different = simulation.simulate_system([1.0, 0.6], [10.0, 0.0], self.timepoints)
+        self.assertNotEqual(first, different)
+        simulation.simulate_system([1.0, 0.5], [10.0, 0.0], self.timepoints[:-1])
+        self.assertEqual(simulation.cache.hits, 1)
+        self.assertEqual(simulation.cache.misses, 3)
+
+    def test_simulations_are_not_cached_by_default(self):
+        """
+        Given a simulation without a cache, its cache should be None
+        """
+        self.assertIsNone(Simulation(DecayProblem(), solver='scipy-lsoda').cache)
+        self.assertIsNone(Simulation(DecayProblem(), solver='scipy-lsoda', cache=False).cache)
+
+    def test_keys_are_quantised(self):
+        """
+        Given values that only differ beyond the significant digits of the cache, the keys should be the same,
+        and otherwise, or for different solvers, they should differ.
+        """
+        cache = SimulationCache(significant_digits=8)
+        key = cache.key('solver', [1.0, 300.0], [0.1, 0.0], self.timepoints)
+
+        self.assertEqual(key, cache.key('solver', [1.0 + 1e-12, 300.0 * (1 - 1e-12)], [0.1, 0.0], self.timepoints))
+        self.assertNotEqual(key, cache.key('solver', [1.0 + 1e-6, 300.0], [0.1, 0.0], self.timepoints))
+        self.assertNotEqual(key, cache.key('other solver', [1.0, 300.0], [0.1, 0.0], self.timepoints))
+        # The values cannot move between the arrays
+        self.assertNotEqual(key, cache.key('solver', [1.0], [300.0, 0.1, 0.0], self.timepoints))
+
+    def test_least_recently_used_entries_are_dropped(self):
+        """
+        Given a cache whose memory budget is only enough for two entries, storing a third entry
+        should drop the least recently used one.
+        """
+        entry_size = 2 * 10 * 8
+        cache = SimulationCache(max_memory=2 * entry_size)
+        a, b, c = self._trajectories(), self._trajectories(), self._trajectories()
+
+        cache.put('a', a)
+        cache.put('b', b)
+        self.assertIs(cache.get('a'), a)
+        cache.put('c', c)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.memory_used, 2 * entry_size)
+        self.assertIsNone(cache.get('b'))
+        self.assertIs(cache.get('a'), a)
+        self.assertIs(cache.get('c'), c)
+
+        # Entries larger than the budget are not stored
+        cache.put('d', self._trajectories(100))
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(len(cache), 2)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.memory_used, cache.hits, cache.misses), (0, 0, 0, 0))
+
+    def test_serialisation(self):
+        """
+        Given a simulation with a cache, its settings should survive serialisation and pickling, but not its entries.
+        """
+        simulation = Simulation(DecayProblem(), solver='scipy-lsoda',
+                                cache=SimulationCache(max_memory=1000, significant_digits=6))
+        simulation.simulate_system([1.0, 0.5], [10.0, 0.0], self.timepoints)
+
+        for copy in [load(dump(simulation)), pickle.loads(pickle.dumps(simulation))]:
+            self.assertEqual(copy.cache.max_memory, 1000)
+            self.assertEqual(copy.cache.significant_digits, 6)
+            self.assertEqual(len(copy.cache), 0)
@@ -1,56 +1,199 @@
+import itertools
 import unittest
-import sympy
-from means.simulation import Trajectory
-from means import  Moment
-from means import SSASimulation
-from means import StochasticProblem
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+from means import SSASimulation, TauLeapingSimulation, NextReactionSimulation
+from means.simulation.ssa import _MomentAccumulator
+from means.simulation.next_reaction import _IndexedPriorityQueue
+from means import StochasticProblem, Model
 from means.examples import MODEL_LOTKA_VOLTERRA
 
 class TestSSA(unittest.TestCase):
 
     def test_moment_from_traj(self):
-        dummy = StochasticProblem(MODEL_LOTKA_VOLTERRA)
-        ssa = SSASimulation(dummy, 1)
-
-        all_trajectories = [
-            [
-                Trajectory([0, 1, 2], [3, 4, 4], Moment([0,1],"a")),
-                Trajectory([0, 1, 2], [7, 9, 10], Moment([1,0],"b"))
-            ],
-            [
-                Trajectory([0, 1, 2], [1, 2, 5], Moment([0,1],"a")),
-                Trajectory([0, 1, 2], [2, 3, 3], Moment([1,0],"b"))
-            ],
-            [
-                Trajectory([0, 1, 2], [13,7,5], Moment([0,1],"a")),
-                Trajectory([0, 1, 2], [22,3,1], Moment([1,0],"b"))
-            ],
-            [
-                Trajectory([0, 1, 2], [9,21, 3], Moment([0,1],"a")),
-                Trajectory([0, 1, 2], [8, 7, 4], Moment([1,0],"b"))
-            ]
-        ]
-
-        mean_trajectories = [sum(trajs)/float(len(trajs)) for trajs in zip(*all_trajectories)]
-
-        variance_a_result = ssa._compute_one_moment(all_trajectories, mean_trajectories,
-                                                    Moment([2,0],sympy.Symbol("V_a")))
-        covar_result= ssa._compute_one_moment(all_trajectories, mean_trajectories,
-                                              Moment([1,1],sympy.Symbol("Cov_a_b")))
-
-        variance_a_expected = Trajectory([0.0, 1.0, 2.0],[22.75, 55.25, 0.6875],
-                                         Moment([2, 0], sympy.Symbol("V_a")))
-
-        covar_expected = Trajectory([0.0, 1.0, 2.0], [31.875, 5.75, -1.125],
-                                    Moment([1, 1], sympy.Symbol("Cov_a_b")))
-
-        skew_a_result = ssa._compute_one_moment(all_trajectories, mean_trajectories,
-                                                    Moment([3,0],sympy.Symbol("V_a")))
-
-        skew_a_expected = Trajectory([0.0, 1.0, 2.0], [20.25,   396.0,  -0.28125],
-                                     Moment([3, 0], symbol="V_a"))
-
-
-        self.assertEqual(variance_a_result , variance_a_expected)
-        self.assertEqual(covar_result, covar_expected)
-        self.assertEqual(skew_a_expected, skew_a_result)
+        """
+        Given the amounts of species in a few simulations, added one block at a time,
+        the accumulated central moments should be the ones of all of the simulations.
+        """
+        amounts = np.array([
+            [[3, 4, 4], [7, 9, 10]],
+            [[1, 2, 5], [2, 3, 3]],
+            [[13, 7, 5], [22, 3, 1]],
+            [[9, 21, 3], [8, 7, 4]]
+        ])
+
+        accumulator = _MomentAccumulator([[2, 0], [1, 1], [0, 2], [3, 0]], (2, 3))
+        accumulator.add(amounts[:1])
+        accumulator.add(amounts[1:3])
+        accumulator.add(amounts[3:])
+
+        self.assertEqual(accumulator.count, 4)
+        assert_array_almost_equal(accumulator.mean, amounts.mean(axis=0))
+        assert_array_almost_equal(accumulator.central_moment([2, 0]), [22.75, 55.25, 0.6875])
+        assert_array_almost_equal(accumulator.central_moment([1, 1]), [31.875, 5.75, -1.125])
+        assert_array_almost_equal(accumulator.central_moment([3, 0]), [20.25, 396.0, -0.28125])
+
+    def test_merged_moments_match_the_moments_of_all_simulations(self):
+        """
+        Given two accumulators of different sets of simulations, merging them should give the same moments
+        as accumulating all of the simulations in one go.
+        """
+        rng = np.random.RandomState(3)
+        amounts = rng.poisson([[[5], [40], [200]]], size=(50, 3, 4)).astype(float)
+        # All of the central moments of second to fourth order
+        n_vectors = [n_vector for n_vector in itertools.product(range(5), repeat=3) if 2 <= sum(n_vector) <= 4]
+
+        accumulator = _MomentAccumulator(n_vectors, (3, 4))
+        accumulator.add(amounts)
+
+        first, second = _MomentAccumulator(n_vectors, (3, 4)), _MomentAccumulator(n_vectors, (3, 4))
+        first.add(amounts[:13])
+        second.add(amounts[13:30])
+        second.add(amounts[30:])
+        first.merge(second)
+
+        self.assertEqual(first.count, 50)
+        assert_array_almost_equal(first.mean, accumulator.mean)
+        for n_vector in n_vectors:
+            assert_array_almost_equal(first.central_moment(n_vector), accumulator.central_moment(n_vector))
+
+        assert_array_almost_equal(accumulator.central_moment([2, 0, 0]), amounts[:, 0].var(axis=0))
+        deviations = amounts - amounts.mean(axis=0)
+        assert_array_almost_equal(accumulator.central_moment([1, 1, 2]),
+                                  (deviations[:, 0] * deviations[:, 1] * deviations[:, 2] ** 2).mean(axis=0))
+
+    def test_conversion_matches_the_expected_means(self):
+        """
+        Given a conversion A -> B with many more reactions than timepoints, whose amounts are only recorded
+        at the timepoints, the means of the simulations should be close to the exact means,
+        and B should keep its amount once A is exhausted and no reaction can happen any more.
+        The same seed should give the same results.
+        """
+        model = Model(species=['a', 'b'], parameters=['k'], propensities=['k*a'], stoichiometry_matrix=[[-1], [1]])
+        timepoints = np.linspace(0, 20, 41)
+        ssa = SSASimulation(StochasticProblem(model), 20, random_seed=7)
+
+        means = ssa.simulate_system([1.0], [2000, 0], timepoints)
+        a, b = means
+
+        expected_a = 2000 * np.exp(-timepoints)
+        self.assertTrue((np.abs(a.values - expected_a) < 0.05 * 2000).all())
+        assert_array_almost_equal(a.values + b.values, 2000)
+        self.assertEqual(b.values[-1], 2000)
+
+        self.assertEqual(means, ssa.simulate_system([1.0], [2000, 0], timepoints))
+
+        trajectories = ssa.simulate_system([1.0], [2000, 0], timepoints, max_moment_order=0)
+        self.assertEqual(len(trajectories), 20)
+        assert_array_almost_equal(sum(t[0].values for t in trajectories) / 20.0, a.values)
+
+    def test_amounts_are_recorded_at_the_timepoints(self):
+        """
+        Given a set of timepoints, the individual simulations should hold the amounts of species at each of them,
+        which are whole numbers since the amounts only change by whole numbers at each reaction,
+        starting with the initial conditions, whatever the order of the timepoints.
+        """
+        problem = StochasticProblem(MODEL_LOTKA_VOLTERRA)
+        timepoints = np.linspace(0, 2, 11)
+        ssa = SSASimulation(problem, 3, random_seed=11)
+
+        parameters = [2, 0.1, 1.5]
+        simulations = ssa.simulate_system(parameters, [50, 10], timepoints, max_moment_order=0)
+        for trajectories in simulations:
+            for trajectory, initial_condition in zip(trajectories, [50, 10]):
+                assert_array_almost_equal(trajectory.timepoints, timepoints)
+                assert_array_almost_equal(trajectory.values, np.round(trajectory.values))
+                self.assertEqual(trajectory.values[0], initial_condition)
+
+        reversed_simulations = ssa.simulate_system(parameters, [50, 10], timepoints[::-1], max_moment_order=0)
+        for trajectories, reversed_trajectories in zip(simulations, reversed_simulations):
+            for trajectory, reversed_trajectory in zip(trajectories, reversed_trajectories):
+                assert_array_almost_equal(trajectory.values, reversed_trajectory.values[::-1])
+
+
+class TestTauLeaping(unittest.TestCase):
+
+    def test_conversion_matches_the_expected_means(self):
+        """
+        Given a conversion A -> B of a large number of molecules, the means of the simulations
+        should be close to the exact means, the amounts should stay whole and non negative,
+        and A should be exhausted by the critical reactions at the end.
+        """
+        model = Model(species=['a', 'b'], parameters=['k'], propensities=['k*a'], stoichiometry_matrix=[[-1], [1]])
+        timepoints = np.linspace(0, 20, 41)
+        simulation = TauLeapingSimulation(StochasticProblem(model), 10, random_seed=7)
+
+        a, b = simulation.simulate_system([1.0], [100000, 0], timepoints)
+        expected_a = 100000 * np.exp(-timepoints)
+        self.assertTrue((np.abs(a.values - expected_a) < 0.01 * 100000).all())
+        assert_array_almost_equal(a.values + b.values, 100000)
+        self.assertEqual(b.values[-1], 100000)
+
+        for trajectories in simulation.simulate_system([1.0], [100000, 0], timepoints, max_moment_order=0):
+            for trajectory in trajectories:
+                assert_array_almost_equal(trajectory.values, np.round(trajectory.values))
+                self.assertTrue((trajectory.values >= 0).all())
+
+    def test_tolerance_trades_accuracy_for_speed(self):
+        """
+        Given a birth-death process at its stationary distribution, whose mean and variance are both `k/d`,
+        the means should be close to it whatever the tolerance,
+        but the variances should be further from it with a larger tolerance.
+        """
+        model = Model(species=['x'], parameters=['k', 'd'], propensities=['k', 'd*x'],
+                      stoichiometry_matrix=[[1, -1]])
+        problem = StochasticProblem(model)
+        assert_array_almost_equal(problem._reactant_orders, [[0], [1]])
+
+        timepoints = [0, 5, 10]
+        errors = []
+        for epsilon in [0.01, 0.1]:
+            simulation = TauLeapingSimulation(problem, 200, random_seed=5, epsilon=epsilon)
+            mean, variance = simulation.simulate_system([1000.0, 1.0], [1000], timepoints, max_moment_order=2)
+            self.assertTrue((np.abs(mean.values - 1000) < 30).all())
+            errors.append(np.abs(variance.values[1:] - 1000).max())
+
+        self.assertLess(errors[0], errors[1])
+        self.assertRaises(ValueError, TauLeapingSimulation, problem, 10, epsilon=0)
+
+
+class TestNextReactionMethod(unittest.TestCase):
+
+    def test_dependency_graph(self):
+        """
+        Given the Lotka-Volterra model, each reaction should depend on itself
+        and on the reactions whose propensities depend on the species it changes.
+        """
+        problem = StochasticProblem(MODEL_LOTKA_VOLTERRA)
+        self.assertEqual(problem._dependency_graph, [[0, 1], [0, 1, 2], [1, 2]])
+
+    def test_priority_queue_keeps_the_earliest_reaction_at_the_top(self):
+        """
+        Given random changes of the times of the reactions, the top of the queue should always be the earliest one.
+        """
+        rng = np.random.RandomState(1)
+        times = rng.random_sample(50).tolist()
+        queue = _IndexedPriorityQueue(times)
+        for index, time in zip(rng.randint(0, 50, 500), rng.random_sample(500)):
+            times[index] = np.inf if time > 0.9 else time
+            queue.update(index, times[index])
+            self.assertEqual(queue.top(), (int(np.argmin(times)), min(times)))
+            self.assertEqual([queue.heap[position] for position in queue.positions], range(50))
+
+    def test_birth_death_matches_the_stationary_distribution(self):
+        """
+        Given a birth-death process at its stationary distribution, whose mean and variance are both `k/d`,
+        the means and variances of the simulations should be close to it,
+        and the amounts should be whole numbers starting with the initial conditions.
+        """
+        model = Model(species=['x'], parameters=['k', 'd'], propensities=['k', 'd*x'],
+                      stoichiometry_matrix=[[1, -1]])
+        simulation = NextReactionSimulation(StochasticProblem(model), 200, random_seed=13)
+
+        mean, variance = simulation.simulate_system([100.0, 1.0], [100], [0, 5, 10], max_moment_order=2)
+        self.assertTrue((np.abs(mean.values - 100) < 3).all())
+        self.assertTrue((np.abs(variance.values[1:] - 100) < 30).all())
+
+        for x, in simulation.simulate_system([100.0, 1.0], [100], [10, 0, 5], max_moment_order=0):
+            assert_array_almost_equal(x.values, np.round(x.values))
+            self.assertEqual(x.values[1], 100)
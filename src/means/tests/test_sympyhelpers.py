@@ -1,7 +1,12 @@
+import multiprocessing
 import unittest
 import sympy
+from means.util import sympyhelpers
 from means.util.sympyhelpers import to_sympy_matrix, assert_sympy_expressions_equal, sympy_expressions_equal
-from means.util.sympyhelpers import substitute_all
+from means.util.sympyhelpers import substitute_all, resolve_substitutions, cached_xreplace
+
+def _failing_substitution(expression):
+    raise ValueError('Substitution failed')
 
 class TestSympyHelpers(unittest.TestCase):
 
@@ -24,6 +29,52 @@ class TestSympyHelpers(unittest.TestCase):
         answer = substitute_all(to_substitute, pairs)
         self.assertEqual(answer, expected)
 
+    def test_failed_parallel_substitution_does_not_leave_processes_behind(self):
+        """
+        Given a substitution that fails in one of the processes, the error should be raised,
+        and all of the processes should be terminated.
+        """
+        # The processes of the pools of other tests may still be exiting
+        other_processes = multiprocessing.active_children()
+        substitute_in_process = sympyhelpers._substitute_all_in_process
+        sympyhelpers._substitute_all_in_process = _failing_substitution
+        try:
+            self.assertRaises(ValueError, substitute_all, to_sympy_matrix(["a*b", "c*d"]),
+                              {sympy.Symbol('a'): 1}, number_of_processes=2)
+        finally:
+            sympyhelpers._substitute_all_in_process = substitute_in_process
+
+        self.assertEqual([p for p in multiprocessing.active_children() if p not in other_processes], [])
+
+    def test_cached_xreplace(self):
+        """
+        Given a matrix whose elements share sub-expressions, the cached replacement should give
+        the same result as replacing each of the elements, and keep the replaced sub-expressions in the cache.
+        """
+        to_substitute = to_sympy_matrix(["a*b + c", "(a*b + c)**2", "d", "2.5*a"])
+        substitutions = {sympy.Symbol('a'): sympy.sympify("x + 1"), sympy.Symbol('c'): sympy.sympify("y*z")}
+        expected = to_substitute.applyfunc(lambda x: x.xreplace(substitutions))
+
+        cache = {}
+        self.assertEqual(cached_xreplace(to_substitute, substitutions, cache), expected)
+        self.assertEqual(cache[sympy.sympify("a*b + c")], sympy.sympify("(x + 1)*b + y*z"))
+        self.assertEqual(cached_xreplace(to_substitute[1], substitutions, cache), expected[1])
+
+    def test_resolve_substitutions(self):
+        """
+        Given substitutions referring to each other, the resolved substitutions should not refer
+        to any of the substituted symbols, whatever the order of the substitutions.
+        """
+        pairs = zip(to_sympy_matrix(["x_3", "x_1", "x_2"]),
+                    to_sympy_matrix(["x_2*x_1", "a", "2 + x_1"]))
+        expected = dict(zip(to_sympy_matrix(["x_1", "x_2", "x_3"]),
+                            to_sympy_matrix(["a", "2 + a", "(2 + a)*a"])))
+        self.assertEqual(resolve_substitutions(pairs), expected)
+
+    def test_resolve_circular_substitutions_raises_value_error(self):
+        pairs = zip(to_sympy_matrix(["x_1", "x_2"]), to_sympy_matrix(["x_2 + 1", "x_1 + 1"]))
+        self.assertRaises(ValueError, resolve_substitutions, pairs)
+
 
 
 class TestSympyExpressionsEqual(unittest.TestCase):
@@ -2,8 +2,11 @@ import unittest
 import numpy as np
 from means.simulation import Trajectory, TrajectoryWithSensitivityData, TrajectoryCollection
 from means.core import Moment
+from numpy.testing import assert_array_almost_equal
 import os
+import pickle
 import tempfile
+from StringIO import StringIO
 
 class TestTrajectory(unittest.TestCase):
 
@@ -104,4 +107,76 @@ class TestTrajectoriesToCSV(unittest.TestCase):
             os.unlink(file)
 
 
+class TestColumnarTrajectoryCollection(unittest.TestCase):
 
+    def setUp(self):
+        self.timepoints = np.array([0.0, 1.0, 2.5, 4.0])
+        self.values = np.array([[3.0, 2.0, 1.0, 5.0], [1.0, 4.0, 9.0, 16.0]])
+        self.descriptions = [Moment([1], symbol='y_1'), Moment([1], symbol='y_2')]
+        self.collection = TrajectoryCollection.from_array(self.timepoints, self.values, self.descriptions)
+        self.trajectories = [Trajectory(self.timepoints, values, description)
+                             for values, description in zip(self.values, self.descriptions)]
+
+    def test_trajectories_are_views_of_the_values(self):
+        """
+        Given a collection created from an array, its trajectories should be equal to the ones created one by one,
+        and be views of the rows of the array, rather than copies.
+        """
+        self.assertEqual(self.collection, TrajectoryCollection(self.trajectories))
+        self.assertIs(self.collection.values, self.values)
+        for trajectory in self.collection:
+            self.assertIs(trajectory.values.base, self.values)
+            self.assertIs(trajectory.timepoints, self.collection.timepoints)
+
+        self.assertIsNone(TrajectoryCollection(self.trajectories).values)
+        self.assertEqual(self.collection[1:], TrajectoryCollection(self.trajectories[1:]))
+        self.assertIs(self.collection[1:].values.base, self.values)
+        self.assertEqual(pickle.loads(pickle.dumps(self.collection)), self.collection)
+        self.assertRaises(ValueError, TrajectoryCollection.from_array, self.timepoints, self.values.T,
+                          self.descriptions)
+
+    def test_resample(self):
+        """
+        Given a collection created from an array, resampling it should give the same results
+        as resampling each of its trajectories.
+        """
+        new_timepoints = [-1.0, 0.0, 0.5, 2.5, 3.9, 5.0]
+        expected = [trajectory.resample(new_timepoints, extrapolate=True) for trajectory in self.trajectories]
+        resampled = self.collection.resample(new_timepoints, extrapolate=True)
+
+        assert_array_almost_equal(resampled.values, [trajectory.values for trajectory in expected])
+        assert_array_almost_equal(resampled.timepoints, new_timepoints)
+        self.assertEqual(resampled.descriptions, self.descriptions)
+        self.assertRaises(Exception, self.collection.resample, new_timepoints)
+
+    def test_arithmetic(self):
+        """
+        Given collections created from arrays, the arithmetic operations should apply to each of their trajectories
+        """
+        other = TrajectoryCollection.from_array(self.timepoints, self.values * 2, self.descriptions)
+        for result, expected in [(self.collection + other, self.values * 3),
+                                 (other - self.collection, self.values),
+                                 (self.collection * 2, self.values * 2),
+                                 (self.collection ** 2, self.values ** 2),
+                                 (sum([self.collection, other]), self.values * 3)]:
+            assert_array_almost_equal(result.values, expected)
+            self.assertEqual(result.descriptions, self.descriptions)
+
+        self.assertEqual(TrajectoryCollection(self.trajectories) * 2, self.collection * 2)
+        self.assertRaises(Exception, self.collection.__add__,
+                          TrajectoryCollection.from_array(self.timepoints, self.values, self.descriptions[::-1]))
+
+    def test_to_csv(self):
+        """
+        Given a collection created from an array, it should be written to the same csv as the one created
+        from its trajectories.
+        """
+        columnar_file, file_ = StringIO(), StringIO()
+        self.collection.to_csv(columnar_file)
+        TrajectoryCollection(self.trajectories).to_csv(file_)
+
+        self.assertEqual(columnar_file.getvalue(), file_.getvalue())
+        lines = columnar_file.getvalue().splitlines()
+        self.assertEqual(lines[0], 'description,time,value')
+        self.assertEqual(lines[1], 'y_1,0.000000,3.000000')
+        self.assertEqual(len(lines), 9)
@@ -0,0 +1,466 @@
+"""
+Code Generation
+----
+
+This part of the package compiles lists of :mod:`sympy` expressions into a single C function.
+All of the expressions are evaluated in one call, and the results are written into an output
+buffer provided by the caller. This replaces compiling each expression into its own module.
+
+The generated C code is wrapped with Cython, in the same way as
+:func:`sympy.utilities.autowrap.autowrap` does it.
+Compiled modules are kept in an on-disk cache shared between processes, see :func:`cache_directory`.
+"""
+
+import glob
+import hashlib
+import imp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import sympy
+
+from means.util.logs import get_logger
+
+logger = get_logger(__name__)
+
+class CodeGenerationError(Exception):
+    """
+    Exception raised when the generated code could not be compiled.
+    """
+    pass
+
+_C_HEADER_TEMPLATE = """\
+void {name}({arguments});
+"""
+
+_C_CODE_TEMPLATE = """\
+#include <math.h>
+#include "{header}"
+
+void {name}({arguments}) {{
+{body}
+}}
+"""
+
+_PYX_TEMPLATE = """\
+import numpy as np
+cimport numpy as np
+
+cdef extern from "{header}":
+    void {name}({c_arguments})
+
+def evaluate({py_arguments}):
+{checks}
+    {name}({call_arguments})
+"""
+
+_PYX_CHECK_TEMPLATE = """\
+    if {argument}.shape[0] != {length}:
+        raise ValueError('Expected {length} values for {argument}, got {{0}}'.format({argument}.shape[0]))
+"""
+
+# Batched functions evaluate the expressions for each row of two-dimensional arguments
+_C_BATCH_CODE_TEMPLATE = """\
+#include <math.h>
+#include "{header}"
+
+void {name}({arguments}) {{
+    long row;
+    for (row = 0; row < {rows}; row++) {{
+{row_pointers}
+{body}
+    }}
+}}
+"""
+
+_PYX_BATCH_CHECK_TEMPLATE = """\
+    if {argument}.shape[1] != {length}:
+        raise ValueError('Expected {length} values in each row of {argument}, got {{0}}'.format({argument}.shape[1]))
+    if {argument}.shape[0] != {rows}:
+        raise ValueError('Expected {{0}} rows in {argument}, got {{1}}'.format({rows}, {argument}.shape[0]))
+"""
+
+_ROWS_ARGUMENT = 'rows'
+_BATCH_SUFFIX = '_batch'
+
+_SETUP_TEMPLATE = """\
+from distutils.core import setup
+from distutils.extension import Extension
+from Cython.Distutils import build_ext
+import numpy
+
+setup(
+    cmdclass = {{'build_ext': build_ext}},
+    ext_modules = [Extension({module_name!r}, [{pyx_file!r}, {c_file!r}],
+                             include_dirs=[numpy.get_include()],
+                             extra_compile_args=['-std=c99'])]
+)
+"""
+
+_OUTPUT_ARGUMENT = 'out'
+
+def _argument_name(index):
+    return 'arg{0}'.format(index)
+
+def _temporary_name(index):
+    return 'tmp{0}'.format(index)
+
+def _c_expression(expression, replacements):
+    expression = sympy.sympify(expression)
+    unknown_symbols = expression.free_symbols - set(replacements)
+    if unknown_symbols:
+        raise ValueError('Cannot compile {0!r}: symbols {1!r} are not in the argument list'.format(
+            expression, sorted(map(str, unknown_symbols))))
+    return sympy.ccode(expression.xreplace(replacements))
+
+def _c_body(expressions, arguments, temporaries=()):
+    """
+    Generates the body of the C function that evaluates each of the `expressions` into the output buffer.
+
+    :param expressions: list of expressions to evaluate
+    :param arguments: list of lists of symbols, each of the lists is an array argument of the function
+    :param temporaries: list of (symbol, expression) pairs that are evaluated, in order, before the `expressions`.
+                        The expressions (and the later temporaries) can refer to them by their symbols.
+    :return: the lines of C code
+    :rtype: list[str]
+    """
+    replacements = {}
+    for i, symbols in enumerate(arguments):
+        for j, symbol in enumerate(symbols):
+            replacements[symbol] = sympy.Symbol('{0}[{1}]'.format(_argument_name(i), j))
+
+    lines = []
+    for i, (symbol, expression) in enumerate(temporaries):
+        lines.append('    const double {0} = {1};'.format(_temporary_name(i),
+                                                          _c_expression(expression, replacements)))
+        replacements[symbol] = sympy.Symbol(_temporary_name(i))
+
+    for i, expression in enumerate(expressions):
+        lines.append('    {0}[{1}] = {2};'.format(_OUTPUT_ARGUMENT, i, _c_expression(expression, replacements)))
+    return lines
+
+def _render_code(name, body, argument_lengths, number_of_outputs, batched=False):
+    argument_names = [_argument_name(i) for i in range(len(argument_lengths))]
+    all_names = argument_names + [_OUTPUT_ARGUMENT]
+    lengths = list(argument_lengths) + [number_of_outputs]
+    header_file = '{0}.h'.format(name)
+
+    if not batched:
+        c_arguments = ', '.join(['const double *{0}'.format(a) for a in argument_names] +
+                                ['double *{0}'.format(_OUTPUT_ARGUMENT)])
+        code = _C_CODE_TEMPLATE.format(name=name, header=header_file, arguments=c_arguments,
+                                       body='\n'.join(body))
+
+        py_arguments = ', '.join(['np.ndarray[np.double_t, ndim=1, mode="c"] {0}'.format(a) for a in all_names])
+        checks = ''.join([_PYX_CHECK_TEMPLATE.format(argument=a, length=l) for a, l in zip(all_names, lengths)])
+        call_arguments = ', '.join(['<double *> {0}.data'.format(a) for a in all_names])
+    else:
+        # The body refers to the arguments of a single row, so we point them to the current row of each matrix
+        c_arguments = ', '.join(['long {0}'.format(_ROWS_ARGUMENT)] +
+                                ['const double *{0}{1}'.format(a, _BATCH_SUFFIX) for a in argument_names] +
+                                ['double *{0}{1}'.format(_OUTPUT_ARGUMENT, _BATCH_SUFFIX)])
+        row_pointers = ['        {0}double *{1} = {1}{2} + row * {3};'.format('const ' if a != _OUTPUT_ARGUMENT else '',
+                                                                                a, _BATCH_SUFFIX, l)
+                        for a, l in zip(all_names, lengths)]
+        code = _C_BATCH_CODE_TEMPLATE.format(name=name, header=header_file, arguments=c_arguments,
+                                             rows=_ROWS_ARGUMENT, row_pointers='\n'.join(row_pointers),
+                                             body='\n'.join(['    ' + line for line in body]))
+
+        py_arguments = ', '.join(['np.ndarray[np.double_t, ndim=2, mode="c"] {0}'.format(a) for a in all_names])
+        checks = '    {0} = {1}.shape[0]\n'.format(_ROWS_ARGUMENT, _OUTPUT_ARGUMENT) + \
+                 ''.join([_PYX_BATCH_CHECK_TEMPLATE.format(argument=a, length=l, rows=_ROWS_ARGUMENT)
+                          for a, l in zip(all_names, lengths)])
+        call_arguments = ', '.join([_ROWS_ARGUMENT] + ['<double *> {0}.data'.format(a) for a in all_names])
+
+    header = _C_HEADER_TEMPLATE.format(name=name, arguments=c_arguments)
+    pyx = _PYX_TEMPLATE.format(header=header_file, name=name, c_arguments=c_arguments,
+                               py_arguments=py_arguments, checks=checks, call_arguments=call_arguments)
+
+    return code, header, pyx
+
+def generate_code(name, expressions, arguments, temporaries=(), batched=False):
+    """
+    Generates the C code, the C header and the Cython wrapper for a function that evaluates all `expressions`.
+
+    :param name: name of the C function
+    :param expressions: list of expressions to evaluate
+    :param arguments: list of lists of symbols, each of the lists is an array argument of the function
+    :param temporaries: list of (symbol, expression) pairs to evaluate before the `expressions`,
+                        see :func:`eliminate_common_subexpressions`
+    :param batched: whether the function evaluates the expressions for each row of matrix arguments,
+                    see :func:`compile_expressions`
+    :return: tuple of C code, C header and Cython code
+    """
+    return _render_code(name, _c_body(expressions, arguments, temporaries), [len(symbols) for symbols in arguments],
+                        len(expressions), batched)
+
+def eliminate_common_subexpressions(expressions):
+    """
+    Finds the subexpressions that occur more than once in `expressions` using :func:`sympy.cse`,
+    so that they are only evaluated once in the generated code.
+
+    :param expressions: list of expressions
+    :return: a tuple of the temporaries, as a list of (symbol, expression) pairs, and the list of `expressions`
+             rewritten in terms of the temporaries. Both can be passed to :func:`compile_expressions`.
+    """
+    temporaries, reduced_expressions = sympy.cse(list(expressions))
+    return temporaries, reduced_expressions
+
+def count_operations(expressions, temporaries=()):
+    """
+    Counts the operations needed to evaluate all `expressions` and `temporaries`, as given by :func:`sympy.count_ops`.
+    This is a measure of the size of the generated code.
+    """
+    return sum([sympy.count_ops(expression) for expression in expressions]) + \
+           sum([sympy.count_ops(expression) for _, expression in temporaries])
+
+def _build_module(module_name, code, header, pyx, workdir):
+    """
+    Writes the generated code to `workdir`, compiles it and returns the path to the resulting extension module.
+    """
+    c_file = '{0}_code.c'.format(module_name)
+    pyx_file = '{0}.pyx'.format(module_name)
+
+    with open(os.path.join(workdir, c_file), 'w') as f:
+        f.write(code)
+    with open(os.path.join(workdir, '{0}_code.h'.format(module_name)), 'w') as f:
+        f.write(header)
+    with open(os.path.join(workdir, pyx_file), 'w') as f:
+        f.write(pyx)
+    with open(os.path.join(workdir, 'setup.py'), 'w') as f:
+        f.write(_SETUP_TEMPLATE.format(module_name=module_name, pyx_file=pyx_file, c_file=c_file))
+
+    command = [sys.executable, 'setup.py', 'build_ext', '--inplace']
+    try:
+        subprocess.check_output(command, cwd=workdir, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        raise CodeGenerationError('Error while executing command: {0}. '
+                                  'Command output is:\n{1}'.format(' '.join(command), e.output))
+
+    module_file = _find_module_file(workdir, module_name)
+    if module_file is None:
+        raise CodeGenerationError('Compiled module {0!r} not found in {1!r}'.format(module_name, workdir))
+
+    return module_file
+
+def _find_module_file(directory, module_name):
+    for extension in ['.so', '.pyd']:
+        candidates = glob.glob(os.path.join(directory, module_name + '*' + extension))
+        if candidates:
+            return candidates[0]
+    return None
+
+#-- On-disk cache of compiled modules ----------------------------------------------------------------------------------
+
+# Bump this whenever the generated code changes, so stale modules are not picked up from the cache
+CODEGEN_VERSION = 1
+
+CACHE_DIRECTORY_ENVIRONMENT_VARIABLE = 'MEANS_CACHE_DIR'
+CACHE_SIZE_ENVIRONMENT_VARIABLE = 'MEANS_CACHE_SIZE'
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache', 'means', 'codegen')
+DEFAULT_MAXIMUM_CACHE_SIZE = 256 * 1024 * 1024
+
+_MODULE_PREFIX = 'means_codegen_'
+
+# Functions already loaded by this process, so we do not need to go to disk for them again
+_loaded_functions = {}
+
+def cache_directory():
+    """
+    Returns the directory compiled modules are cached in.
+    It can be changed by setting the ``MEANS_CACHE_DIR`` environment variable.
+    Setting it to an empty string disables the cache.
+
+    :return: path to the cache directory, or None if caching is disabled
+    """
+    directory = os.environ.get(CACHE_DIRECTORY_ENVIRONMENT_VARIABLE, DEFAULT_CACHE_DIRECTORY)
+    return directory or None
+
+def maximum_cache_size():
+    """
+    Returns the maximum size of the cache in bytes. When the cache grows larger than this,
+    the least recently used modules are evicted.
+    It can be changed by setting the ``MEANS_CACHE_SIZE`` environment variable.
+    """
+    try:
+        return int(os.environ[CACHE_SIZE_ENVIRONMENT_VARIABLE])
+    except KeyError:
+        return DEFAULT_MAXIMUM_CACHE_SIZE
+
+def clear_cache():
+    """
+    Removes all compiled modules from the cache directory.
+    """
+    directory = cache_directory()
+    if directory is not None and os.path.isdir(directory):
+        for entry in _cache_entries(directory):
+            shutil.rmtree(entry, ignore_errors=True)
+
+def _cache_key(body, argument_lengths, number_of_outputs, batched=False):
+    """
+    A canonical hash of everything the compiled module depends on: the generated code
+    (i.e. the expressions and the order of arguments), the sizes of the arguments and the build environment.
+    """
+    hash_ = hashlib.sha1()
+    for item in [CODEGEN_VERSION, 'cython', sys.version, np.__version__, argument_lengths, number_of_outputs,
+                 batched]:
+        hash_.update(repr(item))
+    for line in body:
+        hash_.update(line)
+    return hash_.hexdigest()
+
+def _cache_entries(directory):
+    return [os.path.join(directory, entry) for entry in os.listdir(directory)
+            if entry.startswith(_MODULE_PREFIX) and os.path.isdir(os.path.join(directory, entry))]
+
+def _directory_size(directory):
+    size = 0
+    for root, _, files in os.walk(directory):
+        for file_ in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file_))
+            except OSError:
+                # The file could have been evicted by another process in the meantime
+                pass
+    return size
+
+def _evict(directory, keep):
+    """
+    Removes the least recently used entries of the cache until it fits into :func:`maximum_cache_size`.
+    The entry `keep` is never removed.
+    """
+    maximum_size = maximum_cache_size()
+    entries = []
+    for entry in _cache_entries(directory):
+        try:
+            entries.append((os.path.getmtime(entry), _directory_size(entry), entry))
+        except OSError:
+            continue
+
+    total_size = sum([size for _, size, _ in entries])
+    for _, size, entry in sorted(entries):
+        if total_size <= maximum_size:
+            break
+        if entry == keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= size
+
+def _compile_into_cache(directory, module_name, code, header, pyx):
+    """
+    Compiles the module and stores it in the cache `directory`.
+    The module is built in a temporary directory first, and then moved to its place,
+    so other processes never see partially built modules.
+
+    :return: the path to the compiled module
+    """
+    entry = os.path.join(directory, module_name)
+    workdir = tempfile.mkdtemp('_means_compile', dir=directory)
+    try:
+        module_file = _build_module(module_name, code, header, pyx, workdir)
+        # Keep only the compiled module
+        os.mkdir(os.path.join(workdir, module_name))
+        os.rename(module_file, os.path.join(workdir, module_name, os.path.basename(module_file)))
+        try:
+            os.rename(os.path.join(workdir, module_name), entry)
+        except OSError:
+            # Another process has put the same module into the cache in the meantime, use that one
+            if not os.path.isdir(entry):
+                raise
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    _evict(directory, keep=entry)
+    return _find_module_file(entry, module_name)
+
+def _cached_module_file(directory, module_name, code, header, pyx):
+    """
+    Returns the path to the compiled module in the cache `directory`, compiling it first if it is not there yet.
+    Returns None if the cache directory cannot be used.
+    """
+    entry = os.path.join(directory, module_name)
+    module_file = _find_module_file(entry, module_name)
+    if module_file is not None:
+        try:
+            # Mark the entry as recently used
+            os.utime(entry, None)
+        except OSError:
+            pass
+        return module_file
+
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return _compile_into_cache(directory, module_name, code, header, pyx)
+    except (OSError, IOError) as e:
+        logger.warn('Could not use {0!r} to cache compiled code: {1!s}'.format(directory, e))
+        return None
+
+def compile_expressions(expressions, arguments, temporaries=(), batched=False):
+    """
+    Compiles `expressions` into a single function that evaluates all of them at once.
+
+    The returned function takes one one-dimensional array of doubles for each list of symbols in `arguments`,
+    in the same order, followed by a preallocated output array of length ``len(expressions)`` that is filled
+    with the results, e.g. for ``arguments=[parameters, variables]``: ``f(parameter_values, variable_values, out)``.
+    All arrays have to be C-contiguous arrays of :class:`numpy.double`.
+
+    If `batched` is set, the function takes two-dimensional arrays instead, and evaluates the expressions
+    for each of their rows in a single call, i.e. ``out[i]`` is computed from the i-th row of each of the arguments.
+    All of the arrays need to have the same number of rows.
+
+    Compiled modules are cached on disk (see :func:`cache_directory`), so that compiling the same
+    expressions again, e.g. in a new process, only needs to load the already compiled module.
+
+    :param expressions: the expressions to compile
+    :type expressions: iterable
+    :param arguments: list of lists of symbols, each of the lists becomes an array argument of the function
+    :type arguments: list[list[:class:`sympy.Symbol`]]
+    :param temporaries: list of (symbol, expression) pairs to evaluate before the `expressions`,
+                        as returned by :func:`eliminate_common_subexpressions`
+    :param batched: whether to compile a function evaluating the expressions for many rows of values at once
+    :return: the compiled function
+    """
+    expressions = list(expressions)
+    arguments = [list(symbols) for symbols in arguments]
+
+    body = _c_body(expressions, arguments, temporaries)
+    argument_lengths = [len(symbols) for symbols in arguments]
+    key = _cache_key(body, argument_lengths, len(expressions), batched)
+
+    try:
+        return _loaded_functions[key]
+    except KeyError:
+        pass
+
+    module_name = _MODULE_PREFIX + key
+    code, header, pyx = _render_code(module_name + '_code', body, argument_lengths, len(expressions), batched)
+
+    directory = cache_directory()
+    module_file = None
+    if directory is not None:
+        module_file = _cached_module_file(directory, module_name, code, header, pyx)
+
+    if module_file is not None:
+        module = imp.load_dynamic(module_name, module_file)
+    else:
+        # The module stays usable after its file is removed, so we can just build it in a temporary directory
+        workdir = tempfile.mkdtemp('_means_compile')
+        try:
+            module = imp.load_dynamic(module_name, _build_module(module_name, code, header, pyx, workdir))
+        finally:
+            shutil.rmtree(workdir)
+
+    _loaded_functions[key] = module.evaluate
+    return module.evaluate
+
+def to_double_array(values):
+    """
+    Converts `values` to an one-dimensional C-contiguous array of doubles, as expected by the functions returned
+    from :func:`compile_expressions`. Does not copy `values` if they are already in that format.
+    """
+    return np.ascontiguousarray(values, dtype=np.double).reshape(-1)
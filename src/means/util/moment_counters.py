@@ -10,6 +10,104 @@ import itertools
 import sympy as sp
 from means.core import Moment
 
+
+def compositions(order, number_of_parts):
+    """
+    Generates all the vectors of `number_of_parts` non-negative integers that sum to `order`,
+    in lexicographic order. For instance, the compositions of 2 into two parts are
+    `(0, 2)`, `(1, 1)` and `(2, 0)`.
+
+    The compositions are enumerated directly, so the cost is proportional to their number.
+
+    :param order: the sum of the vectors
+    :param number_of_parts: the length of the vectors
+    :return: a generator of tuples
+    """
+    if number_of_parts == 1:
+        yield (order,)
+        return
+    for first in range(order + 1):
+        for rest in compositions(order - first, number_of_parts - 1):
+            yield (first,) + rest
+
+
+class MomentLattice(object):
+    """
+    An index over a list of :class:`~means.core.descriptors.Moment`\s, such as the counters returned by
+    :func:`generate_n_and_k_counters`.
+    It allows to look up the moments by their n-vector in constant time,
+    and to get all the moments lower than or equal to a given one (see :meth:`lower_moments`)
+    without scanning the whole list.
+
+        >>> from means.util.moment_counters import generate_n_and_k_counters, MomentLattice
+        >>> n_counter, k_counter = generate_n_and_k_counters(2, ['a', 'b'])
+        >>> lattice = MomentLattice(k_counter)
+        >>> lattice[(1, 1)]
+        Moment(array([1, 1]), symbol=x_1_1)
+
+    """
+    def __init__(self, moments):
+        """
+        :param moments: the moments to index.
+        :type moments: list[:class:`~means.core.descriptors.Moment`]
+        """
+        self.__moments = list(moments)
+        self.__index = {}
+        self.__positions = {}
+        for position, moment in enumerate(self.__moments):
+            key = tuple(moment.n_vector)
+            self.__index[key] = moment
+            self.__positions[key] = position
+        self.__lower_moments = {}
+
+    def __len__(self):
+        return len(self.__moments)
+
+    def __iter__(self):
+        return iter(self.__moments)
+
+    def __contains__(self, n_vector):
+        return tuple(n_vector) in self.__index
+
+    def __getitem__(self, n_vector):
+        """
+        Returns the moment with the given n-vector.
+
+        :param n_vector: a vector of integers
+        :raise KeyError: if there is no such moment
+        """
+        return self.__index[tuple(n_vector)]
+
+    @property
+    def moments(self):
+        return self.__moments
+
+    def lower_moments(self, n_vector):
+        """
+        Returns all the moments whose n-vector is lower than or equal to `n_vector` for each species,
+        i.e. all the moments `k` such that `moment >= k`, in the same order as they were given.
+        The lists are computed once for each `n_vector`.
+
+        :param n_vector: a vector of integers, or a :class:`~means.core.descriptors.Moment`
+        :rtype: list[:class:`~means.core.descriptors.Moment`]
+        """
+        if isinstance(n_vector, Moment):
+            n_vector = n_vector.n_vector
+        key = tuple(n_vector)
+        try:
+            return self.__lower_moments[key]
+        except KeyError:
+            pass
+
+        positions = self.__positions
+        lower_keys = [k for k in itertools.product(*[range(n + 1) for n in key]) if k in positions]
+        lower_keys.sort(key=positions.__getitem__)
+        lower = [self.__index[k] for k in lower_keys]
+
+        self.__lower_moments[key] = lower
+        return lower
+
+
 def generate_n_and_k_counters(max_order, species, central_symbols_prefix="M_", raw_symbols_prefix="x_"):
         r"""
         Makes a counter for central moments (n_counter) and a counter for raw moment (k_counter).
@@ -38,20 +136,16 @@ def generate_n_and_k_counters(max_order, species, central_symbols_prefix="M_", r
         # We use species name as symbols for first order raw moment
         k_counter += [Moment(d, s) for d,s in zip(descriptors, species)]
 
-        # Higher order raw moment descriptors
-        k_counter_descriptors = [i for i in itertools.product(range(n_moments + 1), repeat=len(species))
-                                 if 1 < sum(i) <= n_moments]
-
-        #this mimics the order in the original code
-        k_counter_descriptors = sorted(k_counter_descriptors,lambda x,y: sum(x) - sum(y))
-        #k_counter_descriptors = [[r for r in reversed(k)] for k in k_counter_descriptors]
+        # Higher order raw moment descriptors, by increasing order, and in lexicographic order for each order.
+        # This mimics the order in the original code
+        k_counter_descriptors = [c for order in range(2, n_moments + 1) for c in compositions(order, len(species))]
 
         k_counter_symbols = [sp.Symbol(raw_symbols_prefix + "_".join([str(s) for s in count]))
                              for count in k_counter_descriptors]
         k_counter += [Moment(d, s) for d,s in zip(k_counter_descriptors, k_counter_symbols)]
 
         #  central moments
-        n_counter_descriptors = [m for m in k_counter_descriptors if sum(m) > 1]
+        n_counter_descriptors = k_counter_descriptors
         # arbitrary symbols
         n_counter_symbols = [sp.Symbol(central_symbols_prefix + "_".join([str(s) for s in count]))
                              for count in n_counter_descriptors]
@@ -59,4 +153,3 @@ def generate_n_and_k_counters(max_order, species, central_symbols_prefix="M_", r
         n_counter += [Moment(c, s) for c,s in zip(n_counter_descriptors, n_counter_symbols)]
 
         return n_counter, k_counter
-
@@ -6,16 +6,19 @@ This part of the package provides functions to extend the functionality of sympy
 or to make MEANS compatible with different versions of sympy.
 """
 
+import multiprocessing
 import sympy
 from sympy.core.sympify import SympifyError
 import numpy as np
 
 
-def substitute_all(sp_object, pairs):
+def substitute_all(sp_object, pairs, number_of_processes=1):
     """
     Performs multiple substitutions in an expression
     :param expr: a sympy matrix or expression
     :param pairs: a list of pairs (a,b) where each a_i is to be substituted with b_i
+    :param number_of_processes: if set to more than 1, and `sp_object` is a matrix,
+                                its elements are substituted in parallel
     :return: the substituted expression
     """
     if not isinstance(pairs, dict):
@@ -25,6 +28,20 @@ def substitute_all(sp_object, pairs):
 
     # we recurse if the object was a matrix so we apply substitution to all elements
     if isinstance(sp_object, sympy.Matrix):
+        if number_of_processes > 1:
+            p = multiprocessing.Pool(number_of_processes, initializer=_substitution_pool_initialiser,
+                                     initargs=[dict_pairs])
+            try:
+                elements = p.map(_substitute_all_in_process, list(sp_object), chunksize=1)
+                p.close()
+            except:
+                # Do not leave the processes behind if any of the substitutions failed
+                p.terminate()
+                raise
+            finally:
+                p.join()
+            return sympy.Matrix(sp_object.rows, sp_object.cols, elements)
+
         return sp_object.applyfunc(lambda x: substitute_all(x, dict_pairs))
 
     try:
@@ -38,6 +55,99 @@ def substitute_all(sp_object, pairs):
         expr = expr.doit()
     return expr
 
+def _substitution_pool_initialiser(pairs):
+    global process_substitution_pairs
+    process_substitution_pairs = pairs
+
+def _substitute_all_in_process(expression):
+    """
+    Used in `substitute_all`.
+    Needs to be in global scope for multiprocessing module to pick it up
+    """
+    return substitute_all(expression, process_substitution_pairs)
+
+def cached_xreplace(sp_object, substitutions, cache=None):
+    """
+    Replaces the symbols in `substitutions` in an expression or in all the elements of a matrix,
+    as :meth:`sympy.Basic.xreplace` does.
+    The result of the replacement in each of the sub-expressions is kept in `cache`,
+    so that sub-expressions shared between expressions (e.g. between the elements of a matrix) are only
+    traversed once.
+
+    :param sp_object: a sympy matrix or expression
+    :param substitutions: a dictionary {a_i: b_i} where each a_i is to be replaced with b_i.
+                          The b_i are not replaced again, see :func:`resolve_substitutions`
+    :param cache: a dictionary {sub-expression: replaced sub-expression}, to share between calls with the same
+                  `substitutions` (and only with them)
+    :return: the replaced expression or matrix
+    """
+    if cache is None:
+        cache = {}
+
+    def replace(expression):
+        if expression in substitutions:
+            return substitutions[expression]
+        args = getattr(expression, 'args', ())
+        if not args:
+            return expression
+        try:
+            return cache[expression]
+        except KeyError:
+            pass
+
+        new_args = [replace(arg) for arg in args]
+        if any(new_arg is not arg for new_arg, arg in zip(new_args, args)):
+            result = expression.func(*new_args)
+        else:
+            result = expression
+        cache[expression] = result
+        return result
+
+    if isinstance(sp_object, sympy.Matrix):
+        return sp_object.applyfunc(replace)
+    return replace(sp_object)
+
+def resolve_substitutions(pairs):
+    """
+    Resolves a list of substitutions whose expressions can refer to the symbols of other substitutions.
+    For instance, the pairs :math:`x_1 = 1; x_2 = 2 + x_1; x_3 = x_2 * x_1` are resolved to
+    :math:`x_1 = 1; x_2 = 2 + 1; x_3 = (2 + 1) * 1`.
+
+    The substitutions are resolved in order of their dependencies, so that each of the expressions
+    is traversed exactly once, and the already resolved expressions are reused.
+
+    :param pairs: a list of pairs (a,b) where each a_i is to be substituted with b_i
+    :return: a dictionary {a_i: b_i} in which none of the b_i contains any of the a_i
+    :rtype: dict
+    :raise ValueError: if the substitutions depend on each other circularly
+    """
+    definitions = dict(pairs)
+    resolved = {}
+    in_progress = set()
+
+    def resolve(symbol):
+        try:
+            return resolved[symbol]
+        except KeyError:
+            pass
+        if symbol in in_progress:
+            raise ValueError('Circular substitution for {0!r}'.format(symbol))
+        in_progress.add(symbol)
+
+        expression = sympy.sympify(definitions[symbol])
+        dependencies = [s for s in expression.free_symbols if s in definitions]
+        if dependencies:
+            expression = expression.xreplace(dict([(s, resolve(s)) for s in dependencies]))
+
+        in_progress.remove(symbol)
+        resolved[symbol] = expression
+        return expression
+
+    for symbol in definitions:
+        resolve(symbol)
+
+    return resolved
+
 def quick_solve(expr, var):
         r"""
         A function that tries to solve a very simple equation in the quickest way.
@@ -56,7 +56,7 @@ setup(
         "numpy>=1.6.1",
         "sympy>=0.7.5",
         "matplotlib>=1.1.0",
-        "scipy>=0.10.1",
+        "scipy>=1.0",
         "PyYAML>=3.10",
         "Assimulo>=2.5.1",
     ],